@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Memory use of the postprocess entities.
+
+Builds events the way RawInputSource does, as entities.Event with a
+dictionary of TimeMeasurement objects and as entities.CompactEvent,
+and reports the bytes per event: the sizes of all the objects the
+events hold, an object shared by all of them (the machine and file
+names, ...) counted once. Also reports the time to build and to sort
+the events, and the bytes per event once the timestamp filter has
+added the ns timestamp.
+
+The datastreams package (examples/kusp/subsystems/datastreams) has to
+be installed, or on the PYTHONPATH with the pykusp it depends on.
+
+Usage: bench_entity_size.py [number-of-events]
+"""
+import sys
+import time
+import struct
+
+from datastreams.postprocess import entities
+
+MACHINE = 'benchhost'
+FILENAME = 'cpu0.bin'
+
+
+def records(num_events):
+    """
+    Event records as RawInputSource decodes them.
+    """
+    for i in xrange(num_events):
+        yield struct.unpack("QIIIIi", struct.pack("QIIIIi", 5000000000 + 1000 * i,
+                                                  i, 42, i % 7, 1, 0))
+
+
+def make_events(num_events):
+    events = []
+    for tsc, seq, aid, tag, pid, datalen in records(num_events):
+        timeval = {
+            "tsc" : entities.TimeMeasurement("tsc", tsc, MACHINE, 0, 0),
+            "sequence" : entities.TimeMeasurement("sequence", seq, FILENAME, 0, 0)
+        }
+        events.append(entities.Event(long(aid), timeval, tag, None, pid))
+    return events
+
+
+def make_compact_events(num_events):
+    clocks = (intern(MACHINE), intern(FILENAME))
+    events = []
+    for tsc, seq, aid, tag, pid, datalen in records(num_events):
+        events.append(entities.CompactEvent(aid, tsc, seq, clocks, tag, None, pid))
+    return events
+
+
+def add_ns(events):
+    for event in events:
+        event.add_time_object("log", "ns", entities.TimeMeasurement(
+            "ns", event.get_tsc() / 3, "global", 0, 0))
+
+
+def deep_size(objects):
+    """
+    The bytes of *objects* and of all the objects they hold, each one
+    counted once.
+    """
+    seen = {}
+    size = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen[id(obj)] = obj
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        if hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for cls in type(obj).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if hasattr(obj, name):
+                    stack.append(getattr(obj, name))
+    return size
+
+
+def main():
+    num_events = 200000
+    if len(sys.argv) > 1:
+        num_events = int(sys.argv[1])
+
+    print '%d events' % num_events
+    print
+    print '%-14s %10s %12s %10s %14s' % ('entity', 'bytes', 'build (ms)', 'sort (ms)',
+                                       'bytes with ns')
+    for name, make in [('Event', make_events), ('CompactEvent', make_compact_events)]:
+        start_time = time.time()
+        events = make(num_events)
+        build_time = time.time() - start_time
+
+        # the container is not part of the cost of an event
+        size = deep_size(events) - sys.getsizeof(events)
+
+        start_time = time.time()
+        events.sort(key=lambda e: e.get_log_time("tsc"))
+        sort_time = time.time() - start_time
+
+        add_ns(events)
+        size_ns = deep_size(events) - sys.getsizeof(events)
+        print '%-14s %10.1f %12.1f %10.1f %14.1f' % (name, float(size) / num_events,
+                                                    1000 * build_time, 1000 * sort_time,
+                                                    float(size_ns) / num_events)
+        del events
+
+
+if __name__ == '__main__':
+    main()
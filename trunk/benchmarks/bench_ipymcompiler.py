@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Benchmark of the build file compiler on large synthetic build files.
+
+Reports the time to build the lexer with and without the cached lexer
+tables, and the time to tokenize and translate build files of a
+growing number of targets. The translation should grow linearly with
+the size of the build file.
+
+Usage: bench_ipymcompiler.py [largest-number-of-targets]
+"""
+import sys
+import os
+import time
+import tempfile
+
+import ply.lex as lex
+import ipymake.ipymcompiler as ipymc
+
+
+def synthetic_build_file(num_targets):
+    """
+    The text of a build file with *num_targets* targets, each one
+    depending on the one before it.
+    """
+    lines = ['import os', 'import sys', '',
+             'CFLAGS = "-O2 -Wall"', 'SOURCES = ["a.c", "b.c"]', '']
+    for i in range(num_targets):
+        deps = ''
+        if i:
+            deps = ' target_%d' % (i - 1)
+        lines.append('target_%d:%s' % (i, deps))
+        lines.append('    # step %d' % i)
+        lines.append('    value = %d * 2' % i)
+        lines.append('    print "building", value, CFLAGS')
+        lines.append('    pass')
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def best_of(repeat, function, *args):
+    best = None
+    for i in range(repeat):
+        start_time = time.time()
+        function(*args)
+        elapsed = time.time() - start_time
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def build_lexer(optimize=1):
+    ipymc.BuildLanguageLexer().build(optimize=optimize, errorlog=lex.NullLogger())
+
+
+def translate(filename):
+    ipymc.BuildLanguageParser(filename).parse()
+
+
+def main():
+    largest = 8000
+    if len(sys.argv) > 1:
+        largest = int(sys.argv[1])
+
+    print 'lexer build, validated rules : %8.2f ms' % \
+        (1000 * best_of(5, build_lexer, 0))
+    print 'lexer build, cached tables   : %8.2f ms' % \
+        (1000 * best_of(5, build_lexer))
+    print
+
+    print '%8s %8s %10s %12s' % ('targets', 'lines', 'time (ms)', 'us per line')
+    num_targets = max(1, largest / 8)
+    while num_targets <= largest:
+        text = synthetic_build_file(num_targets)
+        fd, filename = tempfile.mkstemp(suffix='.py')
+        try:
+            os.write(fd, text)
+            os.close(fd)
+            elapsed = best_of(3, translate, filename)
+        finally:
+            os.remove(filename)
+        num_lines = text.count('\n')
+        print '%8d %8d %10.1f %12.2f' % (num_targets, num_lines, 1000 * elapsed,
+                                        1e6 * elapsed / num_lines)
+        num_targets *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Benchmark of reading the event records of raw DSKI/DSUI files.
+
+Writes a synthetic raw file and reports the events per second of the
+per record reader that RawInputSource used before (a tell, a read and
+a struct.unpack per record, another read for the extra data) and of
+the block oriented rawfile.RecordReader, reading blocks and mapping
+the file into memory. Only the decoding of the records is measured,
+building the entities from them costs the same for every reader.
+
+The datastreams package (examples/kusp/subsystems/datastreams) has to
+be on the PYTHONPATH.
+
+Usage: bench_raw_input.py [number-of-events]
+"""
+import sys
+import os
+import time
+import struct
+import tempfile
+
+from datastreams.postprocess import rawfile
+
+FILE_HEADER_FORMAT = "IIIIII80s"
+
+
+def write_raw_file(filename, num_events):
+    """
+    Write a raw file of *num_events* events, every fourth one with 8
+    bytes of extra data.
+    """
+    outfile = open(filename, 'wb')
+    try:
+        outfile.write(struct.pack(FILE_HEADER_FORMAT, 0x1abcdef1, 4, 8, 2, 8, 8,
+                                  'benchhost'))
+        for i in range(num_events):
+            if i % 4:
+                outfile.write(struct.pack("QIIIIi", 1000 * i, i, 42, 0, 1, 0))
+            else:
+                outfile.write(struct.pack("QIIIIi", 1000 * i, i, 42, 0, 1, 8))
+                outfile.write(struct.pack("Q", i))
+    finally:
+        outfile.close()
+
+
+def read_per_record(filename):
+    infile = open(filename, 'rb')
+    try:
+        infile.read(struct.calcsize(FILE_HEADER_FORMAT))
+        fmt = "QIIIIi"
+        size = struct.calcsize(fmt)
+        records = []
+        while True:
+            position = infile.tell()
+            event_binary = infile.read(size)
+            if len(event_binary) < size:
+                break
+            tsc, seq, aid, tag, pid, datalen = struct.unpack(fmt, event_binary)
+            extra_data = None
+            if datalen > 0:
+                position = infile.tell()
+                extra_data = infile.read(datalen)
+            records.append((tsc, seq, aid, tag, pid, datalen, extra_data))
+        return records
+    finally:
+        infile.close()
+
+
+def read_blocks(filename, use_mmap):
+    infile = open(filename, 'rb')
+    try:
+        reader = rawfile.RecordReader(infile, struct.calcsize(FILE_HEADER_FORMAT),
+                                      use_mmap=use_mmap)
+        records = list(reader.records())
+        reader.close()
+        return records
+    finally:
+        infile.close()
+
+
+def best_of(repeat, function, *args):
+    best = None
+    for i in range(repeat):
+        start_time = time.time()
+        result = function(*args)
+        elapsed = time.time() - start_time
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main():
+    num_events = 1000000
+    if len(sys.argv) > 1:
+        num_events = int(sys.argv[1])
+
+    fd, filename = tempfile.mkstemp(suffix='.bin')
+    os.close(fd)
+    try:
+        write_raw_file(filename, num_events)
+        print '%d events, %d bytes' % (num_events, os.path.getsize(filename))
+        print
+
+        print '%-22s %10s %14s %8s' % ('reader', 'time (ms)', 'events/s', 'speedup')
+        expected = None
+        baseline = None
+        for name, function, args in [('per record read', read_per_record, ()),
+                                     ('RecordReader blocks', read_blocks, (False,)),
+                                     ('RecordReader mmap', read_blocks, (True,))]:
+            elapsed, records = best_of(3, function, filename, *args)
+            if expected is None:
+                expected = records
+                baseline = elapsed
+            elif records != expected:
+                print '%s decoded different records!' % name
+                sys.exit(1)
+            print '%-22s %10.1f %14.0f %7.2fx' % (name, 1000 * elapsed,
+                                                 num_events / elapsed,
+                                                 baseline / elapsed)
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,7 @@ dsui:
     build_subdir('dsui','build_dsui.py')
     pass
 
-swig_setup:
+swig_setup: < pydsui_backend.i > pydsui_backend_wrap.c pydsui_backend.py
     ~swig -python pydsui_backend.i
     pass
 
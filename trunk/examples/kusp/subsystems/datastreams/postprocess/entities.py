@@ -12,6 +12,14 @@ def get_zero_timedict():
 
 
 
+# the units of the log time entities are compared by, in order of
+# preference. see Entity.__cmp__ and Entity.get_sort_time
+SORT_UNITS = ["ns", "tsc", "sequence"]
+
+# the sort time of the entities with a generated timestamp
+GENERATED_SORT_TIME = (None, -1)
+NS_CLOCK = ("ns", "global")
+
 class TimeMeasurement:
 	"""represents a specific time measurement"""
 	def __init__(self, units, value, clocksource, low_err, high_err):
@@ -131,6 +139,9 @@ class Entity(PipelineItem):
 	def get_times(self):
 		return self.time
 
+	def get_time_types(self):
+		return self.time.keys()
+
 	# three convenience methods
 	def get_log_time(self, units=None):
 		if not units:
@@ -150,6 +161,25 @@ class Entity(PipelineItem):
 	def get_nanoseconds(self):
 		return self.time["log"]["ns"].get_value()
 
+	def get_sort_time(self):
+		"""tuple(clock, value) of the first of the ns timestamp, the tsc
+		and the sequence number the entity has, the clock being the
+		tuple(units, clock source) of it. GENERATED_SORT_TIME for a
+		generated timestamp, which goes before any other.
+
+		entities with the same clock are in the order __cmp__ gives when
+		ordered by value. that is not so for entities with different
+		clocks, __cmp__ compares those by another unit they both have,
+		if any (see HeadFilter.next_source)."""
+		td = self.get_log_time()
+		for u in SORT_UNITS:
+			if u in td and td[u].get_clocksource() == "generated":
+				return GENERATED_SORT_TIME
+		for u in SORT_UNITS:
+			if u in td:
+				return ((u, td[u].get_clocksource()), td[u].get_value())
+		return GENERATED_SORT_TIME
+
 
 	# these values are looked up in the entity definition
 	def get_name(self):
@@ -299,6 +329,202 @@ class InternalEvent(Entity):
 		n.time = self.time
 		return n
 
+def _event_method(name):
+	"""the function of an Event method, to share it with CompactEvent"""
+	return getattr(Event, name).im_func
+
+class CompactEvent(object):
+	"""an Event that takes a fraction of the memory, for the events read
+	from raw files. it has no instance dictionary, and its log time is kept
+	as plain integers: the tsc, the sequence number and, once it has been
+	computed, the ns timestamp. the clock sources are the (machine, file)
+	tuple shared by all the events of an input stream.
+
+	the time dictionary of TimeMeasurement objects is only built when
+	something asks for it (get_times(), get_time_dict(), a time object
+	other than the log tsc, sequence or ns...). from then on it is the
+	one holding the times, like for any other Event.
+
+	it has the methods of an Event, but is not an instance of one: a
+	class with __slots__ only does without an instance dictionary if it
+	is a new style class with no old style base classes.
+
+	only events are made compact. counters, intervals and histograms
+	are built from a few administrative events, and there are too few
+	of them for their size to matter."""
+
+	# the namespace is not shared by the events of a stream like the
+	# clocks are: the input source gives them its local namespace, the
+	# head filter the one of the pipeline once it has renumbered their
+	# cid, and clear_cache() drops it before they are pickled. events of
+	# the same stream hold different ones on the way
+	__slots__ = ["cid", "pid", "tag", "extra_data", "namespace",
+			"tsc", "seq", "ns", "clocks", "_time"]
+
+	message = 0
+
+	def __init__(self, cid, tsc, seq, clocks, tag, extra_data, pid=0):
+		if type(cid) is not long:
+			cid = long(cid)
+		self.cid = cid
+		self.pid = pid
+		self.tag = tag
+		self.extra_data = extra_data
+		self.namespace = None
+		self.tsc = tsc
+		self.seq = seq
+		self.ns = None
+		self.clocks = clocks
+		self._time = None
+
+	def __cmp__(self, other):
+		if self._time is not None or not isinstance(other, CompactEvent) or \
+				other._time is not None:
+			return Entity.__cmp__.im_func(self, other)
+
+		# the same comparison as Entity.__cmp__, without the time dicts
+		if self.ns is not None and other.ns is not None:
+			return cmp(self.ns, other.ns)
+		if self.clocks[0] == "generated":
+			return -1
+		if other.clocks[0] == "generated":
+			return 1
+		if self.clocks[0] == other.clocks[0]:
+			return cmp(self.tsc, other.tsc)
+		if self.clocks[1] == other.clocks[1]:
+			return cmp(self.seq, other.seq)
+		return 0
+
+	def __getstate__(self):
+		# the namespace is not serialized
+		return (self.cid, self.pid, self.tag, self.extra_data,
+			self.tsc, self.seq, self.ns, self.clocks, self._time)
+
+	def __setstate__(self, state):
+		(self.cid, self.pid, self.tag, self.extra_data,
+			self.tsc, self.seq, self.ns, self.clocks, self._time) = state
+		self.namespace = None
+
+	def get_time_dict(self):
+		if self._time is None:
+			machine, stream = self.clocks
+			log = {
+				"tsc" : TimeMeasurement("tsc", self.tsc, machine, 0, 0),
+				"sequence" : TimeMeasurement("sequence", self.seq,
+					stream, 0, 0)
+			}
+			if self.ns is not None:
+				log["ns"] = TimeMeasurement("ns", self.ns, "global", 0, 0)
+			self._time = {"log" : log}
+		return self._time
+
+	def set_time_dict(self, time):
+		self._time = time
+
+	time = property(get_time_dict, set_time_dict)
+
+	get_times = get_time_dict
+
+	def get_time_types(self):
+		if self._time is None:
+			return ["log"]
+		return self._time.keys()
+
+	def has_time_object(self, timetype, units):
+		if self._time is None:
+			return timetype == "log" and (units != "ns" or
+				self.ns is not None)
+		return timetype in self._time and units in self._time[timetype]
+
+	def get_time_object(self, timetype, units):
+		if self._time is None and timetype == "log":
+			# a measurement of its own, not kept by the event
+			if units == "tsc":
+				return TimeMeasurement("tsc", self.tsc, self.clocks[0], 0, 0)
+			if units == "sequence":
+				return TimeMeasurement("sequence", self.seq,
+					self.clocks[1], 0, 0)
+			if units == "ns" and self.ns is not None:
+				return TimeMeasurement("ns", self.ns, "global", 0, 0)
+		return self.time[timetype][units]
+
+	def add_time_object(self, timetype, units, obj):
+		if (self._time is None and timetype == "log" and units == "ns" and
+				obj.get_clocksource() == "global" and
+				obj.get_low_err() == 0 and obj.get_high_err() == 0):
+			self.ns = obj.get_value()
+			return
+		time = self.time
+		if timetype not in time:
+			time[timetype] = {}
+		time[timetype][units] = obj
+
+	def get_log_time(self, units=None):
+		if units and self._time is None:
+			if units == "tsc":
+				return self.tsc
+			if units == "sequence":
+				return self.seq
+			if units == "ns" and self.ns is not None:
+				return self.ns
+		if not units:
+			return self.time["log"]
+		return self.time["log"][units].get_value()
+
+	def get_tsc(self):
+		return self.get_log_time("tsc")
+
+	def get_sequence(self):
+		return self.get_log_time("sequence")
+
+	def get_nanoseconds(self):
+		return self.get_log_time("ns")
+
+	def get_machine(self):
+		if self._time is None:
+			return self.clocks[0]
+		return self._time["log"]["tsc"].get_clocksource()
+
+	def get_sort_time(self):
+		if self._time is None:
+			if self.clocks[0] == "generated" or self.clocks[1] == "generated":
+				return GENERATED_SORT_TIME
+			if self.ns is not None:
+				return (NS_CLOCK, self.ns)
+			return (("tsc", self.clocks[0]), self.tsc)
+		return Entity.get_sort_time.im_func(self)
+
+	def copy(self, cid, tag, extra_data):
+		n = CompactEvent(cid, self.tsc, self.seq, self.clocks, tag,
+			extra_data, self.pid)
+		n.ns = self.ns
+		n._time = self._time
+		return n
+
+	def change_tag(self, new_tag):
+		return self.copy(self.cid, new_tag, self.extra_data)
+
+	def change_cid(self, new_cid):
+		return self.copy(new_cid, self.tag, self.extra_data)
+
+	def change_extra_data(self, new_extra_data):
+		return self.copy(self.cid, self.tag, new_extra_data)
+
+	# the rest is the same as for an Event
+	__repr__ = _event_method("__repr__")
+	get_pid = _event_method("get_pid")
+	get_cid = _event_method("get_cid")
+	get_type = _event_method("get_type")
+	get_tag = _event_method("get_tag")
+	get_extra_data = _event_method("get_extra_data")
+	get_edf_name = _event_method("get_edf_name")
+	get_name = _event_method("get_name")
+	get_description = _event_method("get_description")
+	get_family_name = _event_method("get_family_name")
+	is_admin = _event_method("is_admin")
+	set_namespace = _event_method("set_namespace")
+	clear_cache = _event_method("clear_cache")
+
 class Counter(Entity):
 	def __init__(self, cid, logtime, count, first_update, last_update, pid=0):
 		Entity.__init__(self, cid, logtime, pid)
@@ -8,42 +8,114 @@ import sys
 import imp
 import zlib
 import operator
+import collections
 import syscall
 
 from ppexcept import *
 
+# the header of a DATA_CHUNK event: sequence number and composite id of
+# the event the extra data belongs to, chunk number, total length of the
+# extra data, length of this chunk
+chunk_header = struct.Struct("IIIII")
+
+# extra data still waiting for chunks is dropped, oldest first, once
+# this many bytes of it are held
+MAX_PENDING_BYTES = 64 * 1024 * 1024
+
 class ExtraDataDecoder:
-	def __init__(self, modnames=[]):
+	def __init__(self, modnames=[], max_pending=MAX_PENDING_BYTES):
 		selfmod = sys.modules[__name__]
 		self.mdict = copy.copy(selfmod.__dict__)
 
+		# complete and incomplete extra data, by (cid, seq) of its event
 		self.data_cache = {}
 		self.inc_data_cache = {}
 
+		# keys of inc_data_cache, oldest first. keys that have been
+		# completed since are skipped, and pruned now and then
+		self.inc_order = collections.deque()
+		self.pending_bytes = 0
+		self.max_pending = max_pending
+
+		# extra data that was dropped, by (cid, seq), as a list of the
+		# total length, the bytes received and whether its event has
+		# been handed on without it. the later chunks of it are skipped,
+		# the entry is forgotten once they are all in and its event is
+		# gone (see claim_dropped)
+		self.dropped = {}
+		self.dropped_count = 0
+
 		for modname in modnames:
 			self.add_local_module(modname)
 
 	def decode_chunk(self, binary):
-		format = "IIIII"
-		fsize = struct.calcsize(format)
-
-		edcbin = binary[:fsize]
-		data = binary[fsize:]
+		"""add a chunk of extra data. returns the list of (cid, seq) keys
+		of the extra data the chunk completed or got dropped, the events
+		waiting for those get it, or go on without it"""
+		z = chunk_header.unpack_from(binary)
+		data = binary[chunk_header.size:]
 
-		z = struct.unpack(format, edcbin)
 		owner_seq, owner_cid, seq, total_len, data_len = z
 		key = (owner_cid, owner_seq)
-		if key not in self.inc_data_cache:
+		drop = self.dropped.get(key)
+		if drop is not None:
+			drop[1] = drop[1] + data_len
+			self.forget_dropped(key)
+			return []
+
+		val = self.inc_data_cache.get(key)
+		if val is None:
 			val = {"length" : total_len, "chunks" : [], "recvd" : 0}
 			self.inc_data_cache[key] = val
-		else:
-			val = self.inc_data_cache[key]
+			self.inc_order.append(key)
 
 		val["chunks"].append((seq, data))
 		val["recvd"] = val["recvd"] + data_len
+		self.pending_bytes = self.pending_bytes + data_len
+
 		if val["recvd"] == val["length"]:
 			del self.inc_data_cache[key]
+			self.pending_bytes = self.pending_bytes - val["recvd"]
 			self.data_cache[key] = val
+			if len(self.inc_order) > 2 * len(self.inc_data_cache) + 64:
+				self.inc_order = collections.deque([k for k in self.inc_order
+					if k in self.inc_data_cache])
+			return [key]
+
+		if self.pending_bytes > self.max_pending:
+			return self.drop_pending()
+		return []
+
+	def drop_pending(self):
+		"""drop the oldest incomplete extra data until the rest fits in
+		the memory limit. returns the keys dropped"""
+		keys = []
+		while self.pending_bytes > self.max_pending and self.inc_order:
+			key = self.inc_order.popleft()
+			val = self.inc_data_cache.pop(key, None)
+			if val is None:
+				continue
+			self.pending_bytes = self.pending_bytes - val["recvd"]
+			self.dropped[key] = [val["length"], val["recvd"], False]
+			self.dropped_count = self.dropped_count + 1
+			keys.append(key)
+		return keys
+
+	def claim_dropped(self, cid, seq):
+		"""the event of (cid, seq) is handed on without its extra data if
+		that was dropped, returns whether it was"""
+		key = (cid, seq)
+		drop = self.dropped.get(key)
+		if drop is None:
+			return False
+		drop[2] = True
+		self.forget_dropped(key)
+		return True
+
+	def forget_dropped(self, key):
+		length, recvd, claimed = self.dropped[key]
+		if claimed and recvd >= length:
+			del self.dropped[key]
 
 
 	def decode(self, edfname, binary):
@@ -58,26 +130,48 @@ class ExtraDataDecoder:
 
 
 	def get_cached_data(self, cid, seq):
-		d = self.data_cache[(cid, seq)]
-		del self.data_cache[(cid, seq)]
-
-
- 		length = d["length"]
- 		chunks = d["chunks"]
- 		# sort by first element, the sequence number
- 		chunks = sorted(chunks, key=operator.itemgetter(0))
- 
-  		r = ""
- 		for seq, data in chunks:
- 			r = r + data
- 			length = length - len(data)
- 
- 		if length != 0:
- 			return None
+		d = self.data_cache.pop((cid, seq))
+
+		# sort by first element, the sequence number
+		chunks = d["chunks"]
+		chunks.sort(key=operator.itemgetter(0))
+		r = "".join([data for seq, data in chunks])
+
+		if len(r) != d["length"]:
+			return None
 		return r
 
 	def has_cached_data(self, cid, seq):
-		return (cid, seq) in self.data_cache.keys()
+		return (cid, seq) in self.data_cache
+
+	def report(self, limit=10):
+		"""lines describing the extra data that never made it to its
+		event: incomplete, dropped or never claimed. at most limit
+		of each are listed"""
+		lines = []
+		incomplete = [(key, val["recvd"], val["length"])
+			for key, val in self.inc_data_cache.iteritems()]
+		dropped = [(key, None, drop[0])
+			for key, drop in self.dropped.iteritems()]
+		unclaimed = [(key, val["recvd"], val["length"])
+			for key, val in self.data_cache.iteritems()]
+
+		for title, count, entries in [
+				("incomplete", len(incomplete), incomplete),
+				("dropped over the memory limit", self.dropped_count, dropped),
+				("never claimed by an event", len(unclaimed), unclaimed)]:
+			if not count:
+				continue
+			lines.append(`count`+" extra data "+title)
+			entries.sort()
+			for (cid, seq), recvd, length in entries[:limit]:
+				if recvd is None:
+					lines.append("  cid %d seq %d: %d bytes" %
+						(cid, seq, length))
+				else:
+					lines.append("  cid %d seq %d: %d of %d bytes" %
+						(cid, seq, recvd, length))
+		return lines
 
 	def add_local_module(self, modname):
 		try:
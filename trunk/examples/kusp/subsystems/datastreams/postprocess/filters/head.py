@@ -29,10 +29,6 @@ class PostprocessSocketListener(threading.Thread):
 				self.headfilter.params["extra_data"],
 				infile = conn.makefile("r"))
 		self.headfilter.add_input_source(inp)
-		self.headfilter.lock.acquire()
-		e = self.headfilter.fetch(name)
-		self.headfilter.next_entity[name] = e
-		self.headfilter.lock.release()
 
 
 	def run(self):
@@ -124,20 +120,6 @@ class input(HeadFilter):
 
 	
 
-	def choose_next(self, entitydict):
-		sourceids = entitydict.keys()
-		min_sourceid = sourceids[0]
-		min_time = entitydict[min_sourceid]
-		min_sourceid = sourceids[0]
-
-		for i in range(1, len(sourceids)):
-			sourceid = sourceids[i]
-			entity = entitydict[sourceid]
-			if entity < min_time:
-				min_time = entity
-				min_sourceid = sourceid
-		return min_sourceid
-
 	def postprocess(self, entity):
 		if not self.convert:
 			return entity
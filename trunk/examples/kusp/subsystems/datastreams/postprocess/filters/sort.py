@@ -3,6 +3,9 @@
 from datastreams.postprocess import filtering
 from datastreams.postprocess import entities
 from datastreams import namespaces
+import cPickle
+import heapq
+import tempfile
 
 #Only have sort by TSC and Sequence number for now--what else can we sort by
 
@@ -28,11 +31,13 @@ class sort_time(filtering.Filter):
 
 	def finalize(self):
 		#Sort entities by time value
-		self.entities.sort(key=lambda e: e.get_log_time()[self.key].get_value())
+		self.entities.sort(key=lambda e: e.get_log_time(self.key))
 		
-		#Send the sorted entities along the pipeline
+		#Send the sorted entities along the pipeline, popping them off
+		#the end of the list is what keeps this linear
+		self.entities.reverse()
 		while self.entities:
-			self.send(self.entities.pop(0))
+			self.send(self.entities.pop())
 
 	pass
 
@@ -47,12 +52,169 @@ class sort_seq(filtering.Filter):
 	
 	def finalize(self):
 		#Sort entities by sequence number
-	    self.entities.sort(key=lambda e: e.get_time_object("log","sequence").get_value())
+	    self.entities.sort(key=lambda e: e.get_log_time("sequence"))
 	    
 	    #Pass sorted entities along pipeline
+	    self.entities.reverse()
 	    while self.entities:
-	        self.send(self.entities.pop(0))
+	        self.send(self.entities.pop())
 	
 
 
+# entities per pickle of a sorted run. the entities of one pickle share
+# their class and clocks, the memo is cleared between pickles so that
+# it does not hold every entity of the run
+RUN_BLOCK_SIZE = 1000
 
+class external_sort(filtering.Filter):
+	"""Sorts a datastream of any size by time, with bounded memory.
+
+	up to memory_limit entities are sorted in memory. past that, each
+	sorted batch is written to a temporary file as a run, and the runs
+	are merged when the datastream ends.
+
+	with a window, the datastream is taken to be nearly sorted already:
+	an entity is sent as soon as one that is more than window time units
+	later has been received, so no more than the entities of the last
+	window are held. entities that arrive after the window they belong
+	to has been sent can not be put back in order, they are sent
+	immediately and counted."""
+
+	expected_parameters = {
+		"sort_key" : {
+			"types" : "string",
+			"doc" : "Time units to sort by",
+			"default" : "ns"
+		},
+		"memory_limit" : {
+			"types" : "integer",
+			"doc" : "Number of entities to sort in memory before a sorted run is written to disk",
+			"default" : 1000000
+		},
+		"window" : {
+			"types" : "integer",
+			"doc" : "Only reorder entities within this many time units of each other, 0 sorts the whole datastream",
+			"default" : 0
+		},
+		"temp_dir" : {
+			"types" : "string",
+			"doc" : "Directory of the sorted runs, the system temporary directory by default",
+			"default" : ""
+		}
+	}
+
+	process_admin = True
+
+	def initialize(self):
+		self.key = self.params["sort_key"]
+		self.memory_limit = max(1, self.params["memory_limit"])
+		self.window = self.params["window"]
+		self.temp_dir = self.params["temp_dir"] or None
+
+		# tuple(key, serial, entity). the serial number keeps entities
+		# with the same key in the order they were received, and keeps
+		# the entities themselves from ever being compared
+		self.entities = []
+		self.serial = 0
+
+		self.runs = []
+		self.run_entities = 0
+
+		self.latest = None
+		self.sent_key = None
+		self.late = 0
+
+	def process(self, entity):
+		key = entity.get_log_time(self.key)
+		item = (key, self.serial, entity)
+		self.serial = self.serial + 1
+
+		if self.window:
+			self.process_windowed(item)
+			return
+
+		self.entities.append(item)
+		if len(self.entities) >= self.memory_limit:
+			self.write_run()
+
+	def process_windowed(self, item):
+		key = item[0]
+		if self.sent_key is not None and key < self.sent_key:
+			# its window is gone already
+			self.late = self.late + 1
+			self.send(item[2])
+			return
+
+		heapq.heappush(self.entities, item)
+		if self.latest is None or key > self.latest:
+			self.latest = key
+
+		horizon = self.latest - self.window
+		while self.entities and self.entities[0][0] < horizon:
+			self.send_item(heapq.heappop(self.entities))
+
+	def send_item(self, item):
+		self.sent_key = item[0]
+		self.send(item[2])
+
+	def write_run(self):
+		"""write the entities in memory to a new run, in order"""
+		self.entities.sort()
+		run = tempfile.TemporaryFile(prefix="pp_sort", dir=self.temp_dir)
+		pickler = cPickle.Pickler(run, cPickle.HIGHEST_PROTOCOL)
+		for start in range(0, len(self.entities), RUN_BLOCK_SIZE):
+			block = self.entities[start:start + RUN_BLOCK_SIZE]
+			for key, serial, entity in block:
+				# the namespace pointer is restored when the entity is sent
+				entity.clear_cache()
+			pickler.dump(block)
+			pickler.clear_memo()
+		run.flush()
+		run.seek(0)
+
+		self.info("Wrote a sorted run of "+`len(self.entities)`+" entities")
+		self.runs.append(run)
+		self.run_entities = self.run_entities + len(self.entities)
+		self.entities = []
+
+	def read_run(self, run):
+		unpickler = cPickle.Unpickler(run)
+		while True:
+			try:
+				block = unpickler.load()
+			except EOFError:
+				break
+			unpickler.memo = {}
+			for item in block:
+				yield item
+		run.close()
+
+	def finalize(self):
+		if self.window:
+			while self.entities:
+				self.send_item(heapq.heappop(self.entities))
+			if self.late:
+				self.warn(`self.late`+" entities arrived later than the "
+					"sort window and were sent out of order")
+			return
+
+		self.entities.sort()
+		if not self.runs:
+			self.entities.reverse()
+			while self.entities:
+				self.send(self.entities.pop()[2])
+			return
+
+		self.info("Merging "+`len(self.runs)`+" sorted runs of "+
+			`self.run_entities`+" entities")
+		sources = [self.read_run(run) for run in self.runs]
+		sources.append(iter(self.entities))
+		for key, serial, entity in heapq.merge(*sources):
+			self.send(entity)
+		self.entities = []
+		self.runs = []
+
+	def abort(self):
+		for run in self.runs:
+			run.close()
+		self.runs = []
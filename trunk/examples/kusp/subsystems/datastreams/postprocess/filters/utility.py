@@ -31,11 +31,12 @@ class sort(filtering.Filter):
 
 	def finalize(self):
 		self.info("Sorting begins.")
-		self.entities.sort(key=lambda e: e.get_log_time()[self.key].get_value())
+		self.entities.sort(key=lambda e: e.get_log_time(self.key))
 		self.info("Sorting finished.")
 
+		self.entities.reverse()
 		while (self.entities):
-			e = self.entities.pop(0)
+			e = self.entities.pop()
 			self.send(e)
 
 
@@ -172,22 +173,24 @@ class timestamp(filtering.Filter):
 		if machine not in self.clockinfo:
 			self.send(entity)
 
-		# convert timestamps to nanoseconds
-		for timetype in entity.get_times().values():
+		# convert timestamps to nanoseconds. this goes through the
+		# time object methods so that compact events stay compact
+		for timetype in entity.get_time_types():
 			# FIXME: should 'ns' be hard-coded?
-			if self.redo_clock or "ns" not in timetype:
+			if self.redo_clock or not entity.has_time_object(timetype, "ns"):
 				# TODO: add uncertainty to converted timestamps
 				#       refactor tsc-based histograms
 
-				tsc = timetype["tsc"].get_value()
+				tsc = entity.get_time_object(timetype, "tsc").get_value()
 				offset_tsc = tsc - self.clockinfo[machine]["tsc"]
 				offset_nsecs = ((offset_tsc * 
 						self.clockinfo[machine]["mult"]) 
 						>> self.clockinfo[machine]["shift"])
-				timetype["ns"] = entities.TimeMeasurement(
+				entity.add_time_object(timetype, "ns",
+						entities.TimeMeasurement(
 						"ns", self.clockinfo[machine]["nsecs"] + 
 						long(offset_nsecs),
-						"global", 0, 0)
+						"global", 0, 0))
 
 		self.send(entity)
 
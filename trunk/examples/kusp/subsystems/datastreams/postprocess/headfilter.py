@@ -5,6 +5,7 @@ import time
 import inputs
 import copy
 import sys
+import heapq
 
 class HeadFilter(filtering.Filter):
 	"""this is the first filter in a pipeline, and has an execution loop
@@ -12,15 +13,16 @@ class HeadFilter(filtering.Filter):
 
 	#debug_flag = True
 
-	def choose_next(self, entitydict):
-		"""entitydict is a mapping from source ids (which can be used to 
-		reference source objects in self.sources) to the next available entity
-		for that source.
+	def sort_key(self, entity):
+		"""returns the tuple(clock, value) the entities of all the sources
+		are merged by, see Entity.get_sort_time. it is computed once for
+		every entity, when it is read from its source.
 
-		this function examines these entities and returns the source id of the
-		source to obtain the next event."""
-
-		raise Exception("Abstract Method")
+		while the next entities of all the sources have the same clock
+		(or a generated timestamp, which goes first), the one with the
+		smallest value is sent next. that is the order Entity.__cmp__
+		gives them, see next_source for the others."""
+		return entity.get_sort_time()
 
 	def preprocess(self, entity):
 		"""any processing that needs to be done to an entity BEFORE a decision
@@ -55,10 +57,25 @@ class HeadFilter(filtering.Filter):
 		# is not present in this dictionary, it will be unmodified.
 		self.remapping = {}
 
-		# This dictionary maps input source names to the next available
-		# entity for that input source
-		self.next_entity = {}
-
+		# a heap of the next available entity of every input source, as
+		# tuple(sort value, serial, source name, entity). the serial number
+		# keeps entities with the same value in the order they were read
+		self.merge_heap = []
+		self.serial = 0
+
+		# the clock of the entity of every source in the heap, and the
+		# number of entities in the heap with each clock. generated
+		# timestamps have none
+		self.head_clocks = {}
+		self.clock_counts = {}
+		self.mixed_clocks_warned = False
+
+		# names of the input sources added since run() last looked, run()
+		# reads their first entity and adds them to the merge
+		self.new_sources = []
+
+		# only guards the control paths, adding sources and stopping.
+		# merging the entities is done by run() alone
 		self.lock = thread.allocate_lock()
 
 		self.terminate_flag = False
@@ -83,30 +100,24 @@ class HeadFilter(filtering.Filter):
 
 		self.nsevent = self.namespace["DSTREAM_ADMIN_FAM/NAMESPACE"].get_id()
 
-		# build the next_entity dictionary
-		self.lock.acquire()
-		for sourceid, source in self.sources.iteritems():
-			entity = self.fetch(sourceid)
-			if entity.message == entities.PIPELINE_EOF:
-				self.sources[sourceid].close()
-			else:
-				self.next_entity[sourceid] = entity
-		self.lock.release()
-
-
+		heap = self.merge_heap
 
 		# iterate, sending the earliest event down the pipeline,
 		# until there are no more events
 		while(True):
-			self.lock.acquire()
-			if self.terminate_flag or not self.next_entity:
-				self.lock.release()
+			if self.terminate_flag:
+				break
+
+			if self.new_sources:
+				self.merge_new_sources()
+
+			if not heap:
 				break
 
-			min_sourceid = self.choose_next(self.next_entity)
+			i = self.next_source()
+			value, serial, sourceid, ne = heap[i]
 			
 			try:
-				ne = self.next_entity[min_sourceid]
 				ne = self.postprocess(ne)
 				if ne:
 					self.send(ne)
@@ -116,20 +127,109 @@ class HeadFilter(filtering.Filter):
 				self.send(entities.PipelineError())
 				raise
 			
-			nextent = self.fetch(min_sourceid)
+			nextent = self.fetch(sourceid)
+			self.forget_head(sourceid)
 
 			if nextent.message == entities.PIPELINE_EOF:
-				self.info("Finished reading data from source "+`min_sourceid`)
-				self.sources[min_sourceid].close()
-				del self.sources[min_sourceid]
-				del self.next_entity[min_sourceid]
+				self.info("Finished reading data from source "+`sourceid`)
+				if i == 0:
+					heapq.heappop(heap)
+				else:
+					heap[i] = heap[-1]
+					heap.pop()
+					heapq.heapify(heap)
+				self.remove_source(sourceid)
+			elif i == 0:
+				heapq.heapreplace(heap, self.merge_entry(sourceid, nextent))
 			else:
-				self.next_entity[min_sourceid] = nextent
-			self.lock.release()
+				heap[i] = self.merge_entry(sourceid, nextent)
+				heapq.heapify(heap)
 		
 		# all done. send a pipelineend message
 		self.send(entities.PipelineEnd())
 
+	def merge_entry(self, sourceid, entity):
+		"""the heap entry of the next entity of a source"""
+		clock, value = self.sort_key(entity)
+		self.head_clocks[sourceid] = clock
+		if clock is not None:
+			self.clock_counts[clock] = self.clock_counts.get(clock, 0) + 1
+		entry = (value, self.serial, sourceid, entity)
+		self.serial = self.serial + 1
+		return entry
+
+	def forget_head(self, sourceid):
+		"""the entity of sourceid is leaving the heap"""
+		clock = self.head_clocks.pop(sourceid)
+		if clock is None:
+			return
+		self.clock_counts[clock] = self.clock_counts[clock] - 1
+		if not self.clock_counts[clock]:
+			del self.clock_counts[clock]
+
+	def next_source(self):
+		"""returns the index in the merge heap of the entity to send next.
+
+		while the entities in the heap have at most one clock, it is the
+		top of the heap. otherwise their values can not be compared, say
+		ns timestamps with the tsc of entities that have no ns timestamp,
+		or the tsc of different machines. the entities are then compared
+		one by one with Entity.__cmp__, which compares two entities by
+		another unit they both have, if any, and the first of the
+		smallest ones is sent. this takes time linear in the number of
+		sources, and the result depends on the order the sources are
+		looked at, which is why a warning is printed the first time."""
+		heap = self.merge_heap
+		if len(self.clock_counts) <= 1:
+			return 0
+
+		if not self.mixed_clocks_warned:
+			self.mixed_clocks_warned = True
+			clocks = [units+"/"+str(source)
+				for units, source in self.clock_counts.keys()]
+			clocks.sort()
+			self.warn("merging entities of different clocks ("+
+				", ".join(clocks)+"), they are compared one by one and "
+				"their order is only partly defined")
+
+		index = {}
+		entitydict = {}
+		for i in range(len(heap)):
+			index[heap[i][2]] = i
+			entitydict[heap[i][2]] = heap[i][3]
+
+		sourceids = entitydict.keys()
+		min_sourceid = sourceids[0]
+		min_time = entitydict[min_sourceid]
+		for sourceid in sourceids[1:]:
+			entity = entitydict[sourceid]
+			if entity < min_time:
+				min_time = entity
+				min_sourceid = sourceid
+		return index[min_sourceid]
+
+	def merge_new_sources(self):
+		"""read the first entity of every source added since the last call,
+		and add the sources to the merge"""
+		self.lock.acquire()
+		sourceids = self.new_sources
+		self.new_sources = []
+		self.lock.release()
+
+		for sourceid in sourceids:
+			entity = self.fetch(sourceid)
+			if entity.message == entities.PIPELINE_EOF:
+				self.remove_source(sourceid)
+			else:
+				heapq.heappush(self.merge_heap,
+					self.merge_entry(sourceid, entity))
+
+	def remove_source(self, sourceid):
+		self.lock.acquire()
+		source = self.sources.pop(sourceid)
+		self.lock.release()
+		source.close()
+
 
 	def add_input_source(self, source):
 		"""add an input source object for this pipeline to read entities from"""
@@ -138,6 +238,7 @@ class HeadFilter(filtering.Filter):
 		self.sources[sourceid] = source
 		self.remapping[sourceid] = {}
 		source.open()
+		self.new_sources.append(sourceid)
 		self.lock.release()
 
 	def establish_connections(self):
@@ -3,11 +3,13 @@ from datastreams import namespaces
 #from datastreams import dsui
 import struct
 import event_data
+import rawfile
 import cPickle
 from ppexcept import *
 import os
 from select import poll, POLLIN
 import time
+import collections
 
 magic_format = "I"
 magic_size = struct.calcsize(magic_format)
@@ -74,24 +76,28 @@ class RawInputSource(InputSource):
         self.intervalevent = self.local_ns["DSTREAM_ADMIN_FAM/EVENT_INTERVAL"].get_id()
         self.ns_frag_event = self.local_ns["DSTREAM_ADMIN_FAM/NAMESPACE_FRAGMENT"].get_id()
         self.chunkevent = self.local_ns["DSTREAM_ADMIN_FAM/DATA_CHUNK"].get_id()
-        self.formats = {
-            "event" : "QIIIIi",
-        }
-        self.sizes = {}
-        for k, v in self.formats.iteritems():
-            self.sizes[k] = struct.calcsize(v)
         self.filename = filename
         self.decoder = event_data.ExtraDataDecoder(local_edf_modules)
         self.header = None
         self.infile = infile
+        self.reader = None
+        self.records = None
         self.position = 0
         self.totalsize = None
-        self.waiting_chunks = []
+        # events held back until the chunks of their extra data are all
+        # in, by (cid, seq), as lists of tuple(entity, edf name)
+        self.waiting_chunks = {}
+        # events whose extra data came in, to be returned next
+        self.ready = collections.deque()
         self.endless = endless
+        self.clocks = None
 
     def get_progress(self):
+        position = self.position
+        if self.reader:
+            position = self.reader.tell()
         if self.totalsize:
-            return (float(self.position) / float(self.totalsize)) * 100
+            return (float(position) / float(self.totalsize)) * 100
         else:
             return 0.0
 
@@ -134,19 +140,17 @@ class RawInputSource(InputSource):
     def __read(self):
         #The name of the machine the data was collected on
         machine = self.header["hostname"]
+        if not self.clocks:
+            # shared by all the events of this stream
+            self.clocks = (intern(str(machine)), intern(str(self.filename)))
 
         #dsui.event("INPUTS","RAW_INPUT_READ");
         while True:
-            for evt in self.waiting_chunks:
-                cid = evt.get_cid()
-                seq = evt.get_sequence()
-                if self.decoder.has_cached_data(cid, seq):
-                    self.waiting_chunks.remove(evt)
-                    evt.extra_data = self.decoder.get_cached_data(cid, seq)
-                    return evt
+            if self.ready:
+                return self.ready.popleft()
 
-            event_binary = self.infile_read(self.sizes["event"])
-            if len(event_binary) < self.sizes["event"]:
+            event_record = self.read_record()
+            if event_record is None:
                 # end of stream reached
                 if self.endless:
                     # XXX hack for online postprocessing
@@ -154,9 +158,7 @@ class RawInputSource(InputSource):
                 else:
                     return entities.PipelineEnd()
 
-            event_record = struct.unpack(self.formats["event"],
-                event_binary)
-            tsc, seq, aid, tag, pid, datalen = event_record
+            tsc, seq, aid, tag, pid, datalen, extra_data_binary = event_record
             
            # print "decoded record", event_record, long(aid)
             try:
@@ -168,28 +170,20 @@ class RawInputSource(InputSource):
                raise InputSourceException("Unknown composite id "+
                         `cid`)
 
-            timeval = {
-                "tsc" : entities.TimeMeasurement("tsc", tsc,
-                    machine, 0, 0),
-                "sequence" : entities.TimeMeasurement("sequence",
-                    seq, self.filename, 0, 0)
-            }
-
             edf_name = event_spec.get_edf()
 
             wait_flag = False
-            if datalen > 0:
-                extra_data_binary = self.infile_read(datalen)
-            elif edf_name and self.decoder.has_cached_data(cid, seq):
-                extra_data_binary = self.decoder.get_cached_data(cid, seq)
-            elif edf_name:
-                extra_data_binary = None
-                if datalen == -1:
+            if datalen <= 0 and edf_name:
+                if self.decoder.has_cached_data(cid, seq):
+                    extra_data_binary = self.decoder.get_cached_data(cid, seq)
+                elif datalen == -1 and not self.decoder.claim_dropped(cid, seq):
                     wait_flag = True
 
 
             if cid == self.chunkevent:
-                self.decoder.decode_chunk(extra_data_binary)
+                for key in self.decoder.decode_chunk(extra_data_binary):
+                    if key in self.waiting_chunks:
+                        self.release_waiting(key)
                 continue
     
             if edf_name and (extra_data_binary != None):
@@ -206,7 +200,7 @@ class RawInputSource(InputSource):
             if cid == self.counterevent:
                 entity = entities.Counter(
                     extra_data["raw_cid"], 
-                    timeval, 
+                    self.log_time(tsc, seq), 
                     extra_data["count"],
                     entities.get_tsc_measurement(
                         extra_data["first_update"],
@@ -217,7 +211,7 @@ class RawInputSource(InputSource):
             elif cid == self.histevent:
                 entity = entities.Histogram(
                     extra_data["raw_cid"],
-                    timeval,
+                    self.log_time(tsc, seq),
                     extra_data["lowerbound"], extra_data["upperbound"],
                     extra_data["num_buckets"], pid)
                 entity.populate(extra_data["underflow"],
@@ -234,7 +228,7 @@ class RawInputSource(InputSource):
                 }
                 entity = entities.Interval(
                         extra_data["raw_cid"],
-                        starttime, timeval, tag, pid);
+                        starttime, self.log_time(tsc, seq), tag, pid);
             else: # event
                 if cid == self.ns_frag_event:
                     ns_frag = self.declare_entity(
@@ -244,7 +238,8 @@ class RawInputSource(InputSource):
                         extra_data["edf"],
                         extra_data["type"],
                         long(extra_data["aid"]))
-                    return entities.Event(self.ns_event, timeval, tag, ns_frag, pid)
+                    return entities.Event(self.ns_event,
+                            self.log_time(tsc, seq), tag, ns_frag, pid)
                 elif cid == self.ns_event:
                     raise Exception ("your input file is too old")
                     c, new_ns = self.local_ns.merge(extra_data)
@@ -255,24 +250,80 @@ class RawInputSource(InputSource):
                         self.aid_index[old_cid] = new_cid
 
 
-                entity = entities.Event(cid, timeval, tag, extra_data, pid)
+                entity = entities.CompactEvent(cid, tsc, seq, self.clocks,
+                        tag, extra_data, pid)
             
             
             entity.namespace = self.local_ns
 
             if wait_flag:
-                self.waiting_chunks.append(entity)
+                self.waiting_chunks.setdefault((cid, seq), []).append(
+                        (entity, edf_name))
                 continue
 
             return entity
 
+    def release_waiting(self, key):
+        """the extra data of key is complete, hand it to the first event
+        waiting for it. if it was dropped, the event goes on without it"""
+        waiting = self.waiting_chunks[key]
+        entity, edf_name = waiting.pop(0)
+        if not waiting:
+            del self.waiting_chunks[key]
+
+        if self.decoder.has_cached_data(*key):
+            binary = self.decoder.get_cached_data(*key)
+            if binary is not None:
+                entity.extra_data = self.decoder.decode(edf_name, binary)
+        else:
+            # dropped over the memory limit, its extra data stays None
+            self.decoder.claim_dropped(*key)
+        self.ready.append(entity)
+
+    def log_time(self, tsc, seq):
+        machine, stream = self.clocks
+        return {
+            "tsc" : entities.TimeMeasurement("tsc", tsc, machine, 0, 0),
+            "sequence" : entities.TimeMeasurement("sequence", seq,
+                stream, 0, 0)
+        }
+
     def open(self):
+        opened = False
         if not self.infile:
             self.totalsize = os.stat(self.filename).st_size
             self.infile = open(self.filename, "rb")
+            opened = True
             
         self.read_binary_header()
 
+        if opened and not self.endless:
+            # a file of our own is decoded in bulk
+            self.reader = rawfile.RecordReader(self.infile,
+                    self.infile.tell())
+            self.records = self.reader.records()
+
+    def read_record(self):
+        """returns the next event record as tuple(tsc, seq, aid, tag,
+        pid, datalen, extra_data), or None at the end of the stream"""
+        if self.records:
+            try:
+                return self.records.next()
+            except StopIteration:
+                return None
+
+        header_size = rawfile.event_header.size
+        event_binary = self.infile_read(header_size)
+        if len(event_binary) < header_size:
+            return None
+
+        tsc, seq, aid, tag, pid, datalen = rawfile.event_header.unpack(
+                event_binary)
+        extra_data = None
+        if datalen > 0:
+            extra_data = self.infile_read(datalen)
+        return tsc, seq, aid, tag, pid, datalen, extra_data
+
     def infile_read(self, size):
         self.position = self.infile.tell()
         return self.infile.read(size)
@@ -293,10 +344,17 @@ class RawInputSource(InputSource):
 
     def close(self):
         if self.waiting_chunks:
-            print self.filename,"ERROR",(len(self.waiting_chunks)),"events were held back due to missing/incomplete extra data"
-            for e in self.waiting_chunks:
+            held = []
+            for waiting in self.waiting_chunks.values():
+                held.extend([entity for entity, edf_name in waiting])
+            print self.filename,"ERROR",len(held),"events were held back due to missing/incomplete extra data"
+            for e in held:
                 print e
+        for line in self.decoder.report():
+            print self.filename,line
 
+        if self.reader:
+            self.reader.close()
         self.infile.close()
         pass
 
@@ -0,0 +1,118 @@
+"""block oriented reading of the event records of raw DSKI/DSUI files.
+
+A raw file is a header followed by event records, each one a fixed
+size header (see event_header) and, if its datalen is positive, that
+many bytes of extra data. Reading a record at a time costs a tell(),
+one or two read()s and an unpack per event; the RecordReader instead
+maps the file into memory (or reads it in large blocks) and decodes
+the record headers of a whole batch with one precompiled struct."""
+import mmap
+import os
+import struct
+
+# tsc, sequence, composite id, tag, pid, extra data length
+event_header = struct.Struct("QIIIIi")
+
+BLOCK_SIZE = 1024 * 1024
+BATCH_SIZE = 4096
+
+
+class RecordReader:
+    """reads the event records of infile from offset on.
+
+    records() generates tuple(tsc, seq, aid, tag, pid, datalen,
+    extra_data) for every record, extra_data being None when the
+    record has none (datalen 0, or -1 when the data follows in chunk
+    events). a truncated record at the end of the file is dropped."""
+
+    def __init__(self, infile, offset, use_mmap=True, block_size=BLOCK_SIZE):
+        self.infile = infile
+        self.block_size = block_size
+        self.map = None
+        # self.buffer holds the bytes of the file from self.base on,
+        # the next record starts at self.offset in it
+        self.buffer = ""
+        self.base = offset
+        self.offset = 0
+        self.eof = False
+
+        if use_mmap:
+            self.open_map(offset)
+        if self.map is None:
+            self.infile.seek(offset)
+
+    def open_map(self, offset):
+        try:
+            fileno = self.infile.fileno()
+            if os.fstat(fileno).st_size <= offset:
+                return
+            self.map = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (AttributeError, EnvironmentError, ValueError):
+            # not a regular file, fall back to reading blocks
+            self.map = None
+            return
+        self.buffer = self.map
+        self.base = 0
+        self.offset = offset
+        self.eof = True
+
+    def tell(self):
+        """file offset of the next record not yet decoded"""
+        return self.base + self.offset
+
+    def fill(self):
+        """append the next block of the file to the undecoded part of
+        the buffer. returns False at the end of the file"""
+        if self.eof:
+            return False
+        data = self.infile.read(self.block_size)
+        if not data:
+            self.eof = True
+            return False
+        self.base = self.base + self.offset
+        self.buffer = self.buffer[self.offset:] + data
+        self.offset = 0
+        return True
+
+    def decode_batch(self, count=BATCH_SIZE):
+        """decode up to count of the complete records in the buffer"""
+        unpack_from = event_header.unpack_from
+        header_size = event_header.size
+        buf = self.buffer
+        end = len(buf)
+        offset = self.offset
+
+        batch = []
+        append = batch.append
+        while count and offset + header_size <= end:
+            tsc, seq, aid, tag, pid, datalen = unpack_from(buf, offset)
+            data_start = offset + header_size
+            if datalen > 0:
+                data_end = data_start + datalen
+                if data_end > end:
+                    break
+                extra_data = buf[data_start:data_end]
+            else:
+                data_end = data_start
+                extra_data = None
+            append((tsc, seq, aid, tag, pid, datalen, extra_data))
+            offset = data_end
+            count = count - 1
+
+        self.offset = offset
+        return batch
+
+    def records(self):
+        while True:
+            batch = self.decode_batch()
+            if batch:
+                for record in batch:
+                    yield record
+            elif not self.fill():
+                return
+
+    def close(self):
+        if self.map is not None:
+            self.buffer = ""
+            self.map.close()
+            self.map = None
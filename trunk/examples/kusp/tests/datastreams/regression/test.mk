@@ -1,4 +1,4 @@
-all: ds_import_test dski_regression 
+all: ds_import_test postprocess_test dski_regression 
 
 dski_regression: socketpipe_dski
 
@@ -25,5 +25,10 @@ ds_import_test:
 	else echo 'Data Streams modules not found, import failed!';\
 	exit 5; fi;
 
+postprocess_test:
+	if python -m unittest discover -p 'test_*.py'; then echo ' ';\
+	else echo 'Post processing tests failed!';\
+	exit 6; fi;
+
 clean:
 	rm -rf ./build
\ No newline at end of file
@@ -0,0 +1,243 @@
+"""
+================================================================
+:mod:`test_chunks`
+================================================================
+    :synopsis: Checks that the extra data sent in chunks is put
+        back together the way the old decoder did.
+
+Extra data too large for one event record follows its event in
+DATA_CHUNK events. The old decoder kept the chunks of every (cid,
+seq) key until they added up to the total length, then joined them
+by chunk number. These tests check the decoder and the raw input
+source against that, with chunks out of order, the chunks of several
+events interleaved, and extra data dropped over the memory limit.
+"""
+import os
+import random
+import shutil
+import struct
+import tempfile
+import unittest
+
+from datastreams import namespaces
+from datastreams.postprocess import entities, event_data, inputs
+
+HEADER = struct.pack("IIIIII80s", 0, 4, 8, 2, 8, 8, "testhost")
+EVENT_FORMAT = "QIIIIi"
+
+
+def make_chunks(key, payload, size, rand):
+	"""the chunk event data of payload, in random order"""
+	cid, seq = key
+	chunks = []
+	for number in range(0, (len(payload) + size - 1) / size):
+		data = payload[number * size:(number + 1) * size]
+		chunks.append(event_data.chunk_header.pack(seq, cid, number,
+			len(payload), len(data)) + data)
+	rand.shuffle(chunks)
+	return chunks
+
+
+def interleave(chunk_lists, rand):
+	"""the chunks of all the lists, each list in its own order"""
+	chunk_lists = [list(chunks) for chunks in chunk_lists if chunks]
+	result = []
+	while chunk_lists:
+		chunks = rand.choice(chunk_lists)
+		result.append(chunks.pop(0))
+		if not chunks:
+			chunk_lists.remove(chunks)
+	return result
+
+
+def reassemble(chunks):
+	"""the extra data of the chunks by key, the old way: all the chunks
+	of a key, sorted by chunk number and joined"""
+	by_key = {}
+	lengths = {}
+	for binary in chunks:
+		owner_seq, owner_cid, seq, total_len, data_len = \
+			event_data.chunk_header.unpack_from(binary)
+		by_key.setdefault((owner_cid, owner_seq), []).append(
+			(seq, binary[event_data.chunk_header.size:]))
+		lengths[(owner_cid, owner_seq)] = total_len
+	result = {}
+	for key, pieces in by_key.items():
+		pieces.sort()
+		data = "".join([data for seq, data in pieces])
+		if len(data) == lengths[key]:
+			result[key] = data
+	return result
+
+
+def make_payload(rand, length):
+	return "".join([chr(rand.randrange(32, 127)) for i in range(length)])
+
+
+class DecoderTest(unittest.TestCase):
+
+	def test_interleaved_chunks(self):
+		rand = random.Random(25)
+		payloads = {}
+		chunk_lists = []
+		for seq in range(40):
+			key = (3, seq)
+			payloads[key] = make_payload(rand, rand.randrange(1, 500))
+			chunk_lists.append(make_chunks(key, payloads[key],
+				rand.choice([7, 50, 128]), rand))
+		chunks = interleave(chunk_lists, rand)
+		expected = reassemble(chunks)
+		self.assertEqual(expected, payloads)
+
+		decoder = event_data.ExtraDataDecoder()
+		completed = []
+		for binary in chunks:
+			completed.extend(decoder.decode_chunk(binary))
+		self.assertEqual(sorted(completed), sorted(payloads.keys()))
+		for key in completed:
+			self.assertTrue(decoder.has_cached_data(*key))
+			self.assertEqual(decoder.get_cached_data(*key), expected[key])
+		self.assertEqual(decoder.pending_bytes, 0)
+		self.assertEqual(decoder.report(), [])
+
+	def test_dropped(self):
+		rand = random.Random(26)
+		first = make_chunks((3, 1), make_payload(rand, 100), 10, rand)
+		second = make_chunks((3, 2), make_payload(rand, 100), 10, rand)
+		decoder = event_data.ExtraDataDecoder(max_pending=150)
+
+		for binary in first[:9]:
+			self.assertEqual(decoder.decode_chunk(binary), [])
+		# the first one is dropped to make room for the second
+		settled = []
+		for binary in second[:7]:
+			settled.extend(decoder.decode_chunk(binary))
+		self.assertEqual(settled, [(3, 1)])
+		self.assertFalse(decoder.has_cached_data(3, 1))
+		self.assertTrue("1 extra data dropped over the memory limit" in
+			decoder.report())
+
+		# its last chunk is skipped, the entry is kept for its event
+		self.assertEqual(decoder.decode_chunk(first[9]), [])
+		self.assertTrue((3, 1) in decoder.dropped)
+		self.assertTrue(decoder.claim_dropped(3, 1))
+		self.assertEqual(decoder.dropped, {})
+		self.assertFalse(decoder.claim_dropped(3, 1))
+
+		for binary in second[7:]:
+			settled = decoder.decode_chunk(binary)
+		self.assertEqual(settled, [(3, 2)])
+		self.assertEqual(decoder.get_cached_data(3, 2), reassemble(second)[(3, 2)])
+		self.assertEqual(decoder.report(),
+			["1 extra data dropped over the memory limit"])
+
+
+class RawInputChunkTest(unittest.TestCase):
+
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp()
+		ns = namespaces.get_admin_ns()
+		self.cid = ns["DSTREAM_ADMIN_FAM/EVENT_ASSOCIATE_NAME"].get_id()
+		self.chunk_cid = ns["DSTREAM_ADMIN_FAM/DATA_CHUNK"].get_id()
+
+	def tearDown(self):
+		shutil.rmtree(self.workdir)
+
+	def write(self, records):
+		filename = os.path.join(self.workdir, "test.raw")
+		outfile = open(filename, "wb")
+		try:
+			outfile.write(HEADER)
+			for tsc, (cid, seq, data) in enumerate(records):
+				if data is None:
+					datalen = -1
+				else:
+					datalen = len(data)
+				outfile.write(struct.pack(EVENT_FORMAT, tsc, seq, cid, 0, 1,
+					datalen))
+				if data:
+					outfile.write(data)
+		finally:
+			outfile.close()
+		return filename
+
+	def read(self, filename, max_pending=None):
+		source = inputs.RawInputSource(filename, [])
+		if max_pending is not None:
+			source.decoder.max_pending = max_pending
+		source.open()
+		events = []
+		while True:
+			entity = source.read()
+			if entity.message == entities.PIPELINE_EOF:
+				break
+			events.append(entity)
+		return source, events
+
+	def make_records(self, rand, count, size):
+		"""records of count events whose extra data comes in chunks after
+		them, the chunks of consecutive events interleaved and out of
+		order. returns the records and the chunk event data"""
+		records = []
+		all_chunks = []
+		chunk_seq = 1000
+		pending = []
+		for seq in range(count):
+			payload = make_payload(rand, rand.randrange(1, size))
+			records.append((self.cid, seq, None))
+			pending.append(make_chunks((self.cid, seq), payload, 16, rand))
+			if len(pending) == 3 or seq == count - 1:
+				chunks = interleave(pending, rand)
+				for binary in chunks:
+					records.append((self.chunk_cid, chunk_seq, binary))
+					chunk_seq = chunk_seq + 1
+				all_chunks.extend(chunks)
+				pending = []
+		return records, all_chunks
+
+	def test_chunks(self):
+		rand = random.Random(27)
+		records, chunks = self.make_records(rand, 30, 200)
+		# the chunks of an event may also come before it
+		payload = make_payload(rand, 70)
+		early = make_chunks((self.cid, 500), payload, 16, rand)
+		chunks.extend(early)
+		records[:0] = [(self.chunk_cid, 900 + i, binary)
+			for i, binary in enumerate(early)]
+		records.append((self.cid, 500, None))
+
+		source, events = self.read(self.write(records))
+		expected = reassemble(chunks)
+		self.assertEqual(len(events), 31)
+		for event in events:
+			self.assertEqual(event.get_extra_data(),
+				expected[(self.cid, event.get_sequence())])
+		self.assertEqual(source.waiting_chunks, {})
+		self.assertEqual(source.decoder.report(), [])
+
+	def test_dropped(self):
+		rand = random.Random(28)
+		records, chunks = self.make_records(rand, 30, 200)
+		# room for the chunks of about two events
+		source, events = self.read(self.write(records), max_pending=300)
+
+		expected = reassemble(chunks)
+		self.assertEqual(sorted([e.get_sequence() for e in events]), range(30))
+		missing = 0
+		for event in events:
+			data = event.get_extra_data()
+			if data is None:
+				missing = missing + 1
+			else:
+				self.assertEqual(data,
+					expected[(self.cid, event.get_sequence())])
+		self.assertTrue(missing)
+		self.assertEqual(source.decoder.dropped_count, missing)
+		# the events went on without their extra data, and the later
+		# chunks of it were all skipped
+		self.assertEqual(source.waiting_chunks, {})
+		self.assertEqual(source.decoder.dropped, {})
+
+
+if __name__ == '__main__':
+	unittest.main()
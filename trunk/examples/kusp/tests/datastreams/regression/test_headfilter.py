@@ -0,0 +1,161 @@
+"""
+================================================================
+:mod:`test_headfilter`
+================================================================
+    :synopsis: Checks that the head filter merges its input
+        sources in the order the old merge did.
+
+The old head filter looked at the next entity of every source and
+sent the smallest one by `Entity.__cmp__`. These tests run the same
+sources through that loop and through `HeadFilter`, and compare the
+entities they send.
+"""
+import unittest
+from StringIO import StringIO
+import sys
+
+from datastreams import namespaces
+from datastreams.postprocess import entities, headfilter
+from datastreams.postprocess.entities import TimeMeasurement
+
+
+class ListSource:
+	"""an input source reading the entities of a list"""
+
+	def __init__(self, name, entity_list):
+		self.name = name
+		self.entity_list = entity_list
+
+	def get_name(self):
+		return self.name
+
+	def get_dependency(self):
+		return None
+
+	def open(self):
+		self.position = 0
+
+	def close(self):
+		pass
+
+	def read(self):
+		if self.position == len(self.entity_list):
+			return entities.PipelineEnd()
+		entity = self.entity_list[self.position]
+		self.position = self.position + 1
+		return entity
+
+
+def old_merge(sources):
+	"""the entities of sources in the order the old head filter sent them,
+	the smallest next entity of all the sources by Entity.__cmp__"""
+	next_entity = {}
+	for name, entity_list in sources.iteritems():
+		if entity_list:
+			next_entity[name] = list(entity_list)
+	merged = []
+	while next_entity:
+		sourceids = next_entity.keys()
+		min_sourceid = sourceids[0]
+		min_time = next_entity[min_sourceid][0]
+		for sourceid in sourceids[1:]:
+			entity = next_entity[sourceid][0]
+			if entity < min_time:
+				min_time = entity
+				min_sourceid = sourceid
+		merged.append(next_entity[min_sourceid].pop(0))
+		if not next_entity[min_sourceid]:
+			del next_entity[min_sourceid]
+	return merged
+
+
+class HeadFilterMergeTest(unittest.TestCase):
+
+	def setUp(self):
+		self.namespace = namespaces.get_admin_ns()
+		self.cid = self.namespace["DSTREAM_ADMIN_FAM/EVENT_BUFFER_FLUSH"].get_id()
+
+	def event(self, machine, stream, tsc, seq, ns=None):
+		log = {
+			"tsc" : TimeMeasurement("tsc", tsc, machine, 0, 0),
+			"sequence" : TimeMeasurement("sequence", seq, stream, 0, 0),
+		}
+		if ns is not None:
+			log["ns"] = TimeMeasurement("ns", ns, "global", 0, 0)
+		return entities.Event(self.cid, log, tsc, None)
+
+	def compact_event(self, machine, stream, tsc, seq, ns=None):
+		event = entities.CompactEvent(self.cid, tsc, seq, (machine, stream),
+			tsc, None)
+		event.ns = ns
+		return event
+
+	def merge(self, sources):
+		"""the tags of the entities the head filter sends, and what it
+		printed"""
+		head = headfilter.HeadFilter({})
+		head.namespace = self.namespace
+		sent = []
+		head.send = sent.append
+		names = sources.keys()
+		names.sort()
+		for name in names:
+			head.add_input_source(ListSource(name, sources[name]))
+
+		stdout = sys.stdout
+		sys.stdout = StringIO()
+		try:
+			head.run()
+			output = sys.stdout.getvalue()
+		finally:
+			sys.stdout = stdout
+
+		self.assertEqual(sent[-1].message, entities.PIPELINE_EOF)
+		return [e.get_tag() for e in sent[:-1]], output
+
+	def assertSameOrder(self, sources):
+		tags, output = self.merge(sources)
+		self.assertEqual(tags, [e.get_tag() for e in old_merge(sources)])
+		return tags, output
+
+	def test_ns_timestamps(self):
+		# the ns timestamps of two machines, whose tsc do not agree
+		sources = {
+			"a" : [self.event("m1", "a", tsc, tsc, ns=tsc * 10)
+				for tsc in range(0, 40, 3)],
+			"b" : [self.compact_event("m2", "b", tsc + 1000, tsc, ns=tsc * 10 + 5)
+				for tsc in range(0, 40, 4)],
+		}
+		tags, output = self.assertSameOrder(sources)
+		self.assertEqual(len(tags), 24)
+		self.failIf("WARNING" in output, output)
+
+	def test_ns_and_tsc(self):
+		# the events of one machine, only some of them have an ns
+		# timestamp. the old merge ordered them all by their tsc
+		sources = {
+			"a" : [self.event("m1", "a", tsc, tsc, ns=tsc * 10)
+				for tsc in range(0, 60, 5)],
+			"b" : [self.compact_event("m1", "b", tsc, tsc)
+				for tsc in range(1, 60, 7)],
+			"c" : [self.compact_event("m1", "c", tsc, tsc, ns=tsc * 10)
+				for tsc in range(2, 30, 3)] +
+				[self.event("m1", "c", tsc, tsc)
+				for tsc in range(32, 60, 3)],
+		}
+		tags, output = self.assertSameOrder(sources)
+		self.assertEqual(tags, sorted(tags))
+		self.assertEqual(output.count("WARNING"), 1, output)
+
+	def test_generated_timestamps(self):
+		sources = {
+			"a" : [self.compact_event("generated", "generated", 0, 0)] +
+				[self.event("m1", "a", tsc, tsc, ns=tsc) for tsc in range(1, 9)],
+			"b" : [self.compact_event("m1", "b", tsc, tsc) for tsc in range(3, 6)],
+		}
+		tags, output = self.assertSameOrder(sources)
+		self.assertEqual(tags[0], 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,151 @@
+"""
+================================================================
+:mod:`test_rawfile`
+================================================================
+    :synopsis: Checks that the record reader decodes the event
+        records of raw files the way the old read loop did.
+
+The old raw input source read a record at a time: a read and an
+unpack of the record header, then a read of the extra data if its
+datalen was positive. These tests write raw files, read them with
+that loop and with `RecordReader`, mapped and in small blocks, and
+compare the records.
+"""
+import os
+import random
+import shutil
+import struct
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from datastreams.postprocess import rawfile
+
+# the part of the file before the records, as the header of a raw file
+HEADER = struct.pack("IIIIII80s", 0, 4, 8, 2, 8, 8, "testhost")
+EVENT_FORMAT = "QIIIIi"
+
+
+def old_records(infile, offset):
+	"""the records of infile from offset on, read one at a time"""
+	infile.seek(offset)
+	size = struct.calcsize(EVENT_FORMAT)
+	records = []
+	while True:
+		event_binary = infile.read(size)
+		if len(event_binary) < size:
+			return records
+		tsc, seq, aid, tag, pid, datalen = struct.unpack(EVENT_FORMAT,
+			event_binary)
+		if datalen > 0:
+			extra_data = infile.read(datalen)
+		else:
+			extra_data = None
+		records.append((tsc, seq, aid, tag, pid, datalen, extra_data))
+
+
+def make_records(count, seed):
+	rand = random.Random(seed)
+	records = []
+	for seq in range(count):
+		datalen = rand.choice([0, 0, -1, 1, 7, 40, 300])
+		if datalen > 0:
+			extra_data = "".join([chr(rand.randrange(256))
+				for i in range(datalen)])
+		else:
+			extra_data = None
+		records.append((rand.randrange(2 ** 64), seq, rand.randrange(100),
+			rand.randrange(2 ** 32), rand.randrange(2 ** 16), datalen,
+			extra_data))
+	return records
+
+
+def pack_records(records):
+	parts = []
+	for tsc, seq, aid, tag, pid, datalen, extra_data in records:
+		parts.append(struct.pack(EVENT_FORMAT, tsc, seq, aid, tag, pid,
+			datalen))
+		if extra_data:
+			parts.append(extra_data)
+	return "".join(parts)
+
+
+class RecordReaderTest(unittest.TestCase):
+
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp()
+		self.records = make_records(2000, 21)
+
+	def tearDown(self):
+		shutil.rmtree(self.workdir)
+
+	def write(self, data):
+		filename = os.path.join(self.workdir, "test.raw")
+		outfile = open(filename, "wb")
+		try:
+			outfile.write(HEADER + data)
+		finally:
+			outfile.close()
+		return filename
+
+	def read(self, filename, **options):
+		infile = open(filename, "rb")
+		try:
+			reader = rawfile.RecordReader(infile, len(HEADER), **options)
+			records = list(reader.records())
+			reader.close()
+			return records
+		finally:
+			infile.close()
+
+	def read_old(self, filename):
+		infile = open(filename, "rb")
+		try:
+			return old_records(infile, len(HEADER))
+		finally:
+			infile.close()
+
+	def assertSameRecords(self, filename, expected):
+		self.assertEqual(self.read_old(filename), expected)
+		self.assertEqual(self.read(filename), expected)
+		for block_size in (1, 23, 400, 4096):
+			self.assertEqual(self.read(filename, use_mmap=False,
+				block_size=block_size), expected)
+
+	def test_records(self):
+		filename = self.write(pack_records(self.records))
+		self.assertSameRecords(filename, self.records)
+
+	def test_no_records(self):
+		filename = self.write("")
+		self.assertSameRecords(filename, [])
+
+	def test_truncated_header(self):
+		data = pack_records(self.records)
+		filename = self.write(data + data[:rawfile.event_header.size - 1])
+		self.assertSameRecords(filename, self.records)
+
+	def test_truncated_extra_data(self):
+		# the old loop returned the part of the extra data that was
+		# written, the record reader drops the record
+		last = (1, 2, 3, 4, 5, 100, "x" * 100)
+		data = pack_records(self.records + [last])
+		filename = self.write(data[:-50])
+		self.assertEqual(self.read_old(filename),
+			self.records + [last[:-1] + ("x" * 50,)])
+		self.assertEqual(self.read(filename), self.records)
+		self.assertEqual(self.read(filename, use_mmap=False, block_size=23),
+			self.records)
+
+	def test_stream(self):
+		# a socket or a pipe can not be mapped, it is read in blocks
+		data = pack_records(self.records)
+		reader = rawfile.RecordReader(StringIO(HEADER + data), len(HEADER),
+			block_size=100)
+		self.assertEqual(reader.map, None)
+		self.assertEqual(list(reader.records()), self.records)
+		self.assertEqual(reader.tell(), len(HEADER) + len(data))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,123 @@
+"""
+================================================================
+:mod:`test_sort`
+================================================================
+    :synopsis: Checks that the external sort filter sends a
+        datastream in the order the in memory sort does.
+
+`sort_time` sorts the whole datastream in memory. These tests send
+the same entities through `external_sort`, with a memory limit that
+makes it write several sorted runs to disk, and compare the order of
+the entities the two filters send.
+"""
+import random
+import unittest
+
+from datastreams import namespaces
+from datastreams.postprocess import entities
+from datastreams.postprocess.filters import sort
+
+
+def make_events(count, cid, seed):
+	"""events with ns timestamps, many of them the same"""
+	rand = random.Random(seed)
+	events = []
+	for tag in range(count):
+		event = entities.CompactEvent(cid, rand.randrange(10 ** 9), tag,
+			("m1", "stream"), tag, {"tag" : tag})
+		event.ns = rand.randrange(count / 4)
+		events.append(event)
+	return events
+
+
+class ExternalSortTest(unittest.TestCase):
+
+	def setUp(self):
+		self.namespace = namespaces.get_admin_ns()
+		self.cid = self.namespace["DSTREAM_ADMIN_FAM/EVENT_BUFFER_FLUSH"].get_id()
+		self.block_size = sort.RUN_BLOCK_SIZE
+
+	def tearDown(self):
+		sort.RUN_BLOCK_SIZE = self.block_size
+
+	def run_filter(self, filter_class, params, events):
+		"""the tags of the entities filter_class sends"""
+		f = filter_class(params)
+		f.namespace = self.namespace
+		sent = []
+		f.send = sent.append
+		f.initialize()
+		for event in events:
+			f.process(event)
+		f.finalize()
+		self.filter = f
+		return [e.get_tag() for e in sent]
+
+	def sorted_tags(self, events):
+		return self.run_filter(sort.sort_time, {"sort_key" : "ns"}, events)
+
+	def external_sort(self, events, memory_limit, window=0):
+		return self.run_filter(sort.external_sort, {
+			"sort_key" : "ns",
+			"memory_limit" : memory_limit,
+			"window" : window,
+			"temp_dir" : "",
+		}, events)
+
+	def test_in_memory(self):
+		events = make_events(500, self.cid, 1)
+		expected = self.sorted_tags(events)
+		self.assertEqual(self.external_sort(events, 1000), expected)
+		self.assertEqual(self.filter.runs, [])
+
+	def test_runs(self):
+		# 13 runs of 150 entities and 50 in memory, pickled 40 at a time
+		sort.RUN_BLOCK_SIZE = 40
+		events = make_events(2000, self.cid, 2)
+		expected = self.sorted_tags(events)
+		self.assertEqual(len(expected), 2000)
+
+		f = sort.external_sort({"sort_key" : "ns", "memory_limit" : 150,
+			"window" : 0, "temp_dir" : ""})
+		f.initialize()
+		for event in events:
+			f.process(event)
+		self.assertEqual(len(f.runs), 13)
+		self.assertEqual(f.run_entities, 1950)
+
+		self.assertEqual(self.external_sort(events, 150), expected)
+
+	def test_run_contents(self):
+		# what is read back from a run is what was written to it
+		events = make_events(300, self.cid, 3)
+		f = sort.external_sort({"sort_key" : "ns", "memory_limit" : 300,
+			"window" : 0, "temp_dir" : ""})
+		f.initialize()
+		for event in events:
+			event.set_namespace(self.namespace)
+			f.process(event)
+		self.assertEqual(len(f.runs), 1)
+
+		read = list(f.read_run(f.runs[0]))
+		self.assertEqual(len(read), 300)
+		for key, serial, entity in read:
+			event = events[serial]
+			self.assertEqual(key, event.get_nanoseconds())
+			self.assertEqual(entity.get_tag(), event.get_tag())
+			self.assertEqual(entity.get_extra_data(), event.get_extra_data())
+			self.assertEqual(entity.get_sort_time(), event.get_sort_time())
+			self.assertEqual(entity.namespace, None)
+		self.assertEqual(read, sorted(read))
+
+	def test_window(self):
+		# entities no more than 5 units out of place
+		events = make_events(1000, self.cid, 4)
+		for i in range(len(events)):
+			events[i].ns = i + (i * 7) % 5
+		expected = self.sorted_tags(events)
+		self.assertEqual(self.external_sort(events, 1000, window=5), expected)
+		self.assertEqual(self.filter.late, 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,299 @@
+"""
+:mod:`daemon` -- Persistent Build Server
+===========================================
+
+An opt-in, long lived build server for one workspace. It keeps the
+loaded ``ipym_*`` modules, the build environment and the file
+fingerprints in memory between builds, so the ``ipymake`` client only
+has to send it the build file and target over a local socket.
+
+When :mod:`pyinotify` is available the server watches the workspace
+and trusts its cached fingerprints until a file is reported changed,
+so a build that has nothing to do does not even stat the sources.
+
+The messages on the socket are frames of a one byte type, a four byte
+length and the payload:
+
+* ``R`` -- a build request, the pickled request dictionary.
+* ``O`` -- output of the build.
+* ``X`` -- the exit status of the build, ends the reply.
+
+"""
+import sys
+import os
+import struct
+import socket
+import cPickle
+import traceback
+
+try:
+    import pyinotify
+except(ImportError):
+    pyinotify = None
+
+SOCKET_FILENAME = '.ipymake_daemon.sock'
+REQUEST, OUTPUT, EXIT = 'R', 'O', 'X'
+STOP_TARGET = '__stop__'
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_BUILD_FAILED = 3
+
+_HEADER = struct.Struct('!cI')
+
+
+def socket_path(workspace):
+    """
+    The path of the server socket of *workspace*.
+    """
+    return os.path.join(os.path.abspath(workspace), SOCKET_FILENAME)
+
+
+def send_frame(sock, frame_type, payload):
+    sock.sendall(_HEADER.pack(frame_type, len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError('Connection closed by the build server')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+def recv_frame(sock):
+    frame_type, size = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return frame_type, _recv_exactly(sock, size)
+
+
+class SocketWriter:
+    """
+    File like object that sends everything written to it as output
+    frames to the client.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+
+    def write(self, data):
+        if data:
+            send_frame(self.sock, OUTPUT, str(data))
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class BuildServer:
+    """
+    Serves the build requests of one workspace, one at a time.
+    """
+    def __init__(self, workspace='.'):
+        self.workspace = os.path.abspath(workspace)
+        self.path = socket_path(self.workspace)
+        self.notifier = None
+        # Set when inotify dropped events, the fingerprints trusted
+        # until then may be stale.
+        self.events_lost = False
+
+    def serve_forever(self):
+        os.chdir(self.workspace)
+        # Imported here so that the environment is loaded from the
+        # cache of the workspace.
+        import ipymake.runtimecore as runtimecore
+        self.runtimecore = runtimecore
+        self._watch()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0600)
+        server.listen(5)
+        try:
+            while True:
+                conn = server.accept()[0]
+                try:
+                    try:
+                        if not self.handle(conn):
+                            break
+                    except(socket.error, EOFError):
+                        # The client went away, keep serving.
+                        pass
+                finally:
+                    conn.close()
+        finally:
+            server.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            if self.notifier is not None:
+                self.notifier.stop()
+
+    def _watch(self):
+        """
+        Invalidate the cached fingerprints of the files inotify reports
+        as changed. Only the fingerprints of the files in the watched
+        workspace are trusted.
+        """
+        if pyinotify is None:
+            return
+        fingerprints = self.runtimecore._fingerprints
+        fingerprints.trust_cache([self.workspace])
+        server = self
+
+        class Invalidate(pyinotify.ProcessEvent):
+            def process_IN_Q_OVERFLOW(self, event):
+                server.events_lost = True
+
+            def process_default(self, event):
+                fingerprints.invalidate(event.pathname)
+
+        mask = pyinotify.IN_MODIFY | pyinotify.IN_ATTRIB | pyinotify.IN_CLOSE_WRITE | \
+            pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_MOVED_TO | \
+            pyinotify.IN_MOVED_FROM
+        manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.ThreadedNotifier(manager, Invalidate())
+        self.notifier.setDaemon(True)
+        self.notifier.start()
+        manager.add_watch(self.workspace, mask, rec=True, auto_add=True)
+
+    def handle(self, conn):
+        """
+        Run a single build request.
+
+        :returns: False when the server was asked to stop.
+        """
+        frame_type, payload = recv_frame(conn)
+        if frame_type != REQUEST:
+            return True
+        request = cPickle.loads(payload)
+        if request['target'] == STOP_TARGET:
+            send_frame(conn, EXIT, str(EXIT_OK))
+            return False
+
+        writer = SocketWriter(conn)
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = writer, writer
+        try:
+            status = self.build(request)
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        send_frame(conn, EXIT, str(status))
+        return True
+
+    def start_build(self):
+        """
+        Reset the state that belongs to a single build. The cached
+        fingerprints stay trusted as long as the watch of the workspace
+        is complete.
+        """
+        self.runtimecore.start_build()
+        if self.notifier is None:
+            return
+        if self.events_lost or not self.notifier.isAlive():
+            self.events_lost = False
+            self.runtimecore._fingerprints.trust_cache([self.workspace])
+
+    def build(self, request):
+        runtimecore = self.runtimecore
+        env = runtimecore.env
+        self.start_build()
+        try:
+            env.compile_mode = request.get('compile_mode', 'native')
+            module = runtimecore.load_subdir(self.workspace, request['filename'],
+                                             request.get('cmd_args', ''))
+            env.jobs = request.get('jobs', 1)
+            env.use_fingerprints = request.get('fingerprint', False)
+            if request.get('object_cache_dir'):
+                env.object_cache_dir = request['object_cache_dir']
+            if request.get('object_cache_size'):
+                env.object_cache_size = request['object_cache_size']
+            if request.get('dist_workers'):
+                env.dist_workers = request['dist_workers']
+            env.profile = request.get('profile')
+            getattr(module, request['target'])(is_root=True)
+            module.cleanup_hook(is_root=True)
+        except runtimecore.BuildError, error:
+            print runtimecore.style.bold_red_text('[ Build Failed ]:'), error
+            self._save_state()
+            return EXIT_BUILD_FAILED
+        except Exception:
+            traceback.print_exc()
+            self._save_state()
+            return EXIT_ERROR
+        return EXIT_OK
+
+    def _save_state(self):
+        """
+        Write what a failed build recorded (the targets and objects it
+        did build) to the build state, as cleanup_hook does after a
+        build that succeeded.
+        """
+        try:
+            self.runtimecore.env.sync()
+        except Exception:
+            traceback.print_exc()
+
+
+def start_server(workspace='.'):
+    """
+    Start a build server for *workspace* in the background.
+    """
+    if os.fork():
+        return
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in range(3):
+        os.dup2(devnull, fd)
+    try:
+        BuildServer(workspace).serve_forever()
+    finally:
+        os._exit(0)
+
+
+def request_build(workspace, request, outfile=None):
+    """
+    Send *request* to the build server of *workspace* and copy the
+    build output to *outfile*.
+
+    :returns: The exit status of the build, or None if there is no
+        build server running for the workspace.
+    """
+    if outfile is None:
+        outfile = sys.stdout
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path(workspace))
+    except(socket.error):
+        sock.close()
+        return None
+    try:
+        send_frame(sock, REQUEST, cPickle.dumps(request, -1))
+        while True:
+            frame_type, payload = recv_frame(sock)
+            if frame_type == OUTPUT:
+                outfile.write(payload)
+                outfile.flush()
+            elif frame_type == EXIT:
+                return int(payload)
+    finally:
+        sock.close()
+
+
+def stop_server(workspace='.'):
+    """
+    Ask the build server of *workspace* to exit.
+
+    :returns: False if no build server was running.
+    """
+    return request_build(workspace, {'target' : STOP_TARGET}) is not None
@@ -0,0 +1,560 @@
+"""
+:mod:`distributed` -- Distributed Compilation
+================================================
+
+Spreads the object file compiles of a build over compile workers on
+other machines (or on this one). The coordinator, the build itself,
+runs the preprocessor locally, which also writes the dependency file,
+and sends the preprocessed translation unit with the compiler command
+line to a worker. The worker compiles it without needing the sources
+or the headers of the tree and sends the object file back.
+
+A worker is picked by its load: the compiles the coordinator has
+running on it and the ones its last reply reported, against the
+number of compiles it runs at the same time. When every worker is
+full, or a worker can not be reached or fails, the object file is
+compiled locally instead; a failed worker is left alone for a while
+before it is tried again.
+
+Workers are registered as a comma separated list of ``host:port``
+addresses (``--dist-workers`` or :envvar:`IPYMAKE_WORKERS`). A worker
+is started with ``python -m ipymake.distributed --port PORT``, by
+default on localhost only. A worker only runs the compilers it
+finds on its own :envvar:`PATH` by name, and only passes them the
+options of an allowlist (optimization, code generation, debug
+information, warnings, the language standard and defines), none of
+which names a file, and runs it in a scratch directory. The
+coordinator leaves out the preprocessor options, and compiles the
+sources whose other options a worker would refuse locally.
+
+The messages between the two are the frames of :mod:`ipymake.daemon`,
+a one byte type, a four byte length and the payload:
+
+* ``Q`` -- a load query, answered by ``L``.
+* ``C`` -- the compiler command line, followed by
+* ``N`` -- the file name of the translation unit and
+* ``U`` -- the translation unit, which starts the compile.
+* ``L`` -- the running compiles and the capacity of the worker.
+* ``E`` -- the diagnostics of the compiler.
+* ``O`` -- the object file.
+* ``X`` -- the exit status of the compiler, ends the reply.
+* ``F`` -- the worker can not run the compile, ends the reply.
+
+"""
+import sys
+import os
+import re
+import time
+import pipes
+import shlex
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+import SocketServer
+
+from ipymake.daemon import send_frame, recv_frame
+from ipymake.sourcefiles import is_c_source, is_cxx_source
+from ipymake.scheduler import count
+
+QUERY, COMMAND, NAME, UNIT = 'Q', 'C', 'N', 'U'
+LOAD, DIAGNOSTICS, OBJECT, EXIT, FAILURE = 'L', 'E', 'O', 'X', 'F'
+
+DEFAULT_PORT = 3633
+CONNECT_TIMEOUT = 5.0
+COMPILE_TIMEOUT = 600.0
+RETRY_INTERVAL = 30.0
+
+# The compilers a worker runs.
+ALLOWED_COMPILERS = ('gcc', 'g++', 'cc', 'c++')
+
+# The options a worker passes to the compiler. An option value never
+# holds a path, and the options that take an argument of their own
+# are left out.
+_ALLOWED_OPTIONS = re.compile(r'''^(
+    -O[0-3sgz]? | -Ofast |
+    -g[a-z0-9-]* |
+    -W[a-zA-Z0-9-]+(=[a-zA-Z0-9-]+)? | -w | -pedantic(-errors)? | -ansi |
+    -std=[a-z0-9+]+ |
+    -f[a-zA-Z0-9-]+(=[a-zA-Z0-9,.+-]+)? |
+    -m[a-zA-Z0-9-]+(=[a-zA-Z0-9,.+-]+)? |
+    -[DU][a-zA-Z_][a-zA-Z0-9_]*(=[^/]*)? |
+    -c | -pthread | -pipe
+    )$''', re.VERBOSE)
+# The ones of them that load or write files all the same.
+_REFUSED_OPTIONS = ('-fplugin', '-fprofile', '-fauto-profile')
+
+# The preprocessor options, the coordinator preprocesses the sources.
+# The ones in _PREPROCESSOR_ARGUMENT_OPTIONS may have their argument
+# in the next argument.
+_PREPROCESSOR_OPTIONS = ('-I', '-i', '-M', '-D', '-U', '-nostdinc')
+_PREPROCESSOR_ARGUMENT_OPTIONS = ('-I', '-D', '-U', '-include', '-imacros', '-isystem', '-iquote',
+                                  '-idirafter', '-iprefix', '-iwithprefix',
+                                  '-iwithprefixbefore', '-isysroot', '-MF', '-MT', '-MQ')
+
+
+def allowed_option(arg):
+    """
+    Determine if a worker passes the option *arg* to the compiler.
+    """
+    return _ALLOWED_OPTIONS.match(arg) is not None and \
+        not arg.startswith(_REFUSED_OPTIONS) and not '..' in arg
+
+
+def remote_command(base_command):
+    """
+    The command line of *base_command* (a compiler command without the
+    source and output arguments) that a worker runs on the preprocessed
+    translation unit: the preprocessor options are left out.
+
+    :returns: The command line, or None if a worker would refuse an
+        option of it.
+    """
+    try:
+        argv = shlex.split(base_command)
+    except(ValueError):
+        return None
+    if not argv:
+        return None
+    remote = argv[:1]
+    args = iter(argv[1:])
+    for arg in args:
+        if arg in _PREPROCESSOR_ARGUMENT_OPTIONS:
+            next(args, None)
+        elif arg.startswith(_PREPROCESSOR_OPTIONS):
+            continue
+        elif allowed_option(arg):
+            remote.append(arg)
+        else:
+            return None
+    return ' '.join(map(pipes.quote, remote))
+
+
+def parse_address(address):
+    """
+    Split the ``host:port`` (or ``port``) *address* of a worker.
+    """
+    host, sep, port = address.strip().rpartition(':')
+    return host or 'localhost', int(port or DEFAULT_PORT)
+
+
+def _recv_load(sock):
+    frame_type, payload = recv_frame(sock)
+    if frame_type != LOAD:
+        raise EOFError('Unexpected reply from the compile worker')
+    running, capacity = payload.split()
+    return int(running), int(capacity)
+
+
+class RemoteWorker:
+    """
+    A compile worker listening on *host* and *port*.
+
+    Anything with the attributes :attr:`address`, :attr:`capacity`,
+    :attr:`running`, :attr:`in_flight` and the methods
+    :meth:`query_load` and :meth:`compile` can be registered with a
+    :class:`WorkerSet`, the TCP protocol is just the one that ships
+    with ipymake.
+    """
+    def __init__(self, host, port=DEFAULT_PORT):
+        self.host = host
+        self.port = port
+        self.address = '%s:%d' % (host, port)
+        self.capacity = None
+        # The compiles the worker reported running, and the ones of
+        # this coordinator that were running on it at that time.
+        self.running = 0
+        self.in_flight_at_report = 0
+        self.in_flight = 0
+        self.down_until = 0.0
+
+    def _connect(self, timeout):
+        sock = socket.create_connection((self.host, self.port), CONNECT_TIMEOUT)
+        sock.settimeout(timeout)
+        return sock
+
+    def query_load(self):
+        """
+        Ask the worker for its load and capacity.
+        """
+        sock = self._connect(CONNECT_TIMEOUT)
+        try:
+            send_frame(sock, QUERY, '')
+            self.running, self.capacity = _recv_load(sock)
+            self.in_flight_at_report = self.in_flight
+        finally:
+            sock.close()
+
+    def get_load(self):
+        others = max(0, self.running - self.in_flight_at_report)
+        return float(self.in_flight + others) / max(1, self.capacity)
+    load = property(get_load)
+
+    def compile(self, command, unit_name, unit):
+        """
+        Compile the translation unit *unit* (the contents of the file
+        *unit_name*) with *command* on the worker.
+
+        :returns: tuple(exit value, diagnostics, object file contents),
+            the object file is None when the compile failed.
+        :raises: :class:`EnvironmentError` or :class:`EOFError` if the
+            worker could not run the compile.
+        """
+        sock = self._connect(COMPILE_TIMEOUT)
+        try:
+            send_frame(sock, COMMAND, command)
+            send_frame(sock, NAME, unit_name)
+            send_frame(sock, UNIT, unit)
+            diagnostics, objdata = '', None
+            while True:
+                frame_type, payload = recv_frame(sock)
+                if frame_type == LOAD:
+                    running, self.capacity = map(int, payload.split())
+                    self.running = running
+                    self.in_flight_at_report = self.in_flight
+                elif frame_type == DIAGNOSTICS:
+                    diagnostics = payload
+                elif frame_type == OBJECT:
+                    objdata = payload
+                elif frame_type == EXIT:
+                    return int(payload), diagnostics, objdata
+                elif frame_type == FAILURE:
+                    raise EOFError(payload)
+        finally:
+            sock.close()
+
+
+class WorkerSet:
+    """
+    The registered compile workers of a build.
+    """
+    def __init__(self, workers):
+        self.workers = list(workers)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Reserve a compile slot on the least loaded worker.
+
+        :returns: The worker, or None if every worker is full or down.
+        """
+        now = time.time()
+        for worker in self.workers:
+            if worker.capacity is None and worker.down_until <= now:
+                try:
+                    worker.query_load()
+                except(EnvironmentError, EOFError, ValueError):
+                    self._mark_down(worker)
+        self._lock.acquire()
+        try:
+            candidates = [(worker.load, i, worker) for i, worker in enumerate(self.workers)
+                          if worker.capacity and worker.down_until <= now]
+            if not candidates:
+                return None
+            load, i, worker = min(candidates)
+            if load >= 1.0:
+                return None
+            worker.in_flight += 1
+            return worker
+        finally:
+            self._lock.release()
+
+    def release(self, worker, failed=False):
+        """
+        Give back the compile slot of *worker*. A *failed* worker is
+        not used again for :data:`RETRY_INTERVAL` seconds.
+        """
+        self._lock.acquire()
+        try:
+            worker.in_flight -= 1
+        finally:
+            self._lock.release()
+        if failed:
+            self._mark_down(worker)
+
+    def _mark_down(self, worker):
+        self._lock.acquire()
+        try:
+            worker.down_until = time.time() + RETRY_INTERVAL
+            # Ask for the load again when it comes back.
+            worker.capacity = None
+        finally:
+            self._lock.release()
+
+
+_worker_sets = {}
+
+def get_worker_set(addresses):
+    """
+    The :class:`WorkerSet` of the comma separated worker *addresses*,
+    kept for the whole build so the load of the workers is known
+    across the compiles.
+    """
+    if not _worker_sets.has_key(addresses):
+        workers = [RemoteWorker(*parse_address(address))
+                   for address in addresses.split(',') if address.strip()]
+        _worker_sets[addresses] = WorkerSet(workers)
+    return _worker_sets[addresses]
+
+def reset_worker_sets():
+    """
+    Forget the worker sets of the previous build, so that the load
+    and the down workers it saw are asked for again.
+    """
+    _worker_sets.clear()
+
+
+def can_distribute(source):
+    """
+    Determine if *source* is compiled by a compiler the workers run.
+    """
+    return is_c_source(source) or is_cxx_source(source)
+
+def preprocess(base_command, source, objfile, depfile):
+    """
+    Run the preprocessor of *base_command* on *source*, writing the
+    dependency file *depfile* for *objfile* on the way.
+
+    :returns: tuple(file name, contents) of the translation unit, or
+        None if the source could not be preprocessed.
+    """
+    command = '%s -E -MMD -MF %s -MT %s %s' % (base_command, depfile, objfile, source)
+    proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, close_fds=True)
+    unit, errors = proc.communicate()
+    if proc.returncode != 0:
+        return None
+    extension = '.i'
+    if is_cxx_source(source):
+        extension = '.ii'
+    return os.path.splitext(os.path.basename(source))[0] + extension, unit
+
+def compile_remote(workers, base_command, source, objfile, depfile):
+    """
+    Compile *source* to *objfile* on the least loaded of *workers*.
+
+    :returns: tuple(worker address, exit value, diagnostic lines), or
+        None if the object file has to be compiled locally.
+    """
+    command = remote_command(base_command)
+    if command is None:
+        return None
+    # Preprocess before taking a slot, a worker slot is only held for
+    # as long as the worker compiles.
+    translation_unit = preprocess(base_command, source, objfile, depfile)
+    if translation_unit is None:
+        # Let the local compiler report the error.
+        return None
+    worker = workers.acquire()
+    if worker is None:
+        return None
+    failed = False
+    try:
+        try:
+            exit_value, diagnostics, objdata = worker.compile(command, *translation_unit)
+        except(EnvironmentError, EOFError, ValueError):
+            failed = True
+            count('dist_failures')
+            return None
+    finally:
+        workers.release(worker, failed)
+
+    # The object file may be a hard link into the object cache, never
+    # write into it.
+    if os.path.exists(objfile):
+        os.remove(objfile)
+    if objdata is not None:
+        outfile = open(objfile, 'wb')
+        try:
+            outfile.write(objdata)
+        finally:
+            outfile.close()
+    count('dist_remote')
+    return worker.address, exit_value, diagnostics.splitlines()
+
+
+class CompileHandler(SocketServer.BaseRequestHandler):
+    """
+    Serves a single request of a coordinator.
+    """
+    def handle(self):
+        server = self.server
+        try:
+            frame_type, payload = recv_frame(self.request)
+            if frame_type == QUERY:
+                self.send_load()
+                return
+            if frame_type != COMMAND:
+                return
+            command = payload
+            frame_type, unit_name = recv_frame(self.request)
+            if frame_type != NAME:
+                return
+            frame_type, unit = recv_frame(self.request)
+            if frame_type != UNIT:
+                return
+
+            argv = self.check_command(command, unit_name)
+            if isinstance(argv, str):
+                send_frame(self.request, FAILURE, argv)
+                return
+            server.slots.acquire()
+            try:
+                server.add_running(1)
+                try:
+                    self.send_load()
+                    self.compile(argv, unit_name, unit)
+                finally:
+                    server.add_running(-1)
+            finally:
+                server.slots.release()
+        except(socket.error, EOFError):
+            # The coordinator went away, it compiles locally.
+            pass
+
+    def send_load(self):
+        send_frame(self.request, LOAD, '%d %d' % (self.server.running,
+                                                  self.server.capacity))
+
+    def check_command(self, command, unit_name):
+        """
+        :returns: The argument list of *command*, or the reason it is
+            refused.
+        """
+        try:
+            argv = shlex.split(command)
+        except(ValueError), error:
+            return 'Bad command line: %s' % error
+        if not argv or not self.server.compiler_paths.has_key(argv[0]):
+            return 'Compiler not allowed: %s' % (argv and argv[0])
+        # The compiler of the worker's own PATH, never a path of the
+        # coordinator's choosing.
+        argv[0] = self.server.compiler_paths[argv[0]]
+        for arg in argv[1:]:
+            if not allowed_option(arg):
+                return 'Option not allowed: %s' % arg
+        if os.path.basename(unit_name) != unit_name or \
+                os.path.splitext(unit_name)[1] not in ('.i', '.ii'):
+            return 'Bad translation unit name: %s' % unit_name
+        return argv
+
+    def compile(self, argv, unit_name, unit):
+        tempdir = tempfile.mkdtemp(prefix='ipymake-worker-')
+        try:
+            unit_path = os.path.join(tempdir, unit_name)
+            objfile = os.path.join(tempdir, 'out.o')
+            outfile = open(unit_path, 'wb')
+            try:
+                outfile.write(unit)
+            finally:
+                outfile.close()
+            try:
+                proc = subprocess.Popen(argv + ['-c', unit_path, '-o', objfile],
+                                        cwd=tempdir, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, close_fds=True)
+            except(OSError), error:
+                send_frame(self.request, FAILURE, str(error))
+                return
+            diagnostics = proc.communicate()[0]
+            if diagnostics:
+                send_frame(self.request, DIAGNOSTICS, diagnostics)
+            if proc.returncode == 0 and os.path.exists(objfile):
+                infile = open(objfile, 'rb')
+                try:
+                    send_frame(self.request, OBJECT, infile.read())
+                finally:
+                    infile.close()
+            send_frame(self.request, EXIT, str(proc.returncode))
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+
+class CompileWorkerServer(SocketServer.ThreadingTCPServer):
+    """
+    A compile worker, running up to *capacity* compiles at the same
+    time.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='localhost', port=DEFAULT_PORT, capacity=None,
+                 compilers=ALLOWED_COMPILERS):
+        if capacity is None:
+            capacity = cpu_count()
+        self.capacity = capacity
+        self.compilers = compilers
+        self.compiler_paths = find_compilers(compilers)
+        self.slots = threading.Semaphore(capacity)
+        self.running = 0
+        self._lock = threading.Lock()
+        SocketServer.ThreadingTCPServer.__init__(self, (host, port), CompileHandler)
+
+    def add_running(self, increment):
+        self._lock.acquire()
+        try:
+            self.running += increment
+        finally:
+            self._lock.release()
+
+
+def find_compilers(compilers):
+    """
+    Look up the *compilers* on the :envvar:`PATH` of the worker. A
+    name with a ``/`` in it is not looked up, the coordinator only
+    names the compiler.
+
+    :returns: The dictionary of compiler name to its path, for the
+        ones that were found.
+    """
+    paths = {}
+    for name in compilers:
+        if '/' in name:
+            continue
+        for directory in os.environ.get('PATH', '').split(os.pathsep):
+            # Not the directory the worker happens to run in.
+            if not os.path.isabs(directory):
+                continue
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                paths[name] = path
+                break
+    return paths
+
+
+def cpu_count():
+    try:
+        return max(1, os.sysconf('SC_NPROCESSORS_ONLN'))
+    except(ValueError, OSError, AttributeError):
+        return 1
+
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage='python -m ipymake.distributed [options]',
+                          description='Run an ipymake compile worker.')
+    parser.add_option('--host', dest='host', default='localhost',
+                      help='Listen on HOST (default: localhost)')
+    parser.add_option('--port', dest='port', type='int', default=DEFAULT_PORT,
+                      help='Listen on PORT (default: %d)' % DEFAULT_PORT)
+    parser.add_option('--capacity', dest='capacity', type='int',
+                      help='Run up to CAPACITY compiles at the same time '
+                      '(default: the number of processors)')
+    parser.add_option('--allow-compiler', dest='compilers', action='append',
+                      metavar='COMPILER',
+                      help='Also run COMPILER, a name looked up on the PATH '
+                      '(default: %s)' % ', '.join(ALLOWED_COMPILERS))
+    options, args = parser.parse_args(argv)
+    compilers = ALLOWED_COMPILERS + tuple(options.compilers or ())
+    server = CompileWorkerServer(options.host, options.port, options.capacity, compilers)
+    print 'ipymake compile worker on %s:%d, capacity %d' % \
+        (options.host, options.port, server.capacity)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except(KeyboardInterrupt):
+        pass
+
+
+if __name__ == '__main__':
+    main()
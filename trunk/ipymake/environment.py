@@ -5,8 +5,9 @@
 """
 import os
 import shelve
-import pickle, csv
-import shutil
+import pickle
+import cPickle
+import sqlite3
 
 class VerbosityLevels:
     NORMAL             = 0
@@ -15,88 +16,419 @@ class VerbosityLevels:
     EXTREMELY_VERBOSE  = 3
 
 
-class DictDB(dict):
-    """Alternate DB based on a dict subclass
+class RecordMap(dict):
+    """
+    A map of small records (one per file, object or target) that is
+    stored record by record in the :class:`StateDB`. A record is only
+    read from the database the first time it is looked up and only
+    the records that were set or removed are written back. Records
+    must be replaced, changing a record in place is not noticed.
+    """
+    def __init__(self, db, name):
+        dict.__init__(self)
+        self.db = db
+        self.name = name
+        self.dirty = set()
+        self.deleted = set()
+        self.all_loaded = False
+        # Set by clear, the records in the database are all removed
+        # on the next write.
+        self.cleared = False
 
-    Runs like gdbm's fast mode (all writes all delayed until close).
-    While open, the whole dict is kept in memory.  Start-up and
-    close time's are potentially long because the whole dict must be
-    read or written to disk.
-    
-    Input file format is automatically discovered.
-    Output file format is selectable between pickle, json, and csv.
-    All three are backed by fast C implementations.
-    
-    Recipe from Python shelve
+    def _load(self, key):
+        if self.all_loaded or key in self.deleted:
+            return False
+        row = self.db.query('SELECT value FROM records WHERE map = ? AND key = ?',
+                            (self.name, key))
+        if row is None:
+            return False
+        dict.__setitem__(self, key, cPickle.loads(str(row[0])))
+        return True
+
+    def _load_all(self):
+        if self.all_loaded:
+            return
+        for key, value in self.db.query_all('SELECT key, value FROM records WHERE map = ?',
+                                            (self.name,)):
+            if not dict.__contains__(self, key) and not key in self.deleted:
+                dict.__setitem__(self, key, cPickle.loads(str(value)))
+        self.all_loaded = True
+
+    def __missing__(self, key):
+        if self._load(key):
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self._load(key)
+
+    def has_key(self, key):
+        return self.__contains__(key)
+
+    def get(self, key, default=None):
+        if self.__contains__(key):
+            return dict.__getitem__(self, key)
+        return default
+
+    def setdefault(self, key, default=None):
+        if not self.__contains__(key):
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.dirty.add(key)
+        self.deleted.discard(key)
+
+    def __delitem__(self, key):
+        if not self.__contains__(key):
+            raise KeyError(key)
+        dict.__delitem__(self, key)
+        self.dirty.discard(key)
+        self.deleted.add(key)
+
+    def pop(self, key, *default):
+        if self.__contains__(key):
+            value = dict.__getitem__(self, key)
+            self.__delitem__(key)
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def keys(self):
+        self._load_all()
+        return dict.keys(self)
+
+    def values(self):
+        self._load_all()
+        return dict.values(self)
+
+    def items(self):
+        self._load_all()
+        return dict.items(self)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def clear(self):
+        """
+        Remove every record, without reading any of them.
+        """
+        dict.clear(self)
+        self.dirty.clear()
+        self.deleted.clear()
+        self.all_loaded = True
+        self.cleared = True
+
+    def __reduce__(self):
+        # Pickled (for the worker processes) as the plain dictionary
+        # of the records loaded so far.
+        return (dict, (dict.copy(self),))
+
+    def write(self, conn):
+        if self.cleared:
+            conn.execute('DELETE FROM records WHERE map = ?', (self.name,))
+            self.cleared = False
+        for key in self.dirty:
+            conn.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?)',
+                         (self.name, key, _blob(dict.__getitem__(self, key))))
+        for key in self.deleted:
+            conn.execute('DELETE FROM records WHERE map = ? AND key = ?',
+                         (self.name, key))
+        self.dirty.clear()
+        self.deleted.clear()
+
+
+class DeletedRecord:
+    """
+    Stands for a record that was removed from a :class:`RecordMap`,
+    in the changes a worker process sends back.
+    """
+    def __repr__(self):
+        return 'DeletedRecord()'
+
+
+def _blob(value):
+    return sqlite3.Binary(cPickle.dumps(value, -1))
+
+
+def _record_key(item):
+    """
+    The key of an item of a list value when merging it: the name of a
+    named record (a compiled binary, an install file, ...), else the
+    item itself.
+    """
+    name = getattr(item, 'name', None)
+    if name is not None:
+        return ('name', name)
+    return ('value', cPickle.dumps(item, -1))
+
+
+def merge_values(base, ours, theirs):
     """
+    Merge the changes made to the value *base* in this build, giving
+    *ours*, with the value *theirs* another build wrote in the
+    meantime. A list keeps the items of *theirs*, without the ones we
+    removed, and gets the ones we added or changed, an item of a list
+    of named records replacing the record of the same name. A
+    dictionary is merged key by key the same way. Any other value is
+    replaced by ours.
+    """
+    if isinstance(ours, list) and isinstance(theirs, list):
+        base = dict([(_record_key(item), cPickle.dumps(item, -1))
+                     for item in (base or [])])
+        ours_keys = [_record_key(item) for item in ours]
+        removed = set(base.keys()) - set(ours_keys)
+        changed = [(key, item) for key, item in zip(ours_keys, ours)
+                   if base.get(key) != cPickle.dumps(item, -1)]
+        replaced = removed | set([key for key, item in changed])
+        return [item for item in theirs if not _record_key(item) in replaced] + \
+            [item for key, item in changed]
+    if isinstance(ours, dict) and isinstance(theirs, dict):
+        base = base or {}
+        merged = dict(theirs)
+        for key in base:
+            if not key in ours:
+                merged.pop(key, None)
+        for key, value in ours.items():
+            if not key in base or cPickle.dumps(base[key], -1) != cPickle.dumps(value, -1):
+                merged[key] = value
+        return merged
+    return ours
+
+
+class StateDB(dict):
+    """
+    The build state, kept in a sqlite database.
+
+    Every value is a record of its own and is only read when it is
+    first looked up. :meth:`sync` writes back the values that changed
+    since they were read, in a single transaction, so parallel builds
+    of the same tree can share the database without losing each
+    other's records: a value another build wrote since it was read is
+    merged with it first (see :func:`merge_values`). The names in
+    *maps* hold a :class:`RecordMap` each, whose records are read and
+    written one at a time.
 
-    def __init__(self, filename, flag=None, mode=None, format=None, *args, **kwds):
-        self.flag = flag or 'c'             # r=readonly, c=create, or n=new
-        self.mode = mode                    # None or octal triple like 0x666
-        self.format = format or 'pickle'       # csv,  or pickle
+    *legacy_filename* is a pickled dictionary, as written by older
+    versions, that is imported when the database does not exist yet.
+    """
+    TIMEOUT = 30.0
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value BLOB)',
+        'CREATE TABLE IF NOT EXISTS records (map TEXT, key TEXT, value BLOB, '
+        'PRIMARY KEY (map, key))',
+        ]
+
+    def __init__(self, filename, maps=(), legacy_filename=None):
+        dict.__init__(self)
         self.filename = filename
-        if flag != 'n' and os.access(filename, os.R_OK):
-            file = open(filename, 'rb')
+        self.blobs = {}
+        self.deleted = set()
+        self._conn = None
+        self._pid = None
+        for name in maps:
+            dict.__setitem__(self, name, RecordMap(self, name))
+
+        if legacy_filename is not None and not os.path.exists(filename) \
+                and os.access(legacy_filename, os.R_OK):
+            self.import_pickle(legacy_filename)
+
+    def connection(self):
+        """
+        The connection to the database, which is created if it does
+        not exist. A forked worker process opens a connection of its
+        own, sqlite connections must not be shared across a fork.
+        """
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.filename, timeout=self.TIMEOUT,
+                                         isolation_level=None)
+            self._conn.text_factory = str
+            self._pid = os.getpid()
             try:
-                self.load(file)
-            finally:
-                file.close()
-        self.update(*args, **kwds)
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            except(sqlite3.DatabaseError):
+                pass
+            for statement in self.SCHEMA:
+                self._conn.execute(statement)
+        return self._conn
 
-    def sync(self):
-        if self.flag == 'r':
+    def query(self, sql, args=()):
+        """
+        Get the first row of the result of *sql*, or None. Looking
+        something up does not create the database.
+        """
+        if self._conn is None and not os.path.exists(self.filename):
+            return None
+        return self.connection().execute(sql, args).fetchone()
+
+    def query_all(self, sql, args=()):
+        if self._conn is None and not os.path.exists(self.filename):
+            return []
+        return self.connection().execute(sql, args).fetchall()
+
+    def _load(self, name):
+        if name in self.deleted:
+            return False
+        row = self.query('SELECT value FROM state WHERE name = ?', (name,))
+        if row is None:
+            return False
+        blob = str(row[0])
+        dict.__setitem__(self, name, cPickle.loads(blob))
+        self.blobs[name] = blob
+        return True
+
+    def __missing__(self, name):
+        if self._load(name):
+            return dict.__getitem__(self, name)
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or self._load(name)
+
+    def has_key(self, name):
+        return self.__contains__(name)
+
+    def get(self, name, default=None):
+        if self.__contains__(name):
+            return dict.__getitem__(self, name)
+        return default
+
+    def setdefault(self, name, default=None):
+        if not self.__contains__(name):
+            self[name] = default
+        return dict.__getitem__(self, name)
+
+    def __setitem__(self, name, value):
+        current = dict.get(self, name)
+        if isinstance(current, RecordMap):
+            # Keep the record map, just replace its records.
+            for key in current.keys():
+                if not key in value:
+                    del current[key]
+            current.update(value)
             return
-        filename = self.filename
-        tempname = filename + '.tmp'
-        file = open(tempname, 'wb')
+        dict.__setitem__(self, name, value)
+        self.deleted.discard(name)
+
+    def __delitem__(self, name):
+        if not self.__contains__(name):
+            raise KeyError(name)
+        dict.__delitem__(self, name)
+        self.deleted.add(name)
+
+    def pop(self, name, *default):
+        if self.__contains__(name):
+            value = dict.__getitem__(self, name)
+            self.__delitem__(name)
+            return value
+        if default:
+            return default[0]
+        raise KeyError(name)
+
+    def sync(self):
+        """
+        Write the values and records that changed to the database.
+        """
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
         try:
-            self.dump(file)
-        except Exception:
-            file.close()
-            os.remove(tempname)
+            for name, value in dict.items(self):
+                if isinstance(value, RecordMap):
+                    value.write(conn)
+                    continue
+                blob = cPickle.dumps(value, -1)
+                base = self.blobs.get(name)
+                if base == blob:
+                    continue
+                row = conn.execute('SELECT value FROM state WHERE name = ?',
+                                   (name,)).fetchone()
+                if row is not None and str(row[0]) != base:
+                    # Changed by another build since it was read.
+                    if base is not None:
+                        base = cPickle.loads(base)
+                    value = merge_values(base, value, cPickle.loads(str(row[0])))
+                    dict.__setitem__(self, name, value)
+                    blob = cPickle.dumps(value, -1)
+                conn.execute('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                             (name, sqlite3.Binary(blob)))
+                self.blobs[name] = blob
+            for name in self.deleted:
+                conn.execute('DELETE FROM state WHERE name = ?', (name,))
+                self.blobs.pop(name, None)
+            self.deleted.clear()
+        except:
+            conn.execute('ROLLBACK')
             raise
-        file.close()
-        shutil.move(tempname, self.filename)    # atomic commit
-        if self.mode is not None:
-            os.chmod(self.filename, self.mode)
+        conn.execute('COMMIT')
+
+    def compact(self):
+        """
+        Give the space of the overwritten and removed records back.
+        """
+        self.connection().execute('VACUUM')
 
     def close(self):
+        """
+        Write the changes, and compact the database if more than a
+        quarter of it is unused.
+        """
         self.sync()
+        conn = self.connection()
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        pages = conn.execute('PRAGMA page_count').fetchone()[0]
+        if free_pages * 4 > pages:
+            self.compact()
+        conn.close()
+        self._conn = None
 
-    def dump(self, file):
-        if self.format == 'csv':
-            csv.writer(file).writerows(self.iteritems())
-        elif self.format == 'pickle':
-            pickle.dump(self.items(), file, -1)
-        else:
-            raise NotImplementedError('Unknown format: %r' % self.format)
-
-    def load(self, file):
-        # try formats from most restrictive to least restrictive
-        for loader in (pickle.load, csv.reader):
-            file.seek(0)
-            try:
-                return self.update(loader(file))
-            except Exception:
-                pass
-        raise ValueError('File not in recognized format')
+    def import_pickle(self, filename):
+        """
+        Import the values of the pickled dictionary *filename*.
+        """
+        infile = open(filename, 'rb')
+        try:
+            items = pickle.load(infile)
+        finally:
+            infile.close()
+        for name, value in items:
+            self[name] = value
+        self.sync()
 
 
 
-class Environment(DictDB):
+class Environment(StateDB):
     """
     Holds all of the Ipymake environmental variables
     """
-    CACHE_FILENAME = './ipymake_cache.db'
+    CACHE_FILENAME = './ipymake_state.db'
+    # The whole-file pickle cache of the older versions.
+    LEGACY_CACHE_FILENAME = './ipymake_cache.db'
+    # The per file and per target records.
+    RECORD_MAPS = ('object_dependencies', 'object_signatures', 'fingerprints',
+                   'target_durations', 'target_signatures')
 
     def __init__(self, build_path='./build', prefix="/tmp", binary_prefix="/bin",
 		 library_prefix="/lib", share_prefix="/share", 
-		 include_prefix="/include", compiled_binaries=[], install_files=[],
-		 built_targets={}, verbosity_level=VerbosityLevels.NORMAL, load_from_cache=True ):
+		 include_prefix="/include", compiled_binaries=None, install_files=None,
+		 built_targets=None, verbosity_level=VerbosityLevels.NORMAL, load_from_cache=True,
+		 jobs=1, use_fingerprints=False, compile_mode='native',
+		 object_cache_dir=None, object_cache_size=None, dist_workers=None,
+		 profile=None ):
 	        
-        DictDB.__init__(self, filename=self.CACHE_FILENAME)
+        StateDB.__init__(self, self.CACHE_FILENAME, self.RECORD_MAPS,
+                         self.LEGACY_CACHE_FILENAME)
 
-        if not os.path.exists(self.CACHE_FILENAME) or not load_from_cache:
+        if not self.has_key('build_path') or not load_from_cache:
             self.rpath = lambda path : os.path.realpath(path)
 	
 	    #paths
@@ -108,16 +440,39 @@ class Environment(DictDB):
             self['include_prefix'] = include_prefix
 	
 	    # Compilation
-            self['compiled_binaries'] = compiled_binaries
-            self['install_files'] = install_files
+            self['compiled_binaries'] = list(compiled_binaries or [])
+            self['install_files'] = list(install_files or [])
    
 	    # System Parameters
             self['verbosity_level'] = verbosity_level
 
+        if not load_from_cache:
+            # Start without the records of the previous builds too.
+            for name in self.RECORD_MAPS:
+                dict.__getitem__(self, name).clear()
             
 
         # House Keeping
-        self._built_targets = built_targets
+        self._built_targets = dict(built_targets or {})
+
+        # Runtime only settings, these are given on the command line
+        # and are not kept in the cache.
+        self._jobs = jobs
+        self._use_fingerprints = use_fingerprints
+        self._compile_mode = compile_mode
+        # The object cache is shared by all workspaces, so its
+        # defaults come from the process environment.
+        if object_cache_dir is None:
+            object_cache_dir = os.environ.get('IPYMAKE_OBJECT_CACHE')
+        if object_cache_size is None:
+            object_cache_size = int(os.environ.get('IPYMAKE_OBJECT_CACHE_SIZE', 1024))
+        self._object_cache_dir = object_cache_dir
+        self.object_cache_size = object_cache_size
+        # So are the compile workers.
+        if dist_workers is None:
+            dist_workers = os.environ.get('IPYMAKE_WORKERS')
+        self._dist_workers = dist_workers
+        self._profile = profile
         
         self.install_dirs = [ self.binary_install_path,
                                       self.library_install_path,
@@ -163,10 +518,61 @@ class Environment(DictDB):
     def set_install_files(self, value): self['install_files'] = value
     install_files = property(get_install_files, set_install_files)
 
+    def get_object_dependencies(self): 
+        return self['object_dependencies']
+    object_dependencies = property(get_object_dependencies)
+
+    def get_object_signatures(self): 
+        return self['object_signatures']
+    object_signatures = property(get_object_signatures)
+
+    def get_fingerprints(self): 
+        return self['fingerprints']
+    fingerprints = property(get_fingerprints)
+
+    def get_target_durations(self): 
+        return self['target_durations']
+    target_durations = property(get_target_durations)
+
+    def get_target_signatures(self): 
+        return self['target_signatures']
+    target_signatures = property(get_target_signatures)
+
     def get_built_targets(self): return self._built_targets
     def set_built_targets(self, value): self._built_targets = value
     built_targets = property(get_built_targets, set_built_targets)
 
+    def get_jobs(self): return self._jobs
+    def set_jobs(self, value): self._jobs = max(1, int(value))
+    jobs = property(get_jobs, set_jobs)
+
+    def get_use_fingerprints(self): return self._use_fingerprints
+    def set_use_fingerprints(self, value): self._use_fingerprints = bool(value)
+    use_fingerprints = property(get_use_fingerprints, set_use_fingerprints)
+
+    def get_compile_mode(self): return self._compile_mode
+    def set_compile_mode(self, value): self._compile_mode = value
+    compile_mode = property(get_compile_mode, set_compile_mode)
+
+    def get_object_cache_dir(self): return self._object_cache_dir
+    def set_object_cache_dir(self, value): self._object_cache_dir = value
+    object_cache_dir = property(get_object_cache_dir, set_object_cache_dir)
+
+    # Given in megabytes, kept in bytes.
+    def get_object_cache_size(self): return self._object_cache_size
+    def set_object_cache_size(self, value): self._object_cache_size = int(value) * 1024 * 1024
+    object_cache_size = property(get_object_cache_size, set_object_cache_size)
+
+    # The comma separated host:port addresses of the compile workers.
+    def get_dist_workers(self): return self._dist_workers
+    def set_dist_workers(self, value): self._dist_workers = value
+    dist_workers = property(get_dist_workers, set_dist_workers)
+
+    # The path of the trace file of a profiled build.
+    def get_profile(self): return self._profile
+    def set_profile(self, value): self._profile = value
+    profile = property(get_profile, set_profile)
+
     def get_verbosity_level(self): return self['verbosity_level']
     def set_verbosity_level(self, value): self['verbosity_level'] = value
     verbosity_level = property(get_verbosity_level, set_verbosity_level)
@@ -179,6 +585,65 @@ class Environment(DictDB):
     share_install_path =  property(lambda self: os.path.realpath(self['install_prefix'] + self['share_prefix']))        
     
 
+    def snapshot(self):
+        """
+        Take a snapshot of the cached values, to find out later
+        which of them were changed.
+        """
+        return dict([(key, cPickle.dumps(value, -1)) for key, value in dict.items(self)
+                     if not isinstance(value, RecordMap)])
+
+    def changes_since(self, snapshot):
+        """
+        :returns: The dictionary of the cached values that were added
+            or changed since *snapshot* was taken. The records of a
+            record map that were removed are a :class:`DeletedRecord`.
+        """
+        changes = {}
+        for key, value in dict.items(self):
+            if isinstance(value, RecordMap):
+                # Only the records that were set or removed are sent back.
+                if value.dirty or value.deleted:
+                    records = dict([(k, dict.__getitem__(value, k))
+                                    for k in value.dirty])
+                    for k in value.deleted:
+                        records[k] = DeletedRecord()
+                    changes[key] = records
+                continue
+            if snapshot.get(key) != cPickle.dumps(value, -1):
+                changes[key] = value
+        return changes
+
+    def merge_changes(self, changes):
+        """
+        Merge the values changed by another build (normally a worker
+        process) into this environment.  Dictionaries are updated in
+        place, the records of a record map that were removed are
+        removed here too, lists of named records (compiled binaries
+        and install files) have their records replaced by name,
+        anything else is overwritten.
+        """
+        for key, value in changes.items():
+            current = self.get(key)
+            if isinstance(current, RecordMap):
+                for k, record in value.items():
+                    if isinstance(record, DeletedRecord):
+                        current.pop(k, None)
+                    else:
+                        current[k] = record
+            elif isinstance(current, dict) and isinstance(value, dict):
+                current.update(value)
+            elif isinstance(current, list) and isinstance(value, list):
+                names = [getattr(item, 'name', None) for item in value]
+                merged = filter(lambda item: getattr(item, 'name', None) is None \
+                                    or not getattr(item, 'name') in names, current)
+                for item in value:
+                    if not item in merged:
+                        merged.append(item)
+                self[key] = merged
+            else:
+                self[key] = value
+
     def __repr__(self):
         binaries_str = '[ ' + ', '.join(map(lambda b: repr(b), self.compiled_binaries))+' ]'
 	files_str = '[ ' + ', '.join(map(lambda b: repr(b), self.install_files)) + ' ]'
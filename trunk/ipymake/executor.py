@@ -0,0 +1,149 @@
+"""
+:mod:`executor` -- Native Command Execution
+==============================================
+
+Runs the build commands (compilers, linkers, archivers, ...) as
+child processes without going through IPython.  The output of a
+command is streamed as it is produced and kept for the caller, the
+result of every command comes back as a :class:`CommandResult`.
+Nothing in here needs an IPython instance, so it can be used from
+worker threads and worker processes as well.
+
+"""
+import sys
+import os
+import re
+import time
+import threading
+import subprocess
+
+
+class BuildError(RuntimeError):
+    """
+    Raised when a build step fails. When the failure comes from a
+    command, its :class:`CommandResult` is kept in :attr:`result`.
+    """
+    def __init__(self, message, result=None):
+        RuntimeError.__init__(self, message)
+        self.result = result
+
+    def get_output(self):
+        if self.result is None:
+            return []
+        return self.result.stdout + self.result.stderr
+    output = property(get_output)
+
+
+class CommandResult:
+    """
+    The outcome of a single command.
+    """
+    def __init__(self, command, exit_value, wall_time, stdout, stderr):
+        self.command = command
+        self.exit_value = exit_value
+        self.wall_time = wall_time
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def get_succeeded(self): return self.exit_value == 0
+    succeeded = property(get_succeeded)
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return '%s(%s, %s, %.3f)' % (class_name, repr(self.command),
+                                     self.exit_value, self.wall_time)
+
+
+def _pump(pipe, lines, outfile):
+    """
+    Read the lines from *pipe* until it is closed, keeping them in
+    *lines* and echoing them to *outfile* if it is not None.
+    """
+    for line in iter(pipe.readline, ''):
+        lines.append(line.rstrip('\n'))
+        if outfile is not None:
+            outfile.write(line)
+            outfile.flush()
+    pipe.close()
+
+
+def run_command(cmd_string, stream=True, cwd=None):
+    """
+    Run *cmd_string* in a subshell. When *stream* is true the output
+    of the command is passed through to :data:`sys.stdout` and
+    :data:`sys.stderr` while it runs.
+
+    :returns: The :class:`CommandResult` of the command.
+    """
+    stdout, stderr = [], []
+    start_time = time.time()
+    proc = subprocess.Popen(cmd_string, shell=True, cwd=cwd,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            close_fds=True)
+    if stream:
+        out_echo, err_echo = sys.stdout, sys.stderr
+    else:
+        out_echo, err_echo = None, None
+
+    # Both pipes have to be drained at the same time, otherwise a
+    # command that fills one of them while we block on the other
+    # would never finish.
+    err_pump = threading.Thread(target=_pump, args=(proc.stderr, stderr, err_echo))
+    err_pump.setDaemon(True)
+    err_pump.start()
+    _pump(proc.stdout, stdout, out_echo)
+    err_pump.join()
+
+    exit_value = proc.wait()
+    return CommandResult(cmd_string, exit_value, time.time() - start_time,
+                         stdout, stderr)
+
+
+def execute(cmd_string, target="", stream=True, cwd=None):
+    """
+    Run *cmd_string* like :func:`run_command`, but raise a
+    :class:`BuildError` when it does not exit with 0.
+    """
+    return check_result(run_command(cmd_string, stream, cwd), target)
+
+
+def check_result(result, target=""):
+    """
+    Raise a :class:`BuildError` if the command of *result* did not
+    exit with 0.
+
+    :returns: *result*
+    """
+    if not result.succeeded:
+        raise BuildError("Bad exit value\nTARGET: %s \nCOMMAND: %s"
+                         "\nRETURN VALUE: %s" % (target, result.command, result.exit_value),
+                         result)
+    return result
+
+
+_VARIABLE_RE = re.compile(r'\$\$|\$\{([^}]+)\}|\$([a-zA-Z_][a-zA-Z0-9_]*(\.[a-zA-Z_][a-zA-Z0-9_]*)*)')
+
+def variable_references(cmd_string):
+    """
+    The expressions of the ``$name``, ``$name.attr`` and ``${expr}``
+    references in *cmd_string*, in the order they appear.
+    """
+    return [match.group(1) or match.group(2)
+            for match in _VARIABLE_RE.finditer(cmd_string)
+            if match.group(0) != '$$']
+
+def expand_variables(cmd_string, global_ns, local_ns=None):
+    """
+    Expand the IPython style ``$name``, ``$name.attr`` and ``${expr}``
+    references in *cmd_string* by evaluating them in the given
+    namespaces. ``$$`` is passed through to the shell as ``$``.
+    """
+    if local_ns is None:
+        local_ns = global_ns
+
+    def expand(match):
+        if match.group(0) == '$$':
+            return '$'
+        expr = match.group(1) or match.group(2)
+        return str(eval(expr, global_ns, local_ns))
+    return _VARIABLE_RE.sub(expand, cmd_string)
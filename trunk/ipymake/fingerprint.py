@@ -0,0 +1,108 @@
+"""
+:mod:`fingerprint` -- Content Based Change Detection
+=======================================================
+
+Timestamps alone make a fresh checkout or a branch switch look like
+every file changed. A :class:`FingerprintStore` remembers a digest
+of each file's content along with the modification time and size it
+was computed for, and only reads the file again when either of those
+changed.
+
+"""
+import hashlib
+from os import stat, path as ospath
+from stat import ST_MTIME, ST_SIZE
+
+MTIME, SIZE, DIGEST = range(3)
+
+
+class FingerprintStore:
+    """
+    Content digests keyed by file path. *records* is the dictionary
+    the digests are kept in, normally ``env.fingerprints`` so that
+    they persist between builds.
+    """
+    BLOCK_SIZE = 1 << 16
+
+    def __init__(self, records):
+        self.records = records
+        self.files_hashed = 0
+        # Absolute paths whose records are known to be current, only
+        # used while something (the build server) watches the files
+        # under the directories of trusted_directories.
+        self.trusted = None
+        self.trusted_directories = ()
+
+    def trust_cache(self, directories):
+        """
+        Trust the records of the files under *directories* looked at
+        from now on, until :meth:`invalidate` is called for them. Only
+        safe while the file changes under *directories* are being
+        watched, the files anywhere else are checked every time.
+        """
+        self.trusted = {}
+        self.trusted_directories = tuple([ospath.join(ospath.abspath(directory), '')
+                                          for directory in directories])
+
+    def invalidate(self, path):
+        """
+        Forget that the record of *path* is current.
+        """
+        if self.trusted is not None:
+            self.trusted.pop(ospath.abspath(path), None)
+
+    def digest(self, path):
+        """
+        Get the content digest of the file *path*, or None if the file
+        does not exist. The file is only read if its modification time
+        or size changed since the last digest was taken.
+        """
+        record = self.records.get(path)
+        if self.trusted is not None:
+            abspath = ospath.abspath(path)
+            if abspath.startswith(self.trusted_directories):
+                if record is not None and self.trusted.has_key(abspath):
+                    return record[DIGEST]
+                self.trusted[abspath] = True
+
+        try:
+            st = stat(path)
+        except(OSError):
+            self.records.pop(path, None)
+            return None
+
+        if record is not None and record[MTIME] == st[ST_MTIME] \
+                and record[SIZE] == st[ST_SIZE]:
+            return record[DIGEST]
+
+        digest = self.hash_file(path)
+        self.records[path] = (st[ST_MTIME], st[ST_SIZE], digest)
+        return digest
+
+    def hash_file(self, path):
+        """
+        Compute the content digest of the file *path*.
+        """
+        self.files_hashed += 1
+        md5 = hashlib.md5()
+        infile = open(path, 'rb')
+        try:
+            block = infile.read(self.BLOCK_SIZE)
+            while block:
+                md5.update(block)
+                block = infile.read(self.BLOCK_SIZE)
+        finally:
+            infile.close()
+        return md5.hexdigest()
+
+    def signature(self, command, paths):
+        """
+        Combine the command line that produces an output with the
+        digests of all of the files it reads. Any change to the command,
+        the flags, or the content of one of the files gives a different
+        signature.
+        """
+        md5 = hashlib.md5(command)
+        for path in paths:
+            md5.update('\0%s\0%s' % (path, self.digest(path)))
+        return md5.hexdigest()
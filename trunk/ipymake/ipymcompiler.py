@@ -8,13 +8,23 @@
 """
 import sys
 import os
+import re
+import keyword
+import hashlib
+import py_compile
 import ply.lex as lex
 from exceptions import SyntaxError
 import types
 import time
 from stat import *
 import information as ipyminfo
-import compiler
+import translator
+
+# How the target bodies are compiled: 'native' translates the shell
+# escapes to Python calls when the build file is compiled, 'ipython'
+# runs the bodies that use them through IPython.
+COMPILE_MODES = ('native', 'ipython')
+DEFAULT_MODE = 'native'
 
 
 class BuildLanguageLexer:
@@ -36,10 +46,13 @@ class BuildLanguageLexer:
    
         'TARGET_START',
         'TARGET_END',
+        'PATTERN_START',
       
         'CODE',
         'CRITICAL_CODE',
         'DEPENDENCY',
+        'INPUTS',
+        'OUTPUTS',
         
         'GLOBAL_VAR',
         'IMPORT'
@@ -59,11 +72,27 @@ class BuildLanguageLexer:
         #        t.type = 'TARGET_END'
         return t
     
+    # The input and output files of a target follow its dependencies:
+    #
+    #     target: dep-0 ... dep-n < input-0 ... input-n > output-0 ... output-n
+    #
+    # Neither a < nor a > can start a line of Python code.
+    #
+    def t_INTARGET_INPUTS(self, t):
+        r'[ ]*<[^>\n]*'
+        t.value = t.value.strip()[1:].split()
+        return t
+
+    def t_INTARGET_OUTPUTS(self, t):
+        r'[ ]*>[^\n]*'
+        t.value = t.value.strip()[1:].split()
+        return t
+
     def t_INTARGET_CODE(self, t):
         r'[ ]{4}.+'
 
         if t.value.strip() == 'pass':
-            self.lexer.pop_state()
+            t.lexer.pop_state()
             t.type = 'TARGET_END'
         elif t.value.strip().startswith('~'):
             t.type = 'CRITICAL_CODE'
@@ -83,10 +112,25 @@ class BuildLanguageLexer:
 
     def t_INTARGET_NEWLINE(self, t):
         r'\n'
-        self.lexer.lineno += 1
+        t.lexer.lineno += 1
         pass
 
 
+    # A pattern rule generates the files named by the pattern before
+    # the colon from the files named by the one after it, its body is
+    # a target body:
+    #
+    #     %_wrap.c: %.i
+    #         ~swig -python -o $output $input
+    #         pass
+    #
+    def t_PATTERN_START(self, t):
+        r'%[^\s:]*[ ]*:[ ]*[^\s]*%[^\s]*'
+        output_pattern, input_pattern = t.value.split(':', 1)
+        t.value = (output_pattern.strip(), input_pattern.strip())
+        t.lexer.push_state('INTARGET')
+        return t
+
     def t_IMPORT(self, t):
         r'import .+' 
         return t
@@ -96,10 +140,14 @@ class BuildLanguageLexer:
         return t
 
 
+    # A name followed by a colon starts a target, the spaces
+    # before the colon are dropped from the value.
+    #
     def t_TARGET_START(self, t):
-        r'[a-zA-Z][a-zA-Z0-9_]*:'
-        self.lexer.push_state('INTARGET')
-        self.lexer.lineno += 1
+        r'[a-zA-Z][a-zA-Z0-9_]*[ ]*:'
+        t.value = t.value[:-1].rstrip() + ':'
+        t.lexer.push_state('INTARGET')
+        t.lexer.lineno += 1
         return t
 
 
@@ -109,12 +157,6 @@ class BuildLanguageLexer:
     #
     def t_NAME(self, t):
         r'[a-zA-Z][a-zA-Z0-9_]*'
-        la_token = self.look_ahead()[0]
-        if la_token.type == 'COLON':
-            t.value += la_token.value
-            self.lexer.skip(1)
-            t.type = 'TARGET_START'
-            self.lexer.push_state('INTARGET')
         return t
 
     
@@ -155,17 +197,39 @@ class BuildLanguageLexer:
 
         
 
-    def look_ahead(self):
-        num_tokens = 1
-        seek_lexer = self.lexer.clone()
-        seek_tokens = []
-        for i in range(num_tokens):
-            seek_tokens.append(seek_lexer.token())
-        return seek_tokens
+    def signature(self):
+        """
+        A digest of the token rules, which names the cached lexer
+        tables so that changing a rule never reuses stale tables.
+        """
+        rules = [(name, getattr(self, name).__doc__) for name in dir(self)
+                 if name.startswith('t_')]
+        return hashlib.md5(repr((self.states, self.tokens, rules))).hexdigest()[:8]
 
     # Build the lexer
     def build(self, **kwargs):
+        """
+        Build the lexer. The lexer tables are cached in a module next
+        to this one, so that only the first build has to validate the
+        rules, if the directory is writable.
+        """
+        lextab = 'ipym_lextab_' + self.signature()
+        outputdir = os.path.dirname(os.path.abspath(__file__))
+        if os.path.exists(os.path.join(outputdir, lextab + '.py')) or \
+                os.access(outputdir, os.W_OK):
+            kwargs.setdefault('optimize', 1)
+            kwargs.setdefault('lextab', 'ipymake.' + lextab)
+            kwargs.setdefault('outputdir', outputdir)
         self.lexer = lex.lex(module=self, **kwargs)
+
+    def reset(self, input_string):
+        """
+        Get the lexer ready to tokenize *input_string* from the start.
+        """
+        self.lexer.begin('INITIAL')
+        self.lexer.lexstatestack = []
+        self.lexer.lineno = 1
+        self.lexer.input(input_string)
     
     # Some simple test code for the lexer, which prints out the token
     # stream for curiosity and some low-level learning and debugging
@@ -181,6 +245,19 @@ class BuildLanguageLexer:
              print >>outfile, "T(%d): " % (self.lexer.lineno), token
              
 
+_lexer = None
+
+def get_lexer():
+    """
+    The lexer of the build language, built once per process.
+    """
+    global _lexer
+    if _lexer is None:
+        _lexer = BuildLanguageLexer()
+        _lexer.build()
+    return _lexer
+
+
 class BuildLanguageParser:
 
     HEADER = \
@@ -228,18 +305,9 @@ if __name__ == "__main__":
     pass
 
 
-# Get the IPython API, we need their magic 
-# to get everything to run.
-import IPython.ipapi as ipapi
-ip = ipapi.get()
-
-# There isn't a ipython instance running,
-# get a dummy api instance.
-if ip is None:
-    # The dummy instance allows for use to import the module 
-    # as is for analysis and introspection.
-    ip = ipapi.get(allow_dummy=True, dummy_warn=False)
-
+# Gives the runtime functions and `ip', the IPython API instance we
+# need for the shell escape magic. IPython itself is only started
+# once a target runs a shell escape.
 from ipymake.runtimecore import *
 """
 
@@ -261,17 +329,19 @@ def install_hook(is_root=False, **kwargs):
     except(NameError):
         
         if is_root:
-          ip.runlines(\"\"\"
-
-for indir in env.install_dirs:
-    mkdir -pv $indir
-for cmpbin in env.compiled_binaries: 
-    cmpbin.install()
-\"\"\")
+            for indir in env.install_dirs:
+                execute('mkdir -pv %s' % indir)
+            for cmpbin in env.compiled_binaries: 
+                cmpbin.install()
         #    ip.runlines(\"env = eval(cPickle.unpickle('./.ipym_cache.bin'))\")
 
 
 def cleanup_hook(is_root=False, **kwargs):
+    if is_root:
+        report_object_cache()
+        report_distributed()
+        report_archives()
+        report_profile()
     try:
         cleanup()
     except(NameError):
@@ -288,6 +358,17 @@ def cleanup_hook(is_root=False, **kwargs):
 # doing. Instead, change the input file and rerun ipymake or ipymakec.
 #
 ###############################################################################
+"""
+
+    PATTERN_TEMPLATE = \
+"""
+
+
+@pattern_rule(%(OUTPUT)r, %(INPUT)r)
+def %(NAME)s(input, output, **kwargs):
+%(CODE)s
+    pass
+
 """
 
     TARGET_TEMPLATE = \
@@ -303,43 +384,49 @@ def %(NAME)s(**kwargs):
 """
     
 
-    def __init__(self, filename):
+    def __init__(self, filename, options=None):
         self.filename = filename
+        self.options = dict(options or {})
+        self.mode = self.options.get('mode', DEFAULT_MODE)
+        self._known_names = None
+        if not self.mode in COMPILE_MODES:
+            raise ValueError('Unknown compile mode: %r' % self.mode)
         infile = open(filename, 'r')
         self.parse_str = infile.read()
         infile.close()
-        self.lexer = BuildLanguageLexer()
-        self.lexer.build()
-        self.lexer = self.lexer.lexer
-        self.lexer.input(self.parse_str)
+        build_lexer = get_lexer()
+        build_lexer.reset(self.parse_str)
+        self.lexer = build_lexer.lexer
+
+        # Sort the tokens into the imports, the globals and the
+        # targets in a single pass over the token stream.
         self.token_list = []
-        token = self.lexer.token()
-        while token:
-            #print token
+        self.imports = []
+        self.global_vars = []
+        self.targets = []
+        self.patterns = []
+        target_tokens = None
+        for token in iter(self.lexer.token, None):
             self.token_list.append(token)
-            token = self.lexer.token()
-
-        self.imports = filter(lambda t: t.type == 'IMPORT', 
-                              self.token_list)
-        self.global_vars = filter(lambda t: t.type == 'GLOBAL_VAR', 
-                                  self.token_list)
-    
-        def gen_targets(t_list):
-            target_tokens = []
-            while(t_list):
-                token = t_list.pop(0)
-                if token.type == 'TARGET_START':
-                    target_tokens.append(token)
-                    while t_list and not token.type == 'TARGET_END':
-                        token = t_list.pop(0)
-                        target_tokens.append(token)
-                    
-                    yield target_tokens
-                    target_tokens = []
-                
-            
-        
-        self.targets = [t for t in gen_targets(self.token_list)]
+            if target_tokens is not None:
+                target_tokens.append(token)
+                if token.type == 'TARGET_END':
+                    if target_tokens[0].type == 'PATTERN_START':
+                        self.patterns.append(target_tokens)
+                    else:
+                        self.targets.append(target_tokens)
+                    target_tokens = None
+            elif token.type in ('TARGET_START', 'PATTERN_START'):
+                target_tokens = [token]
+            elif token.type == 'IMPORT':
+                self.imports.append(token)
+            elif token.type == 'GLOBAL_VAR':
+                self.global_vars.append(token)
+        if target_tokens is not None:
+            if target_tokens[0].type == 'PATTERN_START':
+                self.patterns.append(target_tokens)
+            else:
+                self.targets.append(target_tokens)
 
         
 
@@ -390,9 +477,14 @@ def %(NAME)s(**kwargs):
         Process the tokens for a specific target and return a string
         where each line of the function is now executed with
         ip.runlines(), where *ip* is an instance of the IPython API.
-        The format given to targets is::
-
-            @depends_on(<dep-0,...,dep-n>)
+        Targets without any shell escapes are executed as plain Python
+        in the module globals instead, so they do not need IPython.
+        In the native mode the shell escapes are translated to Python
+        (see :mod:`ipymake.translator`) and the body becomes the body
+        of the target function, only a body that can not be translated
+        is left to IPython. The format given to targets is::
+
+            @depends_on(<dep-0,...,dep-n>[, inputs=[...]][, outputs=[...]])
             @managed_target
             def <target-name>(**kwargs):
                 ip.runlines(\"\"\"<code>\"\"\"
@@ -408,17 +500,37 @@ def %(NAME)s(**kwargs):
         assert tokens[0].type == 'TARGET_START'
         assert tokens[-1].type == 'TARGET_END'
         # first token should always be the TARGET_START token
-        name = tokens.pop(0).value[:-1] # gets rid of the ':'
+        name = tokens[0].value[:-1] # gets rid of the ':'
+        tokens = tokens[1:]
         # format dependencies into a comma seperated list
         dependencies = filter(lambda t: t.type == 'DEPENDENCY', tokens)
         dependencies = map(lambda t: t.value, dependencies)
+        for t in tokens:
+            if t.type == 'INPUTS':
+                dependencies.append('inputs=%r' % t.value)
+            elif t.type == 'OUTPUTS':
+                dependencies.append('outputs=%r' % t.value)
         dependencies = ",".join(dependencies)        
         
 
         code_lines = filter(lambda t: t.type.endswith('CODE'), tokens)
         code_lines = map(lambda t: t.value[4:], code_lines)        
         code_lines = '\n'.join(code_lines)
-        code_lines = """
+        body = None
+        if self.mode == 'native':
+            body = translator.translate_target(code_lines, self.known_names())
+        if body is not None:
+            code_lines = '\n'.join(['    ' + line for line in body.splitlines()])
+        elif is_plain_python(code_lines):
+            # No shell escapes, so there is no need for IPython.
+            code_lines = """
+    exec compile(
+\"\"\"
+%s
+\"\"\", '<target %s>', 'exec') in globals()
+""" % (code_lines, name)
+        else:
+            code_lines = """
     ip.runlines(
 \"\"\"
 %s
@@ -430,13 +542,61 @@ def %(NAME)s(**kwargs):
                         'CODE' : code_lines}
         return self.TARGET_TEMPLATE % target_dict
 
+    def p_pattern(self, tokens, index):
+        """
+        Process the tokens of a pattern rule. Its body is translated
+        like the one of a target in the native mode, with the paths of
+        the files in ``input`` and ``output``::
+
+            @pattern_rule(<output-pattern>, <input-pattern>)
+            def _ipym_pattern_<index>(input, output, **kwargs):
+                ...
+                pass
+
+        A pattern rule is always translated, as it runs for many
+        files, so a body that needs IPython is a syntax error.
+        """
+        assert tokens[0].type == 'PATTERN_START'
+        assert tokens[-1].type == 'TARGET_END'
+        output_pattern, input_pattern = tokens[0].value
+        code_lines = filter(lambda t: t.type.endswith('CODE'), tokens[1:])
+        code_lines = '\n'.join(map(lambda t: t.value[4:], code_lines))
+        body = translator.translate_target(code_lines,
+                                           self.known_names() + ['input', 'output'])
+        if body is None:
+            raise SyntaxError('The body of the pattern rule %s: %s can not be '
+                              'translated to Python' % (output_pattern, input_pattern))
+        pattern_dict = {'OUTPUT' : output_pattern,
+                        'INPUT' : input_pattern,
+                        'NAME' : '_ipym_pattern_%d' % index,
+                        'CODE' : '\n'.join(['    ' + line for line in body.splitlines()])}
+        return self.PATTERN_TEMPLATE % pattern_dict
+
+    def known_names(self):
+        """
+        The names the build file defines at the module level: the
+        targets, the global variables and the imported modules. A line
+        of a target that starts with one of them is never a program.
+        """
+        if self._known_names is None:
+            names = [tokens[0].value[:-1] for tokens in self.targets]
+            names += [t.value.split('=')[0].strip() for t in self.global_vars]
+            for t in self.imports:
+                for name in t.value[len('import'):].split(','):
+                    names.append(name.split()[-1].split('.')[0])
+            self._known_names = names
+        return self._known_names
+
     def p_targets(self):
         """
-        :returns: The string of all of the formatted targets.
+        :returns: The string of all of the formatted pattern rules and
+            targets.
         
         .. seealso:: :mod:`BuildLanguageParser.p_target`
         """
         t_strings = []
+        for i, t in enumerate(self.patterns):
+            t_strings.append(self.p_pattern(t, i))
         for t in self.targets:
             t_strings.append(self.p_target(t))
         return '\n'.join(t_strings)
@@ -459,6 +619,22 @@ def %(NAME)s(**kwargs):
 
 
 
+def is_plain_python(code):
+    """
+    Determine if the target body *code* can run without IPython: it
+    has to compile as Python, and none of its lines may be a lone
+    name, which IPython would run as a shell alias (e.g. ``ls``).
+    """
+    try:
+        compile(code, '<target>', 'exec')
+    except(SyntaxError):
+        return False
+    for line in code.splitlines():
+        line = line.strip()
+        if re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', line) and not keyword.iskeyword(line):
+            return False
+    return True
+
 def format_outpath(filename):
     """
     Format the outfile path for ipymake compiled file.
@@ -470,49 +646,235 @@ def format_outpath(filename):
     ofpath = "%s/ipym_%s.py" %(odir, ofname)
     return ofpath
 
-def needs_recompile(filename):
+MANIFEST_EXTENSION = '.manifest'
+
+def format_manifest_path(filename):
+    """
+    Format the path of the compile manifest of the ipymake file
+    *filename*, kept next to the compiled file.
+    """
+    return os.path.splitext(format_outpath(filename))[0] + MANIFEST_EXTENSION
+
+
+_compiler_signature = None
+
+def _code_generation_modules():
+    """
+    The modules whose source decides the code generated for a build
+    file: this compiler, the translator of the target bodies, the
+    version information and the lexer.
+    """
+    return [sys.modules[__name__], translator, ipyminfo, lex]
+
+def compiler_signature():
+    """
+    A digest of the ipymake version and of the source of every module
+    that generates code, so that upgrading ipymake (even without a
+    version change) recompiles every build file.
+    """
+    global _compiler_signature
+    if _compiler_signature is None:
+        md5 = hashlib.md5(ipyminfo.VERSION)
+        for module in _code_generation_modules():
+            source = os.path.splitext(os.path.abspath(module.__file__))[0] + '.py'
+            md5.update('\0' + module.__name__ + '\0')
+            try:
+                infile = open(source, 'rb')
+                try:
+                    md5.update(infile.read())
+                finally:
+                    infile.close()
+            except(IOError):
+                pass
+        _compiler_signature = md5.hexdigest()
+    return _compiler_signature
+
+def compile_options(options=None):
+    """
+    The compiler options with the defaults filled in.
+    """
+    all_options = {'mode' : DEFAULT_MODE}
+    all_options.update(options or {})
+    return all_options
+
+def format_options(options):
+    """
+    The compiler options as they are recorded in the manifest.
+    """
+    return repr(sorted(compile_options(options).items()))
+
+def read_manifest(filename):
+    """
+    Read the compile manifest of the ipymake file *filename*.
+
+    :returns: The dictionary of the manifest entries, empty if there
+        is no manifest.
+    """
+    manifest = {}
+    try:
+        infile = open(format_manifest_path(filename), 'r')
+    except(IOError):
+        return manifest
+    try:
+        for line in infile:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                manifest[key.strip()] = value.strip()
+    finally:
+        infile.close()
+    return manifest
+
+# The manifest entries of the PATH lookups of a translation.
+COMMAND_KEYS = ('commands', 'command_paths', 'path', 'path_mtimes')
+
+def format_commands(lookups):
     """
-    Determine if the source filename needs to be recompiled.
-    Doesn't save t
+    The words of the target bodies that were looked up on the
+    :envvar:`PATH` (see :func:`translator.is_command`), as they are
+    recorded in the manifest: ``word=1`` for a program, ``word=0``
+    for anything else.
     """
-    file_mod_time = os.stat(filename)[ST_MTIME]
-    filename = os.path.basename(filename)
-    module_name = 'ipym_'+os.path.splitext(filename)[0]
+    return ' '.join(['%s=%d' % (word, program is not None)
+                     for word, program in sorted(lookups.items())])
 
+def format_path_mtimes(path):
+    """
+    The modification times of the directories of the search *path*,
+    as they are recorded in the manifest. Adding or removing a program
+    changes the time of its directory.
+    """
+    mtimes = []
+    for directory in path.split(os.pathsep):
+        try:
+            mtimes.append(repr(os.stat(directory or '.').st_mtime))
+        except(OSError):
+            mtimes.append('-1')
+    return ' '.join(mtimes)
+
+def command_entries(lookups):
+    """
+    The manifest entries of the PATH *lookups* (see
+    :func:`translator.command_lookups`): the words, the programs the
+    ones found resolved to, and the :envvar:`PATH` with the times of
+    its directories.
+    """
+    path = os.environ.get('PATH', '')
+    programs = sorted([program for program in lookups.values() if program is not None])
+    return [('commands', format_commands(lookups)),
+            ('command_paths', os.pathsep.join(programs)),
+            ('path', path),
+            ('path_mtimes', format_path_mtimes(path))]
+
+def commands_changed(manifest):
+    """
+    Determine if any of the commands recorded in *manifest* is found
+    on the :envvar:`PATH` differently now, which changes the
+    translation of the lines that start with it. Only the programs the
+    commands resolved to are looked at, and the directories of the
+    :envvar:`PATH` when a command was not found; the words are only
+    looked up again when one of those directories changed.
+    """
+    if manifest.get('path') != os.environ.get('PATH', ''):
+        return True
+    for program in manifest.get('command_paths', '').split(os.pathsep):
+        if program and not (os.path.isfile(program) and os.access(program, os.X_OK)):
+            return True
+    missing = []
+    for entry in manifest.get('commands', '').split():
+        word, found = entry.rsplit('=', 1)
+        if not int(found):
+            missing.append(word)
+    if missing and \
+            manifest.get('path_mtimes') != format_path_mtimes(manifest['path']):
+        for word in missing:
+            if translator.find_command(word):
+                return True
+    return False
+
+def write_manifest(filename, source_hash, options=None, commands=()):
+    """
+    Record what the compiled file of the ipymake file *filename* was
+    generated from, and the PATH lookups its translation depends on
+    (the *commands* entries, see :func:`command_entries`).
+    """
+    st = os.stat(filename)
+    entries = [('source', os.path.abspath(filename)),
+               ('source_mtime', st[ST_MTIME]),
+               ('source_size', st[ST_SIZE]),
+               ('source_hash', source_hash),
+               ('ipymake_version', ipyminfo.VERSION),
+               ('compiler', compiler_signature()),
+               ('options', format_options(options))] + list(commands)
+    outfile = open(format_manifest_path(filename), 'w')
+    try:
+        for key, value in entries:
+            outfile.write('%s: %s\n' % (key, value))
+    finally:
+        outfile.close()
+
+def hash_source(filename):
+    infile = open(filename, 'rb')
     try:
-        comp_mod = __import__(module_name)     
-        # Gets SRC_MODIFICATION_TIME from the docstring header
-        eval(compile(comp_mod.__doc__, filename, 'exec'))
-        #print dir()
-        recompile = bool(locals()['SRC_MODIFICATION_TIME'] != file_mod_time)
-    except(ImportError):
+        return hashlib.md5(infile.read()).hexdigest()
+    finally:
+        infile.close()
+
+def needs_recompile(filename, options=None):
+    """
+    Determine if the source filename needs to be recompiled, from the
+    manifest written by the last compile. The source file is only
+    read if its modification time or size changed since then, a
+    touched but unchanged file just gets its manifest updated.
+    """
+    manifest = read_manifest(filename)
+    if not manifest or not os.path.exists(format_outpath(filename)):
         return True
-    
-    sys.path.pop()
-    return recompile
-    
+    if manifest.get('compiler') != compiler_signature() or \
+            manifest.get('options') != format_options(options) or \
+            commands_changed(manifest):
+        return True
+
+    st = os.stat(filename)
+    if manifest.get('source_mtime') == str(st[ST_MTIME]) and \
+            manifest.get('source_size') == str(st[ST_SIZE]):
+        return False
+
+    source_hash = hash_source(filename)
+    if manifest.get('source_hash') != source_hash:
+        return True
+    write_manifest(filename, source_hash, options,
+                   [(key, manifest.get(key, '')) for key in COMMAND_KEYS])
+    return False
+
 
-def ipym_compile(filename, force_recompile=False):
+def ipym_compile(filename, force_recompile=False, options=None):
     """
     Compile the ipymake-syntaxed filename into a new file python
     source file ipym_<filename>.py and its bytecode compiled
     counterpart ipym_<filename>.pyc
     """
-    if not needs_recompile(filename) and not force_recompile:
+    if not force_recompile and not needs_recompile(filename, options):
         return
-    
-    p = BuildLanguageParser(filename)
+
+    source_hash = hash_source(filename)
+    translator.clear_command_lookups()
+    p = BuildLanguageParser(filename, options)
     code_string = p.parse()
+    commands = command_entries(translator.command_lookups())
 
     ofpath = format_outpath(filename)
-    
+
     outfile = open(ofpath, 'w')
     outfile.write(code_string)
     outfile.close()
-    
-    # Go ahead and generate the bytecode now, this may speed thigns
-    # up in the future.
-    compiler.compileFile(ofpath)
+
+    # Go ahead and generate the bytecode now, the target bodies are
+    # real functions so importing the module does not parse anything.
+    try:
+        py_compile.compile(ofpath, doraise=True)
+    except(py_compile.PyCompileError), error:
+        raise SyntaxError(error.msg)
+    write_manifest(filename, source_hash, options, commands)
     pass
 
 
@@ -0,0 +1,292 @@
+"""
+:mod:`objectcache` -- Content Addressed Object File Cache
+============================================================
+
+An optional cache of compiled object files that can be shared by any
+number of workspaces (checkouts, branches) of the same tree. An
+object file is stored under a key made of:
+
+* the identity of the compiler (its path and ``--version`` output),
+* the compiler command line without the source and output files,
+  which holds the ``C_FLAGS``/``CXX_FLAGS`` and the per call flags,
+* the preprocessed source, so that a change to any included header
+  changes the key while a touched but unchanged file does not.
+
+The working directory that gcc notes in the preprocessed source (for
+the debug information) is left out of the key, and the paths under
+the root of the workspace are made relative to it in the command line
+and in the line markers of the preprocessed source, otherwise no two
+workspaces could share an object file. The dependency file of an
+entry is stored with relative paths as well, and gets the paths of
+the workspace it is taken out in. The debug information of an object
+file from the cache names the workspace it was compiled in.
+
+On a hit the object file (and its dependency file) is hard linked or
+copied out of the cache instead of running the compiler. The cache
+directory is kept below a size limit by evicting the least recently
+used entries.
+
+"""
+import os
+import re
+import stat
+import shutil
+import hashlib
+import tempfile
+
+from ipymake.executor import run_command
+from ipymake.scheduler import build_counters, count
+
+OBJECT_EXTENSION = '.o'
+DEPFILE_EXTENSION = '.d'
+
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+# The line marker of the working directory, e.g. ``# 1 "/src/tree//"``.
+_WORKING_DIRECTORY_RE = re.compile(r'^# \d+ ".*//"$')
+
+# Stands for the root of the workspace in the keys and in the stored
+# dependency files.
+ROOT_PLACEHOLDER = '@IPYMAKE_ROOT@'
+
+
+class ObjectCache:
+    """
+    The object file cache in *directory*, holding at most *max_size*
+    bytes, for the workspace *root*.
+    """
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, root=None):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_size = max_size
+        self.root = None
+        if root is not None:
+            self.root = os.path.join(os.path.abspath(root), '')
+        self._compilers = {}
+
+    def relative(self, text):
+        """
+        *text* with the paths under the root of the workspace made
+        relative to it.
+        """
+        if self.root is None:
+            return text
+        return text.replace(self.root, ROOT_PLACEHOLDER + os.sep)
+
+    def absolute(self, text):
+        """
+        The paths of :meth:`relative` made absolute again, in this
+        workspace.
+        """
+        if self.root is None:
+            return text
+        return text.replace(ROOT_PLACEHOLDER + os.sep, self.root)
+
+    # The statistics are build counters, so that the lookups of the
+    # worker processes are counted as well.
+    def _count(self, name):
+        count('object_cache_' + name)
+
+    def _counter(name):
+        return property(lambda self: build_counters.get('object_cache_' + name, 0))
+    hits = _counter('hits')
+    misses = _counter('misses')
+    stores = _counter('stores')
+    evictions = _counter('evictions')
+    del _counter
+
+    def compiler_identity(self, compiler):
+        """
+        The path and version of the *compiler* command.
+        """
+        compiler = compiler.strip()
+        if not self._compilers.has_key(compiler):
+            result = run_command(compiler + ' --version', stream=False)
+            identity = [compiler] + result.stdout
+            program = compiler.split()[0]
+            for directory in os.environ.get('PATH', '').split(os.pathsep):
+                path = os.path.join(directory, program)
+                if os.path.isfile(path):
+                    st = os.stat(os.path.realpath(path))
+                    identity.append('%s %s %s' % (os.path.realpath(path),
+                                                  st[stat.ST_SIZE], st[stat.ST_MTIME]))
+                    break
+            self._compilers[compiler] = '\n'.join(identity)
+        return self._compilers[compiler]
+
+    def key(self, compiler, base_command, source):
+        """
+        The cache key of the object file compiled from *source* by
+        *base_command* (the compiler command line without the source,
+        output and dependency file arguments).
+
+        :returns: The key, or None if the source could not be
+            preprocessed.
+        """
+        result = run_command('%s -E %s' % (base_command, source), stream=False)
+        if not result.succeeded:
+            return None
+        md5 = hashlib.md5(self.compiler_identity(compiler))
+        md5.update('\0' + self.relative(' '.join(base_command.split())))
+        for line in result.stdout:
+            if line.startswith('# '):
+                if _WORKING_DIRECTORY_RE.match(line):
+                    continue
+                line = self.relative(line)
+            md5.update('\n' + line)
+        return md5.hexdigest()
+
+    def _entry_path(self, key, extension):
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    def fetch(self, key, objfile, depfile=None):
+        """
+        Materialize the cached object file of *key* as *objfile* (and
+        its dependency file as *depfile*).
+
+        :returns: True on a hit.
+        """
+        cached = self._entry_path(key, OBJECT_EXTENSION)
+        if not os.path.exists(cached):
+            self._count('misses')
+            return False
+        try:
+            _materialize(cached, objfile)
+            cached_depfile = self._entry_path(key, DEPFILE_EXTENSION)
+            if depfile is not None and os.path.exists(cached_depfile):
+                _materialize(cached_depfile, depfile, self.absolute)
+            # Mark the entry as recently used, and give the object file
+            # a fresh timestamp so that whatever links it is relinked.
+            os.utime(cached, None)
+            os.utime(objfile, None)
+        except(OSError, IOError):
+            self._count('misses')
+            return False
+        self._count('hits')
+        return True
+
+    def store(self, key, objfile, depfile=None):
+        """
+        Put the freshly compiled *objfile* (and *depfile*) in the
+        cache under *key*.
+        """
+        entries = [(objfile, OBJECT_EXTENSION, None)]
+        if depfile is not None and os.path.exists(depfile):
+            entries.insert(0, (depfile, DEPFILE_EXTENSION, self.relative))
+        try:
+            for path, extension, rewrite in entries:
+                _store_file(path, self._entry_path(key, extension), rewrite)
+        except(OSError, IOError):
+            return
+        self._count('stores')
+
+    def entries(self):
+        """
+        :returns: The list of tuple(last use, size, path) of the files
+            in the cache.
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for subdir in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for filename in os.listdir(subdir):
+                path = os.path.join(subdir, filename)
+                try:
+                    st = os.stat(path)
+                except(OSError):
+                    continue
+                entries.append((st[stat.ST_MTIME], st[stat.ST_SIZE], path))
+        return entries
+
+    def trim(self):
+        """
+        Evict the least recently used entries until the cache is back
+        below 90% of its size limit.
+        """
+        entries = self.entries()
+        size = sum([entry[1] for entry in entries])
+        if size <= self.max_size:
+            return
+        entries.sort()
+        for used, entry_size, path in entries:
+            if size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+            except(OSError):
+                continue
+            size -= entry_size
+            if path.endswith(OBJECT_EXTENSION):
+                self._count('evictions')
+
+    def get_lookups(self): return self.hits + self.misses
+    lookups = property(get_lookups)
+
+    def summary(self):
+        """
+        The hit and miss statistics as a line of text.
+        """
+        rate = 0.0
+        if self.lookups:
+            rate = 100.0 * self.hits / self.lookups
+        return '%d hits, %d misses (%.1f%% hit rate), %d stored, %d evicted' % \
+            (self.hits, self.misses, rate, self.stores, self.evictions)
+
+
+def _rewrite_file(source, path, rewrite):
+    """
+    Write the text of the file *source*, changed by *rewrite*, to *path*.
+    """
+    infile = open(source, 'rb')
+    try:
+        text = infile.read()
+    finally:
+        infile.close()
+    outfile = open(path, 'wb')
+    try:
+        outfile.write(rewrite(text))
+    finally:
+        outfile.close()
+
+def _materialize(cached, path, rewrite=None):
+    """
+    Hard link *cached* to *path*, or copy it if that is not possible
+    (the cache is on another file system). With *rewrite* the text of
+    *cached* is written to *path* changed by it.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    if rewrite is not None:
+        _rewrite_file(cached, path, rewrite)
+        return
+    try:
+        os.link(cached, path)
+    except(OSError, AttributeError):
+        shutil.copy2(cached, path)
+
+def _store_file(path, cached, rewrite=None):
+    """
+    Copy *path* to *cached*, changing its text by *rewrite* if given.
+    The copy is renamed into place, so that builds in other workspaces
+    never see a partial entry.
+    """
+    directory = os.path.dirname(cached)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except(OSError):
+            if not os.path.isdir(directory):
+                raise
+    fd, tempname = tempfile.mkstemp(dir=directory, prefix='.tmp')
+    os.close(fd)
+    try:
+        if rewrite is None:
+            shutil.copy2(path, tempname)
+        else:
+            _rewrite_file(path, tempname, rewrite)
+        os.rename(tempname, cached)
+    except:
+        os.remove(tempname)
+        raise
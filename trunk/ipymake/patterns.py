@@ -0,0 +1,162 @@
+"""
+:mod:`patterns` -- Pattern Rules for Generated Sources
+=========================================================
+
+A pattern rule generates a source file from another file, like a
+``%.c: %.y`` rule of make: ``%`` stands for the same stem in the name
+of the generated file and in the name of the file it is generated
+from. The sources given to ``compile_*`` that a pattern rule matches
+(a yacc grammar, a lex scanner, a swig interface, ...) are replaced
+by the files generated from them.
+
+Rules for swig, yacc and lex are built in. A build file adds its own,
+or replaces a built in one, with a pattern rule block::
+
+    %_wrap.c: %.i
+        ~swig -python -o $output $input
+        pass
+
+or by calling :func:`pattern_rule` with the command line. The rule
+defined last for the same patterns is the one that is used.
+
+The rules of a build file are kept in the namespace of its module, so
+they only apply to the binaries of that build file (and not to those
+of the sub builds it loads, or that load it). They are reset every
+time the build file is loaded again.
+
+"""
+import os
+import sys
+
+from ipymake.executor import execute, expand_variables
+
+
+class PatternRule:
+    """
+    Generates the file named by *output_pattern* from a file whose
+    name matches *input_pattern* by calling *action* with the keyword
+    arguments *input* and *output* (the paths of the two files) and
+    *arguments*.
+    """
+    def __init__(self, output_pattern, input_pattern, action, arguments=None):
+        if not '%' in output_pattern or not '%' in input_pattern:
+            raise ValueError('A pattern rule needs a %% in both of its '
+                             'patterns: %s: %s' % (output_pattern, input_pattern))
+        self.output_pattern = output_pattern
+        self.input_pattern = input_pattern
+        self.action = action
+        self.arguments = dict(arguments or {})
+
+    def output_for(self, source):
+        """
+        :returns: The path of the file generated from *source*, next
+            to it, or None if the rule does not match *source*.
+        """
+        directory, filename = os.path.split(source)
+        prefix, suffix = self.input_pattern.split('%', 1)
+        if len(filename) <= len(prefix) + len(suffix) or \
+                not filename.startswith(prefix) or not filename.endswith(suffix):
+            return None
+        stem = filename[len(prefix):len(filename) - len(suffix)]
+        return os.path.join(directory, self.output_pattern.replace('%', stem, 1))
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return '%s(%r, %r)' % (class_name, self.output_pattern, self.input_pattern)
+
+
+# The name of the list of the rules of a build file in the namespace
+# of its module.
+RULES_NAME = 'ipym_pattern_rules'
+
+builtin_rules = []
+
+def module_rules(namespace):
+    """
+    :returns: The list of the rules of the build file module whose
+        globals are *namespace*, created on first use.
+    """
+    if not namespace.has_key(RULES_NAME):
+        namespace[RULES_NAME] = []
+    return namespace[RULES_NAME]
+
+def reset_pattern_rules(namespace):
+    """
+    Forget the rules of the build file module whose globals are
+    *namespace*, before it is loaded again.
+    """
+    namespace[RULES_NAME] = []
+
+def add_pattern_rule(rule, rules=None):
+    """
+    Register *rule* in the list *rules* (the built in rules by
+    default), replacing the rule for the same patterns.
+    """
+    if rules is None:
+        rules = builtin_rules
+    rules[:] = [r for r in rules
+                if (r.output_pattern, r.input_pattern) !=
+                (rule.output_pattern, rule.input_pattern)]
+    rules.append(rule)
+
+def calling_rules():
+    """
+    :returns: The rules of the nearest build file module on the stack
+        of the caller, e.g. of the target that compiles a binary, or
+        None if there is none. A build file module is one whose
+        globals hold rules or that was compiled by ipymake (it has an
+        ``init_hook``).
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        namespace = frame.f_globals
+        if namespace.has_key(RULES_NAME) or namespace.has_key('init_hook'):
+            return module_rules(namespace)
+        frame = frame.f_back
+    return None
+
+def find_pattern_rule(source, rules=()):
+    """
+    :returns: The last registered rule of *rules*, or else the last
+        built in rule, that generates a file from *source*, or None.
+    """
+    for rule in list(reversed(rules)) + list(reversed(builtin_rules)):
+        if rule.output_for(source) is not None:
+            return rule
+    return None
+
+def run_pattern_command(input, output, command, **kwargs):
+    """
+    The action of the pattern rules given as a command line, the
+    ``$input`` and ``$output`` in *command* are expanded.
+    """
+    command = expand_variables(command, {'input' : input, 'output' : output})
+    execute(command, target=output)
+
+def pattern_rule(output_pattern, input_pattern, command=None):
+    """
+    Register the pattern rule that runs *command* to generate the files
+    named by *output_pattern*. Without a *command* it is a decorator
+    of the function that generates them, which is what a pattern rule
+    block of a build file compiles to.
+
+    The rule is registered with the build file that calls this.
+    """
+    rules = module_rules(sys._getframe(1).f_globals)
+    if command is not None:
+        add_pattern_rule(PatternRule(output_pattern, input_pattern,
+                                     run_pattern_command, {'command' : command}),
+                         rules)
+        return None
+    def register(action):
+        add_pattern_rule(PatternRule(output_pattern, input_pattern, action), rules)
+        return action
+    return register
+
+
+for _output, _input, _command in [('%_wrap.c', '%.i', 'swig -python -o $output $input'),
+                                  ('%.c', '%.y', 'bison -d -o $output $input'),
+                                  ('%.c', '%.l', 'flex -o$output $input')]:
+    add_pattern_rule(PatternRule(_output, _input, run_pattern_command,
+                                 {'command' : _command}))
+del _output, _input, _command
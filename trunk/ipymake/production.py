@@ -12,9 +12,16 @@ from distutils.core import setup
 from stat import ST_MTIME # Stat modification time index for os.stat
 from os import stat, path
 
+from ipymake.executor import execute
 
-from IPython import ipapi
-ip = ipapi.get()
+
+def _install_env():
+    """
+    The build environment holds the install prefixes. It is imported
+    late since :mod:`ipymake.runtimecore` imports this module.
+    """
+    from ipymake.runtimecore import env
+    return env
 
 class BinaryType:
     """
@@ -79,9 +86,24 @@ class ObjectFile(SourceFile):
         else:
             self._source_file = srcfile
 
-    def needs_recompile(self):
-        return self._source_file.needs_recompile() or \
-            not path.exists(self.path)
+    def get_source_file(self): return self._source_file
+    source_file = property(get_source_file)
+
+    def needs_recompile(self, dependencies=()):
+        """
+        The object file has to be compiled again when it is missing,
+        its source changed, or it is older than its source or any of
+        the *dependencies* (the :class:`SourceFile` of each header it
+        included the last time it was compiled). A header changed while
+        the object was compiled is only noticed by the timestamps.
+        """
+        if self._source_file.needs_recompile() or not path.exists(self.path):
+            return True
+        mod_time = stat(self.path)[ST_MTIME]
+        for dep in [self._source_file] + list(dependencies):
+            if not path.exists(dep.path) or stat(dep.path)[ST_MTIME] > mod_time:
+                return True
+        return False
 
 
     def __repr__(self):
@@ -96,7 +118,12 @@ class Binary:
         self.source_files = []
         self.sources = []
         for ofile, sfile in zip(objfiles, sources):
-            srcfile_obj = SourceFile(sfile)
+            # A SourceFile made before the compile started keeps the
+            # timestamp of the source that was compiled.
+            if not isinstance(sfile, SourceFile):
+                srcfile_obj = SourceFile(sfile)
+            else:
+                srcfile_obj = sfile
             self.source_files.append(srcfile_obj)
             self.sources.append(ObjectFile(ofile, srcfile_obj))
 
@@ -107,6 +134,16 @@ class Binary:
     def needs_recompile(self):
         return any( map(lambda ofile: ofile.needs_recompile(), self.sources))
 
+    def get_object_file(self, srcpath):
+        """
+        Get the :class:`ObjectFile` that was compiled from the source
+        file *srcpath*, or None if it is not part of this binary.
+        """
+        for ofile in self.sources:
+            if ofile.source_file.path == srcpath:
+                return ofile
+        return None
+
     def __str__(self):
         return \
 """
@@ -127,7 +164,7 @@ OPTIONS    : %s
 
 
     def install(self):
-        ip.runlines(["!cp -vf %s $env.binary_install_prefix/%s" % (self.binary, self.name)])
+        execute("cp -vf %s %s/%s" % (self.binary, _install_env().binary_install_prefix, self.name))
         pass
 
 class Executable(Binary):
@@ -141,7 +178,7 @@ class SharedLibrary(Binary):
         self.type = BinaryType.SHARED_LIBRARY
         
     def install(self):
-        ip.runlines(["!cp -vf %s $env.library_install_prefix/%s" % (self.binary, self.name)])
+        execute("cp -vf %s %s/%s" % (self.binary, _install_env().library_install_prefix, self.name))
         pass
 
 
@@ -151,7 +188,7 @@ class StaticLibrary(Binary):
         self.type = BinaryType.STATIC_LIBRARY
 
     def install(self):
-        ip.runlines(["!cp -vf %s $env.library_install_prefix/%s" % (self.binary, self.name)])
+        execute("cp -vf %s %s/%s" % (self.binary, _install_env().library_install_prefix, self.name))
         pass
         
 
@@ -178,7 +215,7 @@ class IncludeFile(InstallFile):
        self.type = FileType.INCLUDE_FILE
 
     def install(self):
-        ip.runlines(["!cp -vf %s $env.include_install_prefix" % self.location])
+        execute("cp -vf %s %s" % (self.location, _install_env().include_install_prefix))
         pass
 
 
@@ -189,7 +226,7 @@ class ShareFile(InstallFile):
        self.type = FileType.SHARE_FILE
 
     def install(self):
-        ip.runlines(["!cp -vf %s $env.share_install_prefix" % self.location])
+        execute("cp -vf %s %s" % (self.location, _install_env().share_install_prefix))
         pass
 
 
@@ -0,0 +1,200 @@
+"""
+:mod:`profiler` -- Build Tracing and Critical Path
+=====================================================
+
+Every step of a build -- the targets, the object file compiles, the
+links, the sub builds and the distutils steps -- is recorded as a
+span with its start and end time, the process and thread (the
+worker) it ran on and the command it ran. The spans of the forked
+target workers are sent back with their results.
+
+With ``--profile`` the spans are written as a Chrome trace event file
+(open it in ``chrome://tracing`` or Perfetto), and a summary of the
+slowest targets and compile units and of the critical path through
+the target graph is printed. The critical path is the chain of
+targets, each depending on the next, that took the longest; no
+number of jobs makes the build faster than it, so it is what to split
+or speed up first.
+
+"""
+import os
+import time
+import json
+import thread
+import threading
+
+DEFAULT_TRACE_FILENAME = 'ipymake_trace.json'
+
+TARGET, COMPILE, LINK, SUBDIR, DISTUTILS = \
+    'target', 'compile', 'link', 'subdir', 'distutils'
+
+
+class Span:
+    """
+    A step of the build that is running, see :meth:`Tracer.start`.
+    """
+    def __init__(self, tracer, category, name, args):
+        self.tracer = tracer
+        self.category = category
+        self.name = name
+        self.args = args
+        self.start_time = time.time()
+
+    def finish(self, **args):
+        """
+        Record the span as ended now, with the extra *args*.
+        """
+        self.args.update(args)
+        self.tracer.record(self, time.time())
+
+
+class Tracer:
+    """
+    Collects the spans of a build.
+    """
+    def __init__(self):
+        # Forked workers inherit the epoch, so their timestamps line
+        # up with the ones of the build.
+        self.epoch = time.time()
+        self.events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def start(self, category, name, **args):
+        """
+        Start the span *name* of *category* (one of :data:`TARGET`,
+        :data:`COMPILE`, ...) with the arguments *args* (``command``,
+        ...). Call :meth:`Span.finish` when the step has ended.
+        """
+        return Span(self, category, name, args)
+
+    def _thread_id(self):
+        ident = thread.get_ident()
+        if not self._threads.has_key(ident):
+            self._threads[ident] = len(self._threads) + 1
+        return self._threads[ident]
+
+    def record(self, span, end_time):
+        self._lock.acquire()
+        try:
+            self.events.append({'name' : span.name,
+                                'cat' : span.category,
+                                'ph' : 'X',
+                                'ts' : int((span.start_time - self.epoch) * 1e6),
+                                'dur' : int((end_time - span.start_time) * 1e6),
+                                'pid' : os.getpid(),
+                                'tid' : self._thread_id(),
+                                'args' : span.args})
+        finally:
+            self._lock.release()
+
+    def mark(self):
+        """
+        :returns: A mark for :meth:`events_since`.
+        """
+        return len(self.events)
+
+    def events_since(self, mark):
+        return self.events[mark:]
+
+    def extend(self, events):
+        """
+        Add the *events* recorded by a worker process.
+        """
+        self._lock.acquire()
+        try:
+            self.events.extend(events)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self.events = []
+        finally:
+            self._lock.release()
+
+    def write(self, filename):
+        """
+        Write the events as a Chrome trace event file.
+        """
+        outfile = open(filename, 'w')
+        try:
+            json.dump({'traceEvents' : self.events,
+                       'displayTimeUnit' : 'ms'}, outfile)
+        finally:
+            outfile.close()
+
+    def durations(self, category):
+        """
+        :returns: The list of tuple(seconds, name) of the spans of
+            *category*, the longest first.
+        """
+        durations = [(event['dur'] / 1e6, event['name']) for event in self.events
+                     if event['cat'] == category]
+        durations.sort(reverse=True)
+        return durations
+
+    def critical_path(self):
+        """
+        The chain of targets through the target graph that took the
+        longest. Every target span lists the targets it depends on in
+        its ``dependencies`` argument, a target that was up to date
+        costs nothing.
+
+        :returns: tuple(seconds, list of target names), the first
+            target of the list is the one that ran first.
+        """
+        durations = {}
+        dependencies = {}
+        for event in self.events:
+            if event['cat'] != TARGET:
+                continue
+            name = event['name']
+            durations[name] = durations.get(name, 0.0) + event['dur'] / 1e6
+            dependencies[name] = event['args'].get('dependencies', [])
+
+        # The longest chain ending in each target, memoized.
+        longest = {}
+        def chain(name, visiting):
+            if longest.has_key(name):
+                return longest[name]
+            best = (0.0, [])
+            visiting[name] = True
+            for dep in dependencies.get(name, []):
+                if not visiting.get(dep):
+                    best = max(best, chain(dep, visiting))
+            visiting[name] = False
+            longest[name] = (best[0] + durations.get(name, 0.0), best[1] + [name])
+            return longest[name]
+
+        result = (0.0, [])
+        for name in durations.keys():
+            result = max(result, chain(name, {}))
+        return result
+
+    def summary(self, count=10):
+        """
+        The slowest targets and compile units and the critical path,
+        as a list of lines of text.
+        """
+        lines = []
+        for title, category in [('Slowest targets', TARGET),
+                                ('Slowest compile units', COMPILE),
+                                ('Slowest links', LINK)]:
+            durations = self.durations(category)
+            if not durations:
+                continue
+            lines.append('%s:' % title)
+            for seconds, name in durations[:count]:
+                lines.append('  %9.3fs  %s' % (seconds, name))
+        seconds, path = self.critical_path()
+        if path:
+            lines.append('Critical path (%.3fs):' % seconds)
+            for name in path:
+                lines.append('  %s' % name)
+        return lines
+
+
+# The tracer of the build process.
+tracer = Tracer()
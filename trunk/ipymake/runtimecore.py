@@ -7,22 +7,39 @@
 """
 import sys
 import os
-import signal
+import time
 from distutils.core import setup, Extension
 
 from ipymake.environment import Environment, VerbosityLevels
 from ipymake.sourcefiles import *
 from ipymake.production  import *
+from ipymake.production  import SourceFile
+from ipymake.workerpool import WorkerPool, Job
+from ipymake.fingerprint import FingerprintStore
+from ipymake.objectcache import ObjectCache
+from ipymake.distributed import get_worker_set, can_distribute, compile_remote, \
+    reset_worker_sets
+from ipymake.unity import unity_sources
+from ipymake.patterns import pattern_rule, find_pattern_rule, calling_rules, \
+    reset_pattern_rules
+from ipymake.profiler import tracer, COMPILE, LINK, SUBDIR, DISTUTILS
+from ipymake.executor import BuildError, CommandResult, run_command, \
+    execute, check_result, expand_variables
+from ipymake.scheduler import Scheduler, DependencyCycleError, build_counters, count, \
+    reset_counters
+from ipymake.shell import LazyShell
 import ipymake.textstyle as style
 
 global env
 env = Environment()
-
-from IPython import ipapi
-ip = ipapi.get()
-    
-
-EXPECTED_EXIT_VALUE = '0'
+_fingerprints = FingerprintStore(env.fingerprints)
+scheduler = Scheduler(env, fingerprints=_fingerprints)
+# The root of the workspace, the build state is kept here as well.
+_workspace_root = os.getcwd()
+
+# The IPython API instance, IPython is only started when a target
+# uses a shell escape.
+ip = LazyShell()
  
 ##################################################
 # Helper Decorator Functions 
@@ -36,51 +53,75 @@ def managed_target(function):
     target.  I think that the lack of environment persistence within
     in the makefile is flawed, the reverting of the environment
     between targets seems perfectly reasonable and desireable.
+
+    Calling the target hands it to the :class:`Scheduler`, which
+    builds its dependencies first (in parallel up to ``env.jobs``).
+    Each target runs in the directory of its build file, and the
+    working directory is restored after each target.
     """
     def ipym_managed_function(**args):
-        target_name = function.__name__
-        module_name = function.__module__
-        term_width = _get_terminal_width()
-        header_string = '%s.%s'%(module_name, target_name)
-        push_dir = os.getcwd()
-        retval = function(**args)
-        if not env.built_targets.has_key(target_name):
-            env.built_targets[target_name] = [str(function)]
-        else:
-            env.built_targets[target_name].append(str(function))
-        os.chdir(push_dir)
-
-        
-        return retval
+        return scheduler.build(ipym_managed_function, **args)
     ipym_managed_function.__name__ = function.__name__
+    ipym_managed_function.__module__ = function.__module__
+    ipym_managed_function.__doc__ = function.__doc__
+    ipym_managed_function.ipym_dependencies = getattr(function, 'ipym_dependencies', [])
+    ipym_managed_function.ipym_inputs = getattr(function, 'ipym_inputs', [])
+    ipym_managed_function.ipym_outputs = getattr(function, 'ipym_outputs', [])
+    ipym_managed_function.ipym_body = getattr(function, 'ipym_body', function)
+    ipym_managed_function.ipym_directory = _build_file_directory(function)
     return ipym_managed_function
 
+def _build_file_directory(function):
+    """
+    The directory of the build file that defines the target
+    **function**, the target is always run from there.
+    """
+    body = getattr(function, 'ipym_body', function)
+    module_file = getattr(body, 'func_globals', {}).get('__file__')
+    if module_file is None:
+        return None
+    return os.path.dirname(os.path.abspath(module_file))
+
 
 class depends_on:
     """
     'Decorator class' that wraps a function by sending it a list of
     other functions for which the current function is depenendent.
-    When the function is called, this classes __call__ routine is
-    executed first, which in turn calls all of the target's
-    dependencies in order.
+    The dependencies are kept as the edges of the target graph that
+    the :class:`Scheduler` builds before the function itself.
+
+    The keyword arguments **inputs** and **outputs** declare the files
+    the target reads and writes (``$var`` references are expanded
+    when the target runs). A target that declares them is skipped,
+    across builds, while its inputs and its code are unchanged and
+    all of its outputs exist.
     """
-    def __init__(self, *targets):
+    def __init__(self, *targets, **files):
         self.targets = list(targets)
+        self.inputs = _file_list(files.pop('inputs', []))
+        self.outputs = _file_list(files.pop('outputs', []))
+        if files:
+            raise TypeError('depends_on() got unexpected keyword arguments: ' +
+                            ', '.join(files.keys()))
 
 
     def __call__(self, method):
         def resolve_dependencies(**args):
-            for target in self.targets:
-                target_name = target.__name__
-                if not target_name in env.built_targets.keys():
-                    target(**args)
-                else:
-                    if target in env.built_targets[target_name]:
-                        print 'Target:', target.__name__, 'already built!'
-            return method(**args)
+            return scheduler.build(resolve_dependencies, **args)
         resolve_dependencies.__name__ = method.__name__
+        resolve_dependencies.__module__ = method.__module__
+        resolve_dependencies.__doc__ = method.__doc__
+        resolve_dependencies.ipym_dependencies = self.targets
+        resolve_dependencies.ipym_inputs = self.inputs
+        resolve_dependencies.ipym_outputs = self.outputs
+        resolve_dependencies.ipym_body = method
         return resolve_dependencies;
 
+def _file_list(files):
+    if isinstance(files, basestring):
+        return [files]
+    return list(files)
+
         
 
 ##################################################
@@ -186,72 +227,537 @@ def _format_compile_args(flags=[], include_dirs=[], lib_dirs=[], linking_libs=[]
 def _format_sources(*sources):
     return ' %s '%(' '.join(sources[0]))
 
-def _compile_object_file(source, flags=[], include_dirs=[]):
+def _object_directory(binname):
     """
-    Compile component object file for an exectuable or a library.
+    Get the directory of the object files of the binary **binname**.
+    Every binary has a directory of its own, so binaries that share
+    sources never overwrite each other's object files (a shared
+    library and a static library of the same sources are compiled
+    with different flags), and never compile them at the same time
+    when they are built in parallel.
     """
+    return env.current_build_path+'/'+binname+'.objs'
 
-    if env.verbosity_level >= VerbosityLevels.VERBOSE:
-        print '-->',  style.cyan_text('[ Compiling Object File ]: '), \
-            style.bold_text(os.path.basename(name))
-
+def _object_file_name(source, binname):
+    """
+    Get the path of the component object file of the binary
+    **binname** compiled from **source**.
+    """
     outfilename = os.path.basename(source)
-    outfilename =  env.current_build_path+'/'+outfilename.rsplit('.')[0] + '.o'
-    
+    return _object_directory(binname)+'/'+outfilename.rsplit('.')[0] + '.o'
+
+def _object_base_command(source, flags=[], include_dirs=[]):
+    """
+    Get the compiler command string for **source** without the
+    source, output and dependency file arguments.
+    """
     gxx_string = _get_compiler(source)+_get_global_flags(source)
     gxx_string += ' '.join(_format_compile_args(flags=flags, include_dirs=include_dirs))
+    return gxx_string
+
+def _object_compile_command(source, binname, flags=[], include_dirs=[]):
+    """
+    Get the output object file name and the compiler command string
+    for the component object file of **source** in the binary
+    **binname**.
+    """
+    outfilename = _object_file_name(source, binname)
+    
+    gxx_string = _object_base_command(source, flags, include_dirs)
+    gxx_string += depfile_flags(outfilename)
     gxx_string += source+' -o '+outfilename
+    return outfilename, gxx_string
 
-    if env.verbosity_level >= VerbosityLevels.VERY_VERBOSE:
-        print '    ',style.italic_text(gxx_string)
+def _compile_object_job(source, gxx_string, outfilename=None, base_string=None):
+    """
+    The worker pool job for a single object file.
 
-    execute_critical_command(gxx_string)
+    :returns: The :class:`CommandResult` of the compiler.
+    """
+    span = tracer.start(COMPILE, source, command=gxx_string)
+    try:
+        result = _compile_cached_object(source, gxx_string, outfilename, base_string)
+    except:
+        span.finish(failed=True)
+        raise
+    # The command says which worker compiled it.
+    span.finish(command=result.command)
+    return result
+
+def _compile_cached_object(source, gxx_string, outfilename=None, base_string=None):
+    """
+    Compile a single object file. With the object cache enabled the
+    object file is taken from the cache when it holds it, and put in
+    the cache when it is compiled.
 
-    if env.verbosity_level >= VerbosityLevels.VERY_VERBOSE:
-        print '-->', style.green_text('[ Compiled %s ]'%os.path.basename(name)) 
+    :returns: The :class:`CommandResult` of the compiler.
+    """
+    cache = get_object_cache()
+    if cache is None or outfilename is None:
+        return _run_compiler(source, gxx_string, outfilename, base_string)
+
+    key = cache.key(_get_compiler(source), base_string, source)
+    depfile = depfile_name(outfilename)
+    if key is not None and cache.fetch(key, outfilename, depfile):
+        return CommandResult(gxx_string, 0, 0.0, [], [])
+
+    # The object file may be a hard link into the cache, never let
+    # the compiler write into it.
+    if os.path.exists(outfilename):
+        os.remove(outfilename)
+    result = _run_compiler(source, gxx_string, outfilename, base_string)
+    if key is not None:
+        cache.store(key, outfilename, depfile)
+    return result
+
+def _run_compiler(source, gxx_string, outfilename=None, base_string=None):
+    """
+    Run the compiler command **gxx_string**. With compile workers
+    registered in ``env.dist_workers`` the source is compiled on the
+    least loaded worker, or here when none of them can take it.
+
+    :returns: The :class:`CommandResult` of the compiler.
+    """
+    if env.dist_workers and outfilename is not None and base_string is not None \
+            and can_distribute(source):
+        start_time = time.time()
+        remote = compile_remote(get_worker_set(env.dist_workers), base_string,
+                                source, outfilename, depfile_name(outfilename))
+        if remote is not None:
+            address, exit_value, diagnostics = remote
+            result = CommandResult('%s  # on %s' % (gxx_string, address), exit_value,
+                                   time.time() - start_time, [], diagnostics)
+            return check_result(result, target=source)
+    if env.dist_workers:
+        # Every compile that did not go to a worker, whatever the reason.
+        count('dist_local')
+    return execute(gxx_string, target=source, stream=False)
+
+_object_cache = None
+
+def get_object_cache():
+    """
+    The :class:`ObjectCache` in ``env.object_cache_dir``, or None if
+    the object cache is not enabled.
+    """
+    global _object_cache
+    if not env.object_cache_dir:
+        return None
+    if _object_cache is None or \
+            _object_cache.directory != os.path.abspath(os.path.expanduser(env.object_cache_dir)):
+        _object_cache = ObjectCache(env.object_cache_dir, env.object_cache_size,
+                                    _workspace_root)
+    _object_cache.max_size = env.object_cache_size
+    return _object_cache
+
+def start_build():
+    """
+    Forget the state of the previous build of this process that only
+    belongs to that build: the targets it built, the build counters,
+    the load of the compile workers and the trace. The build server
+    calls this before every request.
+    """
+    env.built_targets = {}
+    reset_counters()
+    reset_worker_sets()
+    tracer.clear()
+
+def report_object_cache():
+    """
+    Print the hit and miss statistics of the object cache, if it was
+    used, and evict the least recently used entries if it grew too
+    large.
+    """
+    cache = get_object_cache()
+    if cache is None or not cache.lookups:
+        return
+    cache.trim()
+    print style.bold_cyan_text('[ Object Cache ]:'), cache.summary()
+
+def report_profile():
+    """
+    With ``env.profile`` set, write the trace of the build to it and
+    print the slowest steps and the critical path of the build. The
+    trace is cleared for the next build either way.
+    """
+    if env.profile:
+        tracer.write(env.profile)
+        print style.bold_cyan_text('[ Profile ]:'), 'trace written to', env.profile
+        for line in tracer.summary():
+            print line
+    tracer.clear()
+
+def report_distributed():
+    """
+    Print how many object files were compiled on the compile workers
+    and how many here, if any workers are registered.
+    """
+    if not env.dist_workers:
+        return
+    remote = build_counters.get('dist_remote', 0)
+    local = build_counters.get('dist_local', 0)
+    if not remote + local:
+        return
+    print style.bold_cyan_text('[ Distributed ]:'), \
+        '%d compiled on workers, %d compiled locally, %d worker failures' % \
+        (remote, local, build_counters.get('dist_failures', 0))
+
+def _generator_target(rule, source, output):
+    """
+    The target that generates **output** from **source** with the
+    pattern **rule**. It is memoized on its input and output files,
+    so it only runs when the source or the rule changed or the
+    generated file is missing.
+    """
+    def generate(**kwargs):
+        return scheduler.build(generate, **kwargs)
+    generate.__name__ = output
+    generate.__module__ = rule.action.__module__
+    generate.ipym_dependencies = []
+    generate.ipym_inputs = [source]
+    generate.ipym_outputs = [output]
+    generate.ipym_body = rule.action
+    generate.ipym_arguments = dict(rule.arguments, input=source, output=output)
+    generate.ipym_directory = os.getcwd()
+    return generate
+
+def _generate_sources(name, sources):
+    """
+    Replace the **sources** of the binary **name** that a pattern rule
+    generates a source from (see :mod:`ipymake.patterns`) by the
+    generated files. Every generated file is a target of its own, the
+    scheduler generates them (in parallel up to ``env.jobs``) before
+    the binary is compiled.
+
+    :returns: The sources to compile.
+    """
+    rules = calling_rules() or []
+    generators = []
+    compiled = []
+    for source in sources:
+        rule = find_pattern_rule(source, rules)
+        if rule is None:
+            compiled.append(source)
+            continue
+        source = os.path.abspath(source)
+        output = rule.output_for(source)
+        generators.append(_generator_target(rule, source, output))
+        compiled.append(output)
+    if not generators:
+        return sources
+
+    def generate_sources(**kwargs):
+        pass
+    generate_sources.__name__ = 'sources of %s' % name
+    generate_sources.ipym_dependencies = generators
+    generate_sources.ipym_directory = os.getcwd()
+    scheduler.build(generate_sources)
+    return compiled
+
+def _unity_sources(name, sources, options):
+    """
+    Pop the unity build options off **options**: ``unity``, the number
+    of bundles to group **sources** in, and ``unity_exclude``, the
+    sources that are compiled on their own.
+
+    :returns: The sources to compile for the binary **name**, the
+        generated bundles when the unity build is on, else **sources**.
+    """
+    bundles = options.pop('unity', None)
+    exclude = options.pop('unity_exclude', [])
+    if not bundles:
+        return sources
+    _make_build_dir()
+    unity = unity_sources(env.current_build_path, name, sources, bundles, exclude)
+    if env.verbosity_level >= VerbosityLevels.VERBOSE:
+        print '-->',  style.cyan_text('[ Unity Build ]: '), \
+            style.bold_text('%d sources in %d files' % (len(sources), len(unity)))
+    return unity
+
+def _make_build_dir(binname=None):
+    """
+    Create the build directory, and the object directory of the binary
+    **binname** if one is given, if they do not exist yet.
+    """
+    directory = env.current_build_path
+    if binname is not None:
+        directory = _object_directory(binname)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except(OSError):
+            # Created by a target built in parallel.
+            if not os.path.isdir(directory):
+                raise
+
+def _compile_object_file(binname, source, flags=[], include_dirs=[]):
+    """
+    Compile component object file for an exectuable or a library.
+    """
+    return _compile_object_files(binname, [source], flags, include_dirs, jobs=1)[0]
+
+def _compile_object_files(binname, sources, flags=[], include_dirs=[], jobs=None):
+    """
+    Compile the component object files for the executable or library
+    **binname**. Up to **jobs** (defaults to ``env.jobs``) compilers run
+    at the same time. The first failure stops the batch, the compiler
+    diagnostics are printed per source file, in the order the sources
+    were given.
+
+    :returns: The list of object files, in the order of **sources**.
+    """
+    if jobs is None:
+        jobs = env.jobs
+
+    pool_jobs = []
+    outfilenames = []
+    for src in sources:
+        outfilename, gxx_string = _object_compile_command(src, binname, flags,
+                                                          include_dirs)
+        outfilenames.append(outfilename)
+        pool_jobs.append(Job(src, _compile_object_job, src, gxx_string, outfilename,
+                             _object_base_command(src, flags, include_dirs)))
 
-    return outfilename
+        if env.verbosity_level >= VerbosityLevels.VERBOSE:
+            print '-->',  style.cyan_text('[ Compiling Object File ]: '), \
+                style.bold_text(os.path.basename(src))
+        if env.verbosity_level >= VerbosityLevels.VERY_VERBOSE:
+            print '    ',style.italic_text(gxx_string)
+
+    WorkerPool(jobs).run(pool_jobs)
+
+    failed_jobs = []
+    for job in pool_jobs:
+        if not job.done:
+            continue
+        if job.failed:
+            failed_jobs.append(job)
+            print style.bold_red_text('[ Failed Compiling Object File ]:'), \
+                style.bold_text(os.path.basename(job.name))
+            output = getattr(job.error, 'output', [])
+        else:
+            output = job.result.stdout + job.result.stderr
+            if env.verbosity_level >= VerbosityLevels.VERY_VERBOSE:
+                print '-->', style.green_text('[ Compiled %s ]'%os.path.basename(job.name)) 
+        if len(output):
+            print '\n'.join(output)
+
+    for job, outfilename in zip(pool_jobs, outfilenames):
+        if job.done and not job.failed:
+            _record_object_dependencies(outfilename)
+            if env.use_fingerprints:
+                src, gxx_string = job.args[:2]
+                env.object_signatures[outfilename] = \
+                    _object_signature(src, outfilename, gxx_string)
+
+    if failed_jobs:
+        raise failed_jobs[0].error
+
+    return outfilenames
+
+def _source_files(sources):
+    """
+    The :class:`SourceFile` of each of **sources**, with the timestamp
+    it has before it is compiled. A source edited while it is compiled
+    is then seen as changed by the next build.
+    """
+    return [SourceFile(src) for src in sources]
 
-def _needs_recompile(name, sources):
-    if not name in ( cbin.name for cbin in env.compiled_binaries):
+def _record_object_dependencies(objfile):
+    """
+    Read the dependency file the compiler wrote for **objfile** and
+    keep the headers it includes, along with their timestamps, in the
+    build environment. The object files are per binary, so is this
+    record: a header change is seen by every binary that includes it.
+    """
+    try:
+        prereqs = parse_depfile(depfile_name(objfile))
+    except(IOError):
+        # No dependency information, the object will be considered
+        # out of date on the next build.
+        env.object_dependencies.pop(objfile, None)
+        return
+    headers = []
+    for header in prereqs[1:]:
+        header = os.path.abspath(header)
+        if os.path.exists(header):
+            headers.append(SourceFile(header))
+    env.object_dependencies[objfile] = headers
+
+def _object_signature(source, objfile, gxx_string):
+    """
+    The content fingerprint of **objfile**: the compiler command line
+    together with the content of the source and of every header it
+    included the last time it was compiled.
+    """
+    headers = [h.path for h in env.object_dependencies.get(objfile, [])]
+    return _fingerprints.signature(gxx_string, [source] + headers)
+
+def _headers_changed(objfile, checked_headers):
+    """
+    Determine if any header included by **objfile** changed since the
+    object was compiled. **checked_headers** maps the headers already
+    looked at in this scan to their result, since most of the headers
+    are shared by many objects.
+    """
+    if not env.object_dependencies.has_key(objfile):
         return True
-    old_binary = filter( lambda cbin: cbin.name == name, (cbin for cbin in env.compiled_binaries))[0]
-    if old_binary.needs_recompile():
+    for header in env.object_dependencies[objfile]:
+        if not checked_headers.has_key(header.path):
+            checked_headers[header.path] = header.has_changed()
+        if checked_headers[header.path]:
+            return True
+    return False
+
+def _find_compiled_binary(name):
+    """
+    Get the binary named **name** from the previous builds, or None
+    if it has never been built.
+    """
+    for cbin in env.compiled_binaries:
+        if cbin.name == name:
+            return cbin
+    return None
+
+def _record_compiled_binary(binary):
+    """
+    Remember **binary** for the next build, replacing the record of
+    any older build of the same name.
+    """
+    env.compiled_binaries = filter(lambda cbin: cbin.name != binary.name,
+                                   env.compiled_binaries) + [binary]
+
+def _stale_sources(name, sources, options, flags=[], include_dirs=[]):
+    """
+    Determine which of **sources** have to be compiled again to build
+    the binary **name**.  Only the sources whose object file is
+    missing, older than the source, or older than any of the headers
+    the source includes are returned, unless the binary was never
+    built or its compile options changed.
+
+    With ``env.use_fingerprints`` set the timestamps are only used to
+    avoid reading unchanged files, a source is out of date when the
+    content of it or its headers, or its compiler command line changed.
+    """
+    if env.use_fingerprints:
+        return _stale_sources_by_content(name, sources, flags, include_dirs)
+
+    old_binary = _find_compiled_binary(name)
+    if old_binary is None or old_binary.options != options:
+        return list(sources)
+
+    stale = []
+    checked_headers = {}
+    for src in sources:
+        ofile = old_binary.get_object_file(src)
+        # The object files of older builds may be somewhere else.
+        if ofile is None or ofile.path != _object_file_name(src, name) or \
+                _headers_changed(ofile.path, checked_headers) or \
+                ofile.needs_recompile(env.object_dependencies[ofile.path]):
+            stale.append(src)
+        elif env.verbosity_level >= VerbosityLevels.VERBOSE:
+            print '-->',  style.cyan_text('[ Object File Up to Date ]: '), \
+                style.bold_text(os.path.basename(src))
+    return stale
+
+def _stale_sources_by_content(name, sources, flags, include_dirs):
+    """
+    The content fingerprint version of :func:`_stale_sources`.
+    """
+    stale = []
+    for src in sources:
+        objfile, gxx_string = _object_compile_command(src, name, flags, include_dirs)
+        if not os.path.exists(objfile) or \
+                not env.object_signatures.has_key(objfile) or \
+                env.object_signatures[objfile] != \
+                _object_signature(src, objfile, gxx_string):
+            stale.append(src)
+        elif env.verbosity_level >= VerbosityLevels.VERBOSE:
+            print '-->',  style.cyan_text('[ Object File Up to Date ]: '), \
+                style.bold_text(os.path.basename(src))
+    return stale
+
+def _needs_relink(name, sources, stale_sources, binpath, options):
+    """
+    The binary has to be linked again when any of its object files
+    were compiled, or are missing or newer than the binary, the binary
+    is missing, or its list of sources or its options changed.
+    """
+    if len(stale_sources) or not os.path.exists(binpath):
         return True
-    return any( ((sf.path not in sources) for sf in old_binary.source_files))
-    
+    old_binary = _find_compiled_binary(name)
+    if old_binary is None or old_binary.options != options:
+        return True
+    old_sources = [sf.path for sf in old_binary.source_files]
+    if old_sources != list(sources):
+        return True
+    bin_mod_time = os.stat(binpath).st_mtime
+    for src in sources:
+        objfile = _object_file_name(src, name)
+        if not os.path.exists(objfile) or os.stat(objfile).st_mtime > bin_mod_time:
+            return True
+    return False
+
 ##################################################
 # runtimecore.py Main User Functions 
 ##################################################
 
 def execute_critical_command(cmd_string, target="", indent=""):
     """
-    Execute a system command and raise an error and exit on a bad
-    return value from the command.
+    Execute a system command and raise a :class:`BuildError` on a bad
+    return value from the command.  IPython style ``$var`` references
+    in **cmd_string** are expanded in the namespace of the caller.
+
+    :returns: The :class:`CommandResult` of the command.
     """
+    caller = sys._getframe(1)
+    cmd_string = expand_variables(cmd_string, caller.f_globals, caller.f_locals)
+    return execute(cmd_string, target)
+
+def shell_command(cmd_string, global_ns, local_ns=None):
+    """
+    Run a shell escape (``!cmd`` or a program line) of a target body
+    translated by :mod:`ipymake.translator`. Like in IPython a failed
+    command does not stop the target.
+
+    :returns: The exit value of the command.
+    """
+    cmd_string = expand_variables(cmd_string, global_ns, local_ns)
+    return run_command(cmd_string).exit_value
+
+def shell_capture(cmd_string, global_ns, local_ns=None):
+    """
+    Run the ``name = !cmd`` shell escape of a translated target body.
+
+    :returns: The list of the output lines of the command.
+    """
+    cmd_string = expand_variables(cmd_string, global_ns, local_ns)
+    result = run_command(cmd_string, stream=False)
+    for line in result.stderr:
+        print >>sys.stderr, line
+    return result.stdout
+
+def shell_cd(path, global_ns, local_ns=None):
+    """
+    Run the ``cd`` of a translated target body.
+    """
+    path = expand_variables(path, global_ns, local_ns).strip() or '~'
+    os.chdir(os.path.expanduser(path))
 
-    r_cmd_string = indent + "retval = !"+cmd_string+" ; echo $?"
-    r_if_string = indent + "if retval[-1] != '0':"
-    error_msg = "Bad exit value\nTARGET: "+target+\
-        " \nCOMMAND: "+cmd_string + "\nRETURN VALUE: %s"
-    r_then_string = indent + "    raise RuntimeError(\"\"\""+error_msg+"\"\"\"%retval[-1])"
-    
-    ip.runlines([r_cmd_string, r_if_string, r_then_string])
-    retval =  ip.user_ns['retval']
-    if retval[-1] != EXPECTED_EXIT_VALUE:
-        sys.stderr.write('\n'.join(retval[:-1]))
-        my_pid = os.getpid()
-        os.kill(my_pid, signal.SIGKILL)
-    else:
-        retlines = filter(lambda s: s.strip() >0, retval[:-1])
-        if len(retlines):
-            print '\n'.join(retlines[:-1])
-    pass
 
-    
 def compile_shared_library(name, *sources, **options):
     """
-    Compile a shared object library from sources.
+    Compile a shared object library from sources. The keyword option
+    **jobs** sets how many object files are compiled at the same time
+    (defaults to ``env.jobs``, the ``-j`` option of ipymake).
+
+    With the keyword option **unity** set to a number the sources are
+    compiled as that many unity bundles (see :mod:`ipymake.unity`),
+    except for the sources listed in **unity_exclude**.
+
+    Sources that a pattern rule matches (``.y``, ``.l``, ``.i``, ...)
+    are generated first and the generated files are compiled, see
+    :mod:`ipymake.patterns`.
     """
     assert len(sources)
 
@@ -260,30 +766,34 @@ def compile_shared_library(name, *sources, **options):
     print style.bold_purple_text('[ Scanning Dependencies for Shared Library ]:'),\
         style.bold_text(libname)
     
-    if not _needs_recompile(libname, sources):
+    # Get the options
+    jobs = options.pop('jobs', None)
+    sources = _generate_sources(libname, sources)
+    sources = _unity_sources(libname, sources, options)
+    flags, include_dirs, lib_dirs, linking_libs = _parse_compile_options(options)
+
+    binpath = env.current_build_path+'/'+libname
+    stale_sources = _stale_sources(libname, sources, options, flags, include_dirs)
+
+    if not _needs_relink(libname, sources, stale_sources, binpath, options):
         print style.bold_cyan_text('[ Shared Library Up to Date ]:'),\
         style.bold_text(libname)
         return 
 
-    binpath = env.current_build_path+'/'+libname
     gxx_template = "%(COMPILER)s %(FLAGS)s%(LIBNAME)s -o  %(BINPATH)s"\
         " %(SOURCES)s %(LINKING_LIBS)s" 
 
-    # Get the options
-    flags, include_dirs, lib_dirs, linking_libs = _parse_compile_options(options)
-    
-
-    comp_lib_sources = []
     compiler = _get_compiler(sources[0])
    
     print style.intense_blue_text('[ Building Shared Library ]:'),\
         style.bold_text(libname)
  
-    ip.runlines("mkdir -p $env.current_build_path")
+    _make_build_dir(libname)
  
-    # compile all of the sources for the library
-    for src in sources:
-        comp_lib_sources.append(_compile_object_file(src, flags, include_dirs))
+    # compile the out of date sources for the library
+    source_files = _source_files(sources)
+    _compile_object_files(libname, stale_sources, flags, include_dirs, jobs)
+    comp_lib_sources = [_object_file_name(src, libname) for src in sources]
     
     print style.red_text('[ Linking Shared Library ]:'), \
         style.bold_text(libname)
@@ -303,48 +813,58 @@ def compile_shared_library(name, *sources, **options):
     if env.verbosity_level >= VerbosityLevels.VERY_VERBOSE:
         print gxx_string
     
-    execute_critical_command(gxx_string)
+    span = tracer.start(LINK, libname, command=gxx_string)
+    try:
+        execute_critical_command(gxx_string)
+    finally:
+        span.finish()
     
     print style.green_text('[ Built Shared Library ]:'), style.bold_text(libname)
 
-    env.compiled_binaries.append(SharedLibrary(libname, sources, comp_lib_sources, options, binpath))
+    _record_compiled_binary(SharedLibrary(libname, source_files, comp_lib_sources, options,
+                                          binpath))
 
     pass
 
 
 def compile_executable(name, *sources, **options):
     """
-    Compile an executable from the sources.
+    Compile an executable from the sources. Takes the same **jobs**
+    option as :func:`compile_shared_library`, and generates the
+    sources that a pattern rule matches the same way.
     """
 
     print style.bold_purple_text('[ Scanning Dependencies for Executable ]:'),\
         style.bold_text(name)
     
-    if not _needs_recompile(name, sources):
+    # Get the options
+    jobs = options.pop('jobs', None)
+    sources = _generate_sources(name, sources)
+    flags, include_dirs, lib_dirs, linking_libs = _parse_compile_options(options)
+
+    binpath = env.current_build_path+'/'+name
+    stale_sources = _stale_sources(name, sources, options, flags, include_dirs)
+
+    if not _needs_relink(name, sources, stale_sources, binpath, options):
         print style.bold_cyan_text('[ Executable Up to Date ]:'),\
         style.bold_text(name)
         return 
 
-    binpath = env.current_build_path+'/'+name
     print style.intense_blue_text('[ Building Executable ]:'),\
         style.bold_text(name)
 
 
-    gxx_template = "%(COMPILER)s %(FLAGS)s -o $env.current_build_path/%(BINNAME)s"\
+    gxx_template = "%(COMPILER)s %(FLAGS)s -o %(BINPATH)s"\
         " %(SOURCES)s %(LINKING_LIBS)s" 
 
-    # Get the options
-    flags, include_dirs, lib_dirs, linking_libs = _parse_compile_options(options)
-    
-
-    comp_exec_sources = []
     compiler = _get_compiler(sources[0])
     
     
-    ip.runlines("mkdir -p $env.current_build_path") 
+    _make_build_dir(name)
        
-    for src in sources:
-        comp_exec_sources.append(_compile_object_file(src, flags, include_dirs))
+    source_files = _source_files(sources)
+    _compile_object_files(name, stale_sources, flags, include_dirs, jobs)
+    comp_exec_sources = [_object_file_name(src, name) for src in sources]
     
     print style.red_text('[ Linking Executable ]:'), \
         style.bold_text(name)
@@ -356,69 +876,138 @@ def compile_executable(name, *sources, **options):
     sources_str = _format_sources(comp_exec_sources)
 
     gxx_string = gxx_template % {'COMPILER':compiler, 'FLAGS':flags_str, 
-                                 'BINNAME':name, 'SOURCES':sources_str,
+                                 'BINPATH':binpath, 'SOURCES':sources_str,
                                  'LINKING_LIBS':linking_libs_str}
     
     if env.verbosity_level >= VerbosityLevels.VERY_VERBOSE:
         print gxx_string
     
-    execute_critical_command(gxx_string)
+    span = tracer.start(LINK, name, command=gxx_string)
+    try:
+        execute_critical_command(gxx_string)
+    finally:
+        span.finish()
 
     print style.green_text('[ Built Executable ]:'), style.bold_text(name)
 
-    env.compiled_binaries.append(Executable(name, sources, comp_exec_sources, options, binpath))
+    _record_compiled_binary(Executable(name, source_files, comp_exec_sources, options, binpath))
 
     pass
 
 def compile_static_library(name, *sources, **options):
     """
-    Compile static library from sources.
+    Compile static library from sources. Takes the same **jobs**,
+    **unity** and **unity_exclude** options as
+    :func:`compile_shared_library`.
     """
     libname = 'lib' + name + '.a'
  
     print style.bold_purple_text('[ Scanning Dependencies for Static Library ]:'),\
         style.bold_text(libname)
     
-    if not _needs_recompile(libname, sources):
-        print style.bold_cyan_text('[ Shared Library Up to Date ]:'),\
-        style.bold_text(libname)
-        return 
-
-
+    jobs = options.pop('jobs', None)
+    sources = _generate_sources(libname, sources)
+    sources = _unity_sources(libname, sources, options)
     flags, include_dirs, lib_dirs, libs = _parse_compile_options(options)
-    comp_lib_sources = []
 
     binpath = env.current_build_path+'/'+libname
+    stale_sources = _stale_sources(libname, sources, options, flags, include_dirs)
+
+    if not _needs_relink(libname, sources, stale_sources, binpath, options):
+        print style.bold_cyan_text('[ Static Library Up to Date ]:'),\
+        style.bold_text(libname)
+        return 
 
     print style.intense_blue_text('[ Building Static Library ]:'),\
         style.bold_text(libname)
 
-    ip.runlines("mkdir -p "+env.current_build_path) 
-    for src in sources:
-        comp_lib_sources.append(_compile_object_file(src, flags, include_dirs))
+    _make_build_dir(libname)
+    source_files = _source_files(sources)
+    compiled = _compile_object_files(libname, stale_sources, flags, include_dirs, jobs)
+    comp_lib_sources = [_object_file_name(src, libname) for src in sources]
     
-    ar_string = "ar rcs $env.current_build_path/"+libname+" "+' '.join(comp_lib_sources)
-
     print style.red_text('[ Linking Static Library ]:'), \
         style.bold_text(libname)
 
-    if env.verbosity_level >= VerbosityLevels.VERY_VERBOSE:
-        print ar_string
-
-    execute_critical_command(ar_string)
+    start_time = time.time()
+    for ar_string in _archive_commands(libname, binpath, comp_lib_sources, compiled, options):
+        if env.verbosity_level >= VerbosityLevels.VERY_VERBOSE:
+            print ar_string
+        span = tracer.start(LINK, libname, command=ar_string)
+        try:
+            execute(ar_string, target=libname)
+        finally:
+            span.finish()
+    count('archive_updates')
+    count('archive_seconds', time.time() - start_time)
     print style.green_text('[ Built Static Library ]:'), style.bold_text(libname)
     
-    env.compiled_binaries.append(StaticLibrary(libname, sources, comp_lib_sources, options, binpath))
+    _record_compiled_binary(StaticLibrary(libname, source_files, comp_lib_sources, options,
+                                          binpath))
  
     pass
 
+def _archive_commands(libname, binpath, objfiles, compiled, options):
+    """
+    The ``ar`` commands that bring the archive **binpath** up to date
+    with **objfiles**, of which **compiled** were just compiled. An
+    existing archive is updated in place: the members that are gone
+    are deleted and only the members that were compiled, or are newer
+    than the archive, are replaced or added.
+    The archive is only written from scratch when it is missing or
+    its options changed.
+
+    ``ar`` keeps the symbol index of an archive that has one up to
+    date whenever it writes it, the index holds the offsets of the
+    members so it can never be left as it is.
+    """
+    old_binary = _find_compiled_binary(libname)
+    if old_binary is None or old_binary.options != options or \
+            not os.path.exists(binpath):
+        if os.path.exists(binpath):
+            os.remove(binpath)
+        return ['ar rcs %s %s' % (binpath, ' '.join(objfiles))]
+
+    members = [ofile.path for ofile in old_binary.sources]
+    commands = []
+    removed = [objfile for objfile in members if not objfile in objfiles]
+    if removed:
+        commands.append('ar d %s %s' % (binpath, ' '.join(map(os.path.basename, removed))))
+    archive_mod_time = os.stat(binpath).st_mtime
+    updated = [objfile for objfile in objfiles
+               if objfile in compiled or not objfile in members or
+               os.stat(objfile).st_mtime > archive_mod_time]
+    if updated:
+        commands.append('ar rs %s %s' % (binpath, ' '.join(updated)))
+    return commands
+
+def report_archives():
+    """
+    Print how many static libraries were updated and the time spent
+    in ``ar``, if any were.
+    """
+    updates = build_counters.get('archive_updates', 0)
+    if not updates:
+        return
+    print style.bold_cyan_text('[ Archives ]:'), \
+        '%d static libraries updated in %.3fs' % \
+        (updates, build_counters.get('archive_seconds', 0.0))
+
+def _record_install_file(install_file):
+    """
+    Remember **install_file** for the install target, replacing the
+    record of the same file from a previous build.
+    """
+    env.install_files = filter(lambda f: f.location != install_file.location,
+                               env.install_files) + [install_file]
+
 def add_include_file(filename):
-    env.install_files.append(
+    _record_install_file(
         IncludeFile(filename, os.path.realpath(filename)))    
     pass
 
 def add_share_file(filename):
-    env.install_files.append(
+    _record_install_file(
         ShareFile(filename, os.path.realpath(filename)))    
     pass
 
@@ -503,11 +1092,15 @@ def build_python_package(auto_pkg_dir=None,**kwargs):
     # TODO: incorporate the env.verbosity_level here somehow to
     # specify a -v if verbosity is high enough.
     sys.argv = ['build_python_package', '-q', 'build', '-b', env.current_build_path]
-    setm = setup(**kwargs)
-    # reset the args back to the original values.
-    sys.argv = temp_args 
+    span = tracer.start(DISTUTILS, name, command=' '.join(sys.argv[1:]))
+    try:
+        setm = setup(**kwargs)
+    finally:
+        span.finish()
+        # reset the args back to the original values.
+        sys.argv = temp_args 
     print style.green_text('[ Built Python Package ]:'), name
-    env.compiled_binaries.append(PythonPackage(**kwargs))
+    _record_compiled_binary(PythonPackage(**kwargs))
     pass
 
 
@@ -527,7 +1120,9 @@ def build_python_extension(name, **kwargs):
     # later.
     temp_args = sys.argv
     sys.argv = ['build_python_package', '-q', 'build', '-b', env.current_build_path]
+    span = tracer.start(DISTUTILS, name, command='Extension(%r)' % name)
     ext = Extension(name, **kwargs)
+    span.finish()
     # reset the args back to the original values.
     sys.argv = temp_args 
     print style.green_text('[ Configured Python Extension ]:'), name
@@ -536,21 +1131,76 @@ def build_python_extension(name, **kwargs):
 
 
 
-def build_subdir(subdir, ipym_file, target='all', cmd_args=""):
+_loaded_subdirs = {}
+
+def load_subdir(subdir, ipym_file, cmd_args=""):
     """
-    Continue running ipymake starting in the directory **subdir** with
-    target **target**.
+    Compile the build file **ipym_file** in the directory **subdir**
+    and load it in-process. Each build file gets a module of its own,
+    named after its path, so the targets of different directories
+    never clobber each other. The targets of the module run in
+    **subdir**, and its init hook runs once when it is first loaded.
+
+    :returns: The loaded module.
     """
-    RUN_SUBDIR_STRING_TPL = \
-        """pushd %(_SUBDIR)s\nfrom %(IPM_MODULE)s import *\ninit_hook()\n%(IPM_TARGET)s()\npopd\n"""
+    import imp
+    import ipymake.ipymcompiler as ipymc
+
+    build_file = os.path.abspath(os.path.join(subdir, ipym_file))
+    force_recompile = '--force-recompile' in cmd_args.split()
+    ipymc.ipym_compile(build_file, force_recompile, {'mode' : env.compile_mode})
+
+    ipym_path = ipymc.format_outpath(build_file)
+    mod_time = os.stat(ipym_path).st_mtime
+    if _loaded_subdirs.has_key(build_file):
+        module, loaded_mod_time = _loaded_subdirs[build_file]
+        if loaded_mod_time == mod_time:
+            return module
+
+    relpath = os.path.splitext(build_file)[0]
+    if relpath.startswith(os.getcwd() + os.sep):
+        relpath = relpath[len(os.getcwd() + os.sep):]
+    module_name = 'ipym_' + ''.join([c.isalnum() and c or '_' for c in relpath])
+
+    # The module is loaded again into the same namespace, without the
+    # pattern rules of the previous version of the build file.
+    if sys.modules.has_key(module_name):
+        reset_pattern_rules(sys.modules[module_name].__dict__)
+
+    push_dir = os.getcwd()
+    os.chdir(os.path.dirname(build_file))
+    try:
+        module = imp.load_source(module_name, ipym_path)
+        module.init_hook()
+    finally:
+        os.chdir(push_dir)
+    _loaded_subdirs[build_file] = (module, mod_time)
+    return module
 
-    os.system('cd %s\nipymakec %s %s' %(subdir,cmd_args, ipym_file))
-    
-    subdir_dict = { 'IPM_MODULE' : 'ipym_'+ipym_file.split('.')[0],
-                    '_SUBDIR' : subdir,
-                    'IPM_TARGET' : target,
-                    'COMMAND_ARGS' : cmd_args }
-   
-    ip.runlines(RUN_SUBDIR_STRING_TPL%subdir_dict)
+def subdir_target(subdir, ipym_file, target='all', cmd_args=""):
+    """
+    Get the target **target** of the build file **ipym_file** in the
+    directory **subdir**.  Used as a dependency it joins the targets
+    of the sub build to the dependency graph of this build, so they
+    are scheduled together with everything else::
 
-    
+        common_all = subdir_target('common', 'build_common.py')
+
+        datastreams: common_all
+            ...
+    """
+    return getattr(load_subdir(subdir, ipym_file, cmd_args), target)
+
+def build_subdir(subdir, ipym_file, target='all', cmd_args=""):
+    """
+    Continue running ipymake starting in the directory **subdir** with
+    target **target**. The build file is loaded in-process with
+    :func:`load_subdir` and its target is built by the same
+    scheduler as this build.
+    """
+    span = tracer.start(SUBDIR, os.path.join(subdir, ipym_file), target=target,
+                        command=cmd_args)
+    try:
+        return subdir_target(subdir, ipym_file, target, cmd_args)()
+    finally:
+        span.finish()
@@ -0,0 +1,669 @@
+"""
+:mod:`scheduler` -- Dependency Graph Scheduler
+=================================================
+
+Builds a target by first collecting the whole graph of targets it
+depends on (the ``depends_on`` edges), and then running every target
+as soon as all of its dependencies are built. Independent targets run
+at the same time in worker processes, up to the job limit. When more
+targets are ready than there are free workers, the ones on the
+longest path to the requested target go first.
+
+The targets run by the worker processes and their compilers share
+the ``-j`` job slots of a :class:`~ipymake.workerpool.JobServer`, so
+building targets in parallel never runs more than ``-j`` jobs at
+once. A worker process is only forked with a slot for it, and its
+first compile uses that slot. The slots a worker held are given back
+when it is reaped, however it ended.
+
+Each worker process is forked from the build, so it sees the build
+environment as it was when the target started. The changes a target
+makes to the environment (compiled binaries, install files, ...) are
+sent back to the build when it finishes and merged in. Its output
+goes through the same pipe, a line at a time, and is printed by the
+build, so the output of the targets never ends up in the middle of a
+line of another and always reaches where the output of the build
+goes (the client of the build server, ...).
+
+A target that declares its input and output files is memoized across
+builds: its signature covers its code, the values of the build file
+variables it uses (``CFLAGS``, ...) and the content of its inputs,
+and while the signature is the one recorded by the last successful
+run and all of its outputs exist the target is skipped.
+
+"""
+import sys
+import os
+import re
+import time
+import select
+import struct
+import cPickle
+import hashlib
+import threading
+
+from ipymake.executor import BuildError, expand_variables, variable_references
+from ipymake.fingerprint import FingerprintStore
+from ipymake.profiler import tracer, TARGET
+from ipymake.workerpool import JobServer, get_job_server, set_job_server
+
+
+# Counters of the whole build (cache hits, ...). The counts of a
+# worker process are added in when it finishes. They are cleared when
+# the next build starts, see Scheduler.build.
+build_counters = {}
+_counters_lock = threading.Lock()
+
+def reset_counters():
+    """
+    Clear the build counters, before a new build.
+    """
+    _counters_lock.acquire()
+    try:
+        build_counters.clear()
+    finally:
+        _counters_lock.release()
+
+def count(name, increment=1):
+    """
+    Add *increment* to the build counter *name*.
+    """
+    _counters_lock.acquire()
+    try:
+        build_counters[name] = build_counters.get(name, 0) + increment
+    finally:
+        _counters_lock.release()
+
+
+# The frames of the result pipe of a worker process: a one byte type,
+# a four byte length and the payload. A TOKENS frame holds the number
+# of job slots the worker took besides its own.
+OUTPUT, ERRORS, RESULT, TOKENS = 'O', 'E', 'R', 'T'
+_FRAME_HEADER = struct.Struct('!cI')
+
+def _write_frame(fd, frame_type, payload):
+    data = _FRAME_HEADER.pack(frame_type, len(payload)) + payload
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+class PipeWriter:
+    """
+    File like object of a worker process that sends the complete
+    lines written to it to the build, as *frame_type* frames of the
+    result pipe *fd*. The writers of a pipe share *lock*.
+    """
+    def __init__(self, fd, frame_type, lock):
+        self.fd = fd
+        self.frame_type = frame_type
+        self.lock = lock
+        self.pending = ''
+
+    def write(self, data):
+        self.lock.acquire()
+        try:
+            self.pending += str(data)
+            end = self.pending.rfind('\n') + 1
+            if end:
+                _write_frame(self.fd, self.frame_type, self.pending[:end])
+                self.pending = self.pending[end:]
+        finally:
+            self.lock.release()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            if self.pending:
+                _write_frame(self.fd, self.frame_type, self.pending)
+                self.pending = ''
+        finally:
+            self.lock.release()
+
+    def isatty(self):
+        return False
+
+
+class DependencyCycleError(BuildError):
+    """
+    Raised when the targets depend on each other in a cycle.
+    """
+    def __init__(self, cycle):
+        BuildError.__init__(self, 'Dependency cycle: ' +
+                            ' -> '.join([node.name for node in cycle]))
+        self.cycle = cycle
+
+
+def target_key(target):
+    """
+    The name that identifies a target across build files.
+    """
+    return '%s.%s' % (target.__module__, target.__name__)
+
+
+def code_signature(code):
+    """
+    A digest of the code object *code* (and of the code objects it
+    contains) that leaves out the line numbers, so that editing
+    another part of the build file does not change it.
+    """
+    md5 = hashlib.md5(code.co_code)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            md5.update(code_signature(const))
+        else:
+            md5.update(repr(const))
+    md5.update(repr(code.co_names))
+    return md5.hexdigest()
+
+
+_NAME_RE = re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*')
+
+# The types of the build file variables that are part of the signature
+# of a target. Anything else (modules, functions, the environment, ...)
+# has no value that is the same from one build to the next.
+_VALUE_TYPES = (basestring, bool, int, long, float, list, tuple, dict)
+
+def referenced_names(code):
+    """
+    The names the code object *code* (and the code objects it
+    contains) may look up in its globals: the names it loads and the
+    names in the ``$var`` references of its strings.
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            names.update(referenced_names(const))
+        elif isinstance(const, basestring):
+            for expr in variable_references(const):
+                names.update(_NAME_RE.findall(expr))
+    return names
+
+
+def globals_signature(code, namespace):
+    """
+    A digest of the values of the variables of *namespace* (the
+    globals of a build file) that *code* refers to, so that changing
+    e.g. the ``CFLAGS`` a target passes to its commands changes it.
+    """
+    md5 = hashlib.md5()
+    for name in sorted(referenced_names(code)):
+        value = namespace.get(name)
+        if isinstance(value, _VALUE_TYPES):
+            md5.update('\0%s=%r' % (name, value))
+    return md5.hexdigest()
+
+
+class TargetNode:
+    """
+    A target in the dependency graph.
+    """
+    def __init__(self, target):
+        self.target = target
+        self.name = target.__name__
+        self.key = target_key(target)
+        self.directory = getattr(target, 'ipym_directory', None)
+        self.inputs = getattr(target, 'ipym_inputs', [])
+        self.outputs = getattr(target, 'ipym_outputs', [])
+        # Keyword arguments of the body that are part of the target,
+        # e.g. the files of a pattern rule.
+        self.arguments = getattr(target, 'ipym_arguments', {})
+        # The signature of the memoized target, once it is checked.
+        self.signature = None
+        self.up_to_date = None
+        self.dependencies = []
+        self.dependents = []
+        # Expected run time and the length of the longest chain of
+        # targets from this one up to the requested target.
+        self.cost = 1.0
+        self.priority = 0.0
+
+    def get_body(self):
+        return getattr(self.target, 'ipym_body', self.target)
+    body = property(get_body)
+
+    def get_memoized(self):
+        return bool(self.inputs or self.outputs)
+    memoized = property(get_memoized)
+
+    def files(self, paths):
+        """
+        The absolute paths of *paths*, with the ``$var`` references
+        expanded in the namespace of the build file.
+        """
+        namespace = getattr(self.body, 'func_globals', {})
+        directory = self.directory or os.getcwd()
+        return [os.path.join(directory, expand_variables(path, namespace))
+                for path in paths]
+
+    def run(self, **kwargs):
+        if self.arguments:
+            kwargs = dict(kwargs, **self.arguments)
+        return self.body(**kwargs)
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return '%s(%s)' % (class_name, repr(self.key))
+
+
+class TargetGraph:
+    """
+    The graph of the targets a root target depends on, directly or
+    through other targets.
+    """
+    def __init__(self, root, costs={}):
+        self.nodes = {}
+        self.order = []
+        self.root = self._collect(root, [], {})
+        for node in self.order:
+            node.cost = costs.get(node.key, node.cost)
+        self._prioritize()
+
+    def _collect(self, target, path, visiting):
+        """
+        Depth first walk of the dependencies that also finds the
+        topological order (dependencies first) of the targets.
+        """
+        key = target_key(target)
+        if visiting.get(key):
+            cycle = [n for n in path[[n.key for n in path].index(key):]]
+            raise DependencyCycleError(cycle + [self.nodes[key]])
+        if self.nodes.has_key(key):
+            return self.nodes[key]
+
+        node = TargetNode(target)
+        self.nodes[key] = node
+        visiting[key] = True
+        path.append(node)
+        for dep in getattr(target, 'ipym_dependencies', []):
+            dep_node = self._collect(dep, path, visiting)
+            if not dep_node in node.dependencies:
+                node.dependencies.append(dep_node)
+                dep_node.dependents.append(node)
+        path.pop()
+        visiting[key] = False
+        self.order.append(node)
+        return node
+
+    def _prioritize(self):
+        """
+        Give each node the cost of the longest path from it to the
+        root, this is the critical path first priority.
+        """
+        for node in reversed(self.order):
+            longest = 0.0
+            for dependent in node.dependents:
+                longest = max(longest, dependent.priority)
+            node.priority = node.cost + longest
+
+
+class Scheduler:
+    """
+    Runs the graph of a target with up to *jobs* targets at once.
+    """
+    def __init__(self, env, jobs=None, fingerprints=None):
+        self.env = env
+        self.jobs = jobs
+        if fingerprints is None:
+            fingerprints = FingerprintStore(env.fingerprints)
+        self.fingerprints = fingerprints
+        # How many builds are running in this process, the targets
+        # build their generated sources with builds of their own (and
+        # a worker process starts out inside the build it was forked
+        # from).
+        self.depth = 0
+
+    def get_jobs(self):
+        if self.jobs is None:
+            return self.env.jobs
+        return self.jobs
+
+    def is_built(self, node):
+        return node.key in self.env.built_targets.get(node.name, [])
+
+    def mark_built(self, node):
+        built = self.env.built_targets.setdefault(node.name, [])
+        if not node.key in built:
+            built.append(node.key)
+
+    def signature(self, node):
+        """
+        The signature of a memoized target: its code and arguments,
+        the values of the build file variables it uses, the content of
+        its inputs and the names of its outputs.
+        """
+        code = getattr(node.body, 'func_code', None)
+        md5 = hashlib.md5()
+        if code is not None:
+            md5.update(code_signature(code))
+            md5.update(globals_signature(code, getattr(node.body, 'func_globals', {})))
+        if node.arguments:
+            md5.update(repr(sorted(node.arguments.items())))
+        for path in node.files(node.inputs):
+            md5.update('\0<%s\0%s' % (path, self.fingerprints.digest(path)))
+        for path in node.files(node.outputs):
+            md5.update('\0>%s' % path)
+        return md5.hexdigest()
+
+    def is_up_to_date(self, node):
+        """
+        Determine if the memoized *node* can be skipped. Only checked
+        once the dependencies of the node are built, as they may
+        change its inputs.
+        """
+        if not node.memoized:
+            return False
+        if node.up_to_date is None:
+            node.signature = self.signature(node)
+            outputs = node.files(node.outputs)
+            node.up_to_date = \
+                self.env.target_signatures.get(node.key) == node.signature and \
+                all([os.path.exists(path) for path in outputs])
+        return node.up_to_date
+
+    def skip(self, node):
+        print 'Target:', node.name, 'is up to date.'
+        tracer.start(TARGET, node.key, up_to_date=True,
+                     dependencies=[dep.key for dep in node.dependencies]).finish()
+        self.mark_built(node)
+
+    def build(self, target, **kwargs):
+        """
+        Build *target* and everything it depends on. A build that is
+        not part of another one starts with cleared build counters.
+
+        :returns: The return value of *target*.
+        """
+        if not self.depth:
+            reset_counters()
+        self.depth += 1
+        try:
+            return self._build(target, **kwargs)
+        finally:
+            self.depth -= 1
+
+    def _build(self, target, **kwargs):
+        graph = TargetGraph(target, self.env.target_durations)
+        pending = [node for node in graph.order if not self.is_built(node)]
+        if not len(pending):
+            print 'Target:', target.__name__, 'already built!'
+            return None
+
+        if self.get_jobs() <= 1 or not hasattr(os, 'fork'):
+            return self._build_serial(graph, pending, **kwargs)
+        return self._build_parallel(graph, pending, **kwargs)
+
+    def _ready(self, pending, running):
+        """
+        The pending nodes that have all of their dependencies built,
+        the highest priority first.
+        """
+        ready = []
+        for node in pending:
+            if node in running:
+                continue
+            if all([self.is_built(dep) for dep in node.dependencies]):
+                ready.append(node)
+        ready.sort(key=lambda node: -node.priority)
+        return ready
+
+    def _run_node(self, node, **kwargs):
+        """
+        Run the body of a single target in the directory of its build
+        file, keeping the working directory of the build unchanged.
+        """
+        push_dir = os.getcwd()
+        start_time = time.time()
+        span = tracer.start(TARGET, node.key, directory=node.directory,
+                            dependencies=[dep.key for dep in node.dependencies])
+        try:
+            if node.directory:
+                os.chdir(node.directory)
+            retval = node.run(**kwargs)
+        finally:
+            os.chdir(push_dir)
+            span.finish()
+        self.env.target_durations[node.key] = time.time() - start_time
+        if node.signature is not None:
+            self.env.target_signatures[node.key] = node.signature
+        self.mark_built(node)
+        return retval
+
+    def _build_serial(self, graph, pending, **kwargs):
+        retval = None
+        while pending:
+            node = self._next_ready(pending, [])
+            pending.remove(node)
+            if self.is_up_to_date(node):
+                self.skip(node)
+                continue
+            retval = self._run_node(node, **kwargs)
+        return retval
+
+    def _ready_to_run(self, pending, running):
+        """
+        Skip the ready nodes that are up to date, which may make more
+        nodes ready.
+
+        :returns: The ready nodes that have to run.
+        """
+        while True:
+            ready = self._ready(pending, running)
+            skipped = [node for node in ready if self.is_up_to_date(node)]
+            if not skipped:
+                return ready
+            for node in skipped:
+                pending.remove(node)
+                self.skip(node)
+
+    def _next_ready(self, pending, running):
+        ready = self._ready(pending, running)
+        if not len(ready):
+            raise BuildError('No target can be built out of: ' +
+                             ', '.join([node.key for node in pending]))
+        return ready[0]
+
+    def _build_parallel(self, graph, pending, **kwargs):
+        # A target built by a worker process uses the job slots of the
+        # build it was forked from.
+        if get_job_server() is not None:
+            return self._run_graph(graph, pending, **kwargs)
+        server = JobServer(self.get_jobs())
+        set_job_server(server)
+        try:
+            return self._run_graph(graph, pending, **kwargs)
+        finally:
+            set_job_server(None)
+            server.close()
+
+    def _run_graph(self, graph, pending, **kwargs):
+        server = get_job_server()
+        running = {}
+        buffers = {}
+        failures = []
+        retval = None
+        snapshot = None
+        while pending or running:
+            waiting = False
+            if not failures:
+                running_nodes = [node for node, pid in running.values()]
+                ready = self._ready_to_run(pending, running_nodes)
+                if not running and pending and not ready:
+                    # Something has to be ready when nothing is running.
+                    self._next_ready(pending, running_nodes)
+                for node in ready[:self.get_jobs() - len(running)]:
+                    if node is graph.root:
+                        # Everything else is built by now. The requested
+                        # target runs in the build itself, so that its
+                        # return value is kept.
+                        pending.remove(node)
+                        retval = self._run_node(node, **kwargs)
+                        continue
+                    # The worker runs with a job slot of its own. While
+                    # others run, wait for one without blocking, their
+                    # output has to be read meanwhile.
+                    if not running:
+                        server.acquire()
+                    elif not server.try_acquire():
+                        waiting = True
+                        break
+                    pending.remove(node)
+                    if snapshot is None:
+                        snapshot = self.env.snapshot()
+                    pid, fd = self._spawn(node, snapshot, **kwargs)
+                    running[fd] = (node, pid)
+
+            if not running:
+                break
+
+            token_fd = None
+            if waiting:
+                token_fd = server.read_fd
+            for node, result in self._wait(running, buffers, token_fd):
+                for name, value in result.get('counters', {}).items():
+                    count(name, value)
+                tracer.extend(result.get('trace', []))
+                if result['error'] is not None:
+                    failures.append((node, result))
+                    continue
+                self.env.merge_changes(result['changes'])
+                for name, keys in result['built_targets'].items():
+                    built = self.env.built_targets.setdefault(name, [])
+                    built.extend([key for key in keys if not key in built])
+                self.env.target_durations[node.key] = result['wall_time']
+                self.mark_built(node)
+                snapshot = None
+
+        if failures:
+            node, result = failures[0]
+            raise BuildError('Target %s failed:\n%s' % (node.key, result['error']),
+                             result.get('error_result'))
+        return retval
+
+    def _spawn(self, node, snapshot, **kwargs):
+        """
+        Fork a worker process that runs *node*.
+
+        :returns: tuple(pid, read end of the result pipe)
+        """
+        sys.stdout.flush()
+        sys.stderr.flush()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(write_fd)
+            return pid, read_fd
+
+        os.close(read_fd)
+        lock = threading.Lock()
+        sys.stdout = PipeWriter(write_fd, OUTPUT, lock)
+        sys.stderr = PipeWriter(write_fd, ERRORS, lock)
+        server = get_job_server()
+        server.hold(1)
+        def send_tokens(taken):
+            lock.acquire()
+            try:
+                _write_frame(write_fd, TOKENS, str(taken))
+            finally:
+                lock.release()
+        server.on_change = send_tokens
+        status = 0
+        result = {'error' : None, 'error_result' : None, 'changes' : {},
+                  'built_targets' : {}, 'wall_time' : 0.0, 'counters' : {},
+                  'trace' : []}
+        counters = build_counters.copy()
+        trace_mark = tracer.mark()
+        try:
+            try:
+                start_time = time.time()
+                self._run_node(node, **kwargs)
+                result['wall_time'] = time.time() - start_time
+                result['changes'] = self.env.changes_since(snapshot)
+                result['built_targets'] = self.env.built_targets
+                for name, value in build_counters.items():
+                    result['counters'][name] = value - counters.get(name, 0)
+            except BaseException, e:
+                status = 1
+                result['error'] = '%s: %s' % (e.__class__.__name__, e)
+                # The failed command and its output, for the build to
+                # report.
+                if isinstance(e, BuildError):
+                    result['error_result'] = e.result
+            result['trace'] = tracer.events_since(trace_mark)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            _write_frame(write_fd, RESULT, cPickle.dumps(result, -1))
+        finally:
+            os._exit(status)
+
+    def _wait(self, running, buffers, token_fd=None):
+        """
+        Wait for at least one of the *running* workers to finish, or
+        for a job slot to be put back in the pipe *token_fd*, and print
+        the output of the workers on the way. *buffers* holds the part
+        of the frames read so far, the results and the job slots the
+        workers took.
+
+        :returns: The list of tuple(node, result) of the finished workers.
+        """
+        server = get_job_server()
+        finished = []
+        while not finished:
+            fds = running.keys()
+            if token_fd is not None:
+                fds.append(token_fd)
+            readable = select.select(fds, [], [])[0]
+            for fd in readable:
+                if fd == token_fd:
+                    continue
+                data = os.read(fd, 1 << 16)
+                if data:
+                    self._read_frames(fd, data, buffers)
+                    continue
+                os.close(fd)
+                node, pid = running.pop(fd)
+                os.waitpid(pid, 0)
+                data, result, tokens = buffers.pop(fd, ('', None, 0))
+                # The slot the worker was forked with, and the ones it
+                # had taken when it ended.
+                server.release()
+                server.return_tokens(tokens)
+                if result is None:
+                    result = {'error' : 'worker process died'}
+                finished.append((node, result))
+            if token_fd in readable:
+                break
+        return finished
+
+    def _read_frames(self, fd, data_read, buffers):
+        """
+        Handle the complete frames of the result pipe *fd*, with
+        *data_read* just read from it.
+        """
+        data, result, tokens = buffers.get(fd, ('', None, 0))
+        data += data_read
+        while len(data) >= _FRAME_HEADER.size:
+            frame_type, size = _FRAME_HEADER.unpack_from(data)
+            end = _FRAME_HEADER.size + size
+            if len(data) < end:
+                break
+            payload = data[_FRAME_HEADER.size:end]
+            data = data[end:]
+            if frame_type == OUTPUT:
+                sys.stdout.write(payload)
+                sys.stdout.flush()
+            elif frame_type == ERRORS:
+                sys.stderr.write(payload)
+                sys.stderr.flush()
+            elif frame_type == TOKENS:
+                tokens = int(payload)
+            elif frame_type == RESULT:
+                try:
+                    result = cPickle.loads(payload)
+                except Exception:
+                    result = None
+        buffers[fd] = (data, result, tokens)
@@ -0,0 +1,124 @@
+"""
+:mod:`shell` -- Lazily Started IPython Shell
+===============================================
+
+The targets of a build file use IPython (through ``ip.runlines``) for
+the shell escapes (``!cmd``, ``$var``, the shell aliases of the
+``sh`` profile).  Starting IPython is by far the most expensive part
+of starting a build, and many targets never need it. The
+:class:`LazyShell` stands in for the IPython API instance and only
+starts IPython the first time a target actually uses it.
+
+"""
+import sys
+
+from ipymake.executor import BuildError
+
+SHELL_ARGV = ['-noconfirm_exit', '-p', 'sh', '-po', ' ']
+
+
+def _reraise_build_error(shell, etype, value, tb):
+    raise value
+
+
+def running_ipython():
+    """
+    Get the API instance of the IPython this process is running in,
+    without importing IPython if it was not imported already.
+    """
+    if not sys.modules.has_key('IPython'):
+        return None
+    try:
+        from IPython import ipapi
+    except(ImportError):
+        return None
+    return ipapi.get()
+
+
+def start_ipython():
+    """
+    Get the API instance of the running IPython, or start an
+    embedded IPython with the ``sh`` profile if there is none.
+    """
+    ip = running_ipython()
+    if ip is None:
+        from IPython.Shell import IPShell
+        from IPython import ipapi
+        IPShell(argv=SHELL_ARGV)
+        ip = ipapi.get()
+
+    # IPython would print a BuildError raised from within a target
+    # body and carry on with the next line, a failed build step has
+    # to stop the build instead.
+    ip.IP.set_custom_exc((BuildError,), _reraise_build_error)
+    return ip
+
+
+# The names IPython keeps its own state in, never written back.
+_SHELL_NAMES = ['In', 'Out', 'exit', 'quit', 'get_ipython']
+
+def _write_back(before, user_ns, caller):
+    """
+    Copy the names the shell bound (or deleted) since *before* to the
+    globals of the *caller* frame. The locals of a function can not be
+    changed from here, so the names of those are left alone.
+    """
+    globals_ = caller.f_globals
+    locals_ = {}
+    if caller.f_locals is not globals_:
+        locals_ = caller.f_locals
+    for name, value in user_ns.items():
+        if name.startswith('_') or name in _SHELL_NAMES or locals_.has_key(name):
+            continue
+        if not before.has_key(name) or before[name] is not value:
+            globals_[name] = value
+    for name in before.keys():
+        if not user_ns.has_key(name) and globals_.has_key(name) and \
+                not locals_.has_key(name):
+            del globals_[name]
+
+
+class LazyShell:
+    """
+    Forwards everything to the IPython API instance, which is only
+    created on first use. The lines given to :meth:`runlines` are run
+    with the globals of the calling module, so the targets of every
+    build file see their own names in the shell, and the names the
+    lines bind or delete are written back to those globals. The user
+    namespace of IPython is left as it was before the lines ran.
+    """
+    def __init__(self):
+        self._ip = None
+
+    def get_api(self):
+        if self._ip is None:
+            self._ip = start_ipython()
+        return self._ip
+    api = property(get_api)
+
+    def get_started(self):
+        return self._ip is not None or running_ipython() is not None
+    started = property(get_started)
+
+    def runlines(self, lines):
+        api = self.get_api()
+        caller = sys._getframe(1)
+        # IPython keeps the one user namespace, put back after the run
+        # so that the names of a build file do not leak into the lines
+        # of the next one.
+        saved = dict(api.user_ns)
+        api.user_ns.update(caller.f_globals)
+        if caller.f_locals is not caller.f_globals:
+            api.user_ns.update(caller.f_locals)
+        before = dict(api.user_ns)
+        try:
+            return api.runlines(lines)
+        finally:
+            _write_back(before, api.user_ns, caller)
+            api.user_ns.clear()
+            api.user_ns.update(saved)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.get_api(), name)
@@ -7,6 +7,8 @@
 from os.path import splitext
 FILENAME, EXTENTION = range(2)
 
+DEPFILE_EXTENTION = '.d'
+
 ASM_SOURCE_FILES = ('.asm')
 ASM_HEADER_FILES = ('.h')
 ASM_FILES = ASM_SOURCE_FILES + ASM_HEADER_FILES
@@ -53,3 +55,60 @@ def is_java_source(srcfile):
 PYTHON_SOURCE_FILES = ('.py',)
 SWIG_SOURCE_FILES = ('.i',)
 
+
+
+def depfile_name(objfile):
+    """
+    Get the name of the make style dependency file that the compiler
+    writes next to the object file *objfile*.
+    """
+    return splitext(objfile)[FILENAME] + DEPFILE_EXTENTION
+
+def depfile_flags(objfile):
+    """
+    The gcc/g++ flags that write the dependency file for *objfile* as
+    a side effect of compiling it. System headers are left out.
+    """
+    return ' -MMD -MF %s ' % depfile_name(objfile)
+
+def parse_depfile(filename):
+    """
+    Read the prerequisites out of a make style dependency file, as
+    written by ``gcc -MMD -MF <filename>``. The first prerequisite is
+    the source file itself, followed by the headers it includes.
+
+    :returns: The list of prerequisite paths, in the order they appear.
+    """
+    infile = open(filename, 'r')
+    try:
+        text = infile.read()
+    finally:
+        infile.close()
+
+    # Join the continued lines and drop the target.
+    text = text.replace('\\\n', ' ').replace('$$', '$')
+    prereq_start = text.find(': ')
+    if prereq_start < 0:
+        prereq_start = text.find(':\n')
+    if prereq_start < 0:
+        return []
+    text = text[prereq_start+1:]
+
+    prereqs = []
+    current = []
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if char == '\\' and index+1 < len(text) and text[index+1] in ' #':
+            current.append(text[index+1])
+            index += 1
+        elif char.isspace():
+            if current:
+                prereqs.append(''.join(current))
+                current = []
+        else:
+            current.append(char)
+        index += 1
+    if current:
+        prereqs.append(''.join(current))
+    return prereqs
@@ -0,0 +1,252 @@
+"""
+:mod:`translator` -- Ahead of Time Translation of Target Bodies
+==================================================================
+
+The body of a target may use the IPython shell escapes of the ``sh``
+profile: ``!cmd``, ``name = !cmd``, ``cd dir`` and lines that start
+with the name of a program (``rm -rfv $env.current_build_path``),
+with ``$var`` and ``${expr}`` expanded in the command. Run through
+``ip.runlines`` every one of those lines is parsed and prefiltered by
+IPython each time the target runs.
+
+:func:`translate_target` rewrites such a body once, when the build
+file is compiled, into plain Python that calls the command runner of
+:mod:`ipymake.runtimecore` directly. The result is compiled as the
+real body of the target function, so running a target needs no
+parsing at all. Bodies that use IPython features that have no
+translation (magics, help, ...) are left to IPython.
+
+"""
+import os
+import re
+import keyword
+import __builtin__
+import ast
+
+_CAPTURE_RE = re.compile(r'^([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*!(.*)$')
+_COMMAND_RE = re.compile(r'^([a-zA-Z_][a-zA-Z0-9_.+-]*)(\s.*)?$')
+# What may follow the first word of a program line, anything else
+# (an assignment, a call, an operator, ...) makes it a Python line.
+_NOT_ARGUMENT_RE = re.compile(r'^\s*([=(\[.,:*%<>&|^]|\+=|-=|==|!=)')
+
+# Names of the runtime that would otherwise look like programs.
+RUNTIME_NAMES = ['env', 'ip', 'execute', 'style']
+
+# The words looked up by is_command since clear_command_lookups, to
+# the program each one was found as. The translation of a build file
+# is only good for as long as they are found (or not) on the PATH the
+# same way, so they are recorded in its manifest.
+_path_commands = {}
+
+def resolve_command(word):
+    """
+    Look up the program *word* on the :envvar:`PATH` right now.
+
+    :returns: The path of the program, or None if there is none.
+    """
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, word)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+def find_command(word):
+    """
+    Determine if *word* is a program on the :envvar:`PATH` right now.
+    """
+    return resolve_command(word) is not None
+
+def is_command(word):
+    """
+    Determine if *word* is a program on the :envvar:`PATH`, which the
+    ``sh`` profile of IPython makes a shell alias of.
+    """
+    if not _path_commands.has_key(word):
+        _path_commands[word] = resolve_command(word)
+    return _path_commands[word] is not None
+
+def clear_command_lookups():
+    _path_commands.clear()
+
+def command_lookups():
+    """
+    The dictionary of the words looked up by :func:`is_command` since
+    :func:`clear_command_lookups`, to the path of the program, None
+    for the ones that are not programs.
+    """
+    return dict(_path_commands)
+
+
+class _LineScanner:
+    """
+    Follows the brackets, strings and line continuations of Python
+    source line by line, to know which lines start a new statement.
+    """
+    def __init__(self):
+        self.depth = 0
+        self.quote = None
+        self.continued = False
+
+    def at_statement_start(self):
+        return self.depth == 0 and self.quote is None and not self.continued
+
+    def feed(self, line):
+        i = 0
+        self.continued = False
+        while i < len(line):
+            if self.quote is not None:
+                if line[i] == '\\':
+                    i += 2
+                    continue
+                if line.startswith(self.quote, i):
+                    i += len(self.quote)
+                    self.quote = None
+                    continue
+                i += 1
+                continue
+            char = line[i]
+            if char == '#':
+                break
+            if char in '\'"':
+                if line.startswith(char * 3, i):
+                    self.quote = char * 3
+                else:
+                    self.quote = char
+                i += len(self.quote)
+                continue
+            if char in '([{':
+                self.depth += 1
+            elif char in ')]}':
+                self.depth = max(0, self.depth - 1)
+            elif char == '\\' and i == len(line) - 1:
+                self.continued = True
+            i += 1
+        if self.quote is not None and len(self.quote) == 1:
+            # A single quoted string does not span lines.
+            self.quote = None
+
+
+def translate_line(line, known_names):
+    """
+    Translate a single statement line of a target body.
+
+    :returns: The Python line, the line itself if it is not a shell
+        escape, or None if it needs IPython.
+    """
+    stripped = line.strip()
+    indent = line[:len(line) - len(line.lstrip())]
+    if not stripped or stripped.startswith('#'):
+        return line
+    if stripped.startswith('%') or stripped.endswith('?'):
+        return None
+    if stripped.startswith('!'):
+        command = stripped[1:]
+        if command.startswith('!'):
+            return None
+        return '%sshell_command(%r, globals(), locals())' % (indent, command)
+
+    match = _CAPTURE_RE.match(stripped)
+    if match:
+        return '%s%s = shell_capture(%r, globals(), locals())' % \
+            (indent, match.group(1), match.group(2))
+
+    match = _COMMAND_RE.match(stripped)
+    if not match:
+        return line
+    word, rest = match.group(1), match.group(2) or ''
+    if keyword.iskeyword(word) or word in known_names or \
+            _NOT_ARGUMENT_RE.match(rest):
+        return line
+    if word == 'cd':
+        return '%sshell_cd(%r, globals(), locals())' % (indent, rest.strip())
+    if is_command(word):
+        return '%sshell_command(%r, globals(), locals())' % (indent, stripped)
+    return line
+
+
+def translate_shell_escapes(code, known_names=()):
+    """
+    Translate the shell escapes of the target body *code*.
+
+    :returns: The translated body, or None if it can not be run
+        without IPython.
+    """
+    known_names = dict.fromkeys(list(known_names) + RUNTIME_NAMES + dir(__builtin__))
+    scanner = _LineScanner()
+    lines = []
+    for line in code.splitlines():
+        if scanner.at_statement_start():
+            translated = translate_line(line, known_names)
+            if translated is None:
+                return None
+            if translated is not line:
+                lines.append(translated)
+                continue
+        scanner.feed(line)
+        lines.append(line)
+    translated = '\n'.join(lines)
+    try:
+        compile(translated + '\n', '<target>', 'exec')
+    except(SyntaxError):
+        return None
+    return translated
+
+
+def assigned_names(code):
+    """
+    The names *code* binds in its own scope (assignments, loop
+    variables, imports, functions and classes), but not the names
+    bound in the functions and classes it defines.
+    """
+    names = []
+    def visit(node):
+        name = None
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            name = node.id
+        elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            name = node.name
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                add(alias.asname or alias.name.split('.')[0])
+        elif isinstance(node, ast.ImportFrom):
+            for alias in node.names:
+                if alias.name != '*':
+                    add(alias.asname or alias.name)
+        if name is not None:
+            add(name)
+        if isinstance(node, (ast.FunctionDef, ast.Lambda)):
+            # Names bound in here are local to the nested scope, only
+            # the default values, the decorators and the base classes
+            # are evaluated in the body itself.
+            children = node.args.defaults + getattr(node, 'decorator_list', [])
+        elif isinstance(node, ast.ClassDef):
+            children = node.bases + node.decorator_list
+        elif isinstance(node, (ast.GeneratorExp, ast.SetComp, ast.DictComp)):
+            children = []
+        else:
+            children = ast.iter_child_nodes(node)
+        for child in children:
+            visit(child)
+    def add(name):
+        if not name in names:
+            names.append(name)
+    visit(ast.parse(code + '\n'))
+    return names
+
+
+def translate_target(code, known_names=()):
+    """
+    Translate the target body *code* to the Python body of the target
+    function. The names the body binds are declared global, so that,
+    as with IPython, what one target sets is seen by the others.
+
+    :returns: The function body (not indented), or None if the body
+        needs IPython.
+    """
+    translated = translate_shell_escapes(code, known_names)
+    if translated is None:
+        return None
+    names = [name for name in assigned_names(translated) if name != 'kwargs']
+    if names:
+        translated = 'global %s\n%s' % (', '.join(names), translated)
+    return translated
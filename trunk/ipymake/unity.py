@@ -0,0 +1,104 @@
+"""
+:mod:`unity` -- Unity Builds
+===============================
+
+A library of many small C or C++ files that include the same headers
+spends most of its build starting the compiler and parsing those
+headers again for every file. In a unity build the sources are
+grouped into a few generated bundle files, each one just including
+its sources, and the bundles are compiled instead.
+
+Every source is put in a bundle by a hash of its name, so adding,
+removing or editing a source only changes (and recompiles) its own
+bundle. A bundle file is only written when its list of sources
+changed, which keeps its timestamp and the object compiled from it.
+
+Sources that can not share a translation unit with others (file
+static names that clash, macros that leak, ...) are left out of the
+bundles and compiled on their own.
+
+"""
+import os
+import hashlib
+
+BUNDLE_PREFIX = 'unity_'
+
+
+def bundle_index(source, bundles):
+    """
+    The bundle of the *bundles* bundles that *source* goes in.
+    """
+    digest = hashlib.md5(os.path.normpath(source)).hexdigest()
+    return int(digest[:8], 16) % bundles
+
+def group_sources(sources, bundles):
+    """
+    Group *sources* into at most *bundles* bundles per source file
+    extension, C and C++ sources are never bundled together.
+
+    :returns: The dictionary of (extension, bundle index) to the list
+        of sources of that bundle, in the order of *sources*.
+    """
+    groups = {}
+    for source in sources:
+        extension = os.path.splitext(source)[1]
+        groups.setdefault((extension, bundle_index(source, bundles)), []).append(source)
+    return groups
+
+def bundle_filename(directory, name, extension, index):
+    """
+    The path of the bundle *index* of the binary *name*.
+    """
+    name = ''.join([c.isalnum() and c or '_' for c in name])
+    return os.path.join(directory, '%s%s_%d%s' % (BUNDLE_PREFIX, name, index, extension))
+
+def write_bundle(filename, sources):
+    """
+    Write the bundle *filename* that includes *sources*, unless it
+    already does. The sources are included relative to the bundle, so
+    that its preprocessed text does not depend on where the tree is.
+
+    :returns: True if the bundle file was written.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    lines = ['/* Generated by ipymake for a unity build, do not edit. */']
+    for source in sources:
+        relpath = os.path.relpath(os.path.abspath(source), directory)
+        lines.append('#include "%s"' % relpath)
+    text = '\n'.join(lines) + '\n'
+    try:
+        infile = open(filename, 'r')
+        try:
+            if infile.read() == text:
+                return False
+        finally:
+            infile.close()
+    except(IOError):
+        pass
+    outfile = open(filename, 'w')
+    try:
+        outfile.write(text)
+    finally:
+        outfile.close()
+    return True
+
+def unity_sources(directory, name, sources, bundles, exclude=()):
+    """
+    Write the bundles of the binary *name* in *directory*.
+
+    :returns: The sources to compile in place of *sources*: the
+        bundles, followed by the *exclude* sources, in the order they
+        were given.
+    """
+    bundles = max(1, int(bundles))
+    excluded = [os.path.normpath(source) for source in exclude]
+    bundled = [source for source in sources if os.path.normpath(source) not in excluded]
+    unbundled = [source for source in sources if os.path.normpath(source) in excluded]
+
+    groups = group_sources(bundled, bundles)
+    filenames = []
+    for (extension, index), members in sorted(groups.items()):
+        filename = bundle_filename(directory, name, extension, index)
+        write_bundle(filename, members)
+        filenames.append(filename)
+    return filenames + unbundled
@@ -0,0 +1,240 @@
+"""
+:mod:`workerpool` -- Bounded pool of build worker threads
+===========================================================
+
+Runs a batch of independent jobs (normally compiler invocations) with
+at most a fixed number of them in flight at once.  The work done by
+each job is expected to happen outside of the interpreter (in a child
+process), so plain threads are enough to keep every worker busy.
+
+The pools of a build and of the worker processes it forks (see
+:mod:`ipymake.scheduler`) share the job slots of a :class:`JobServer`,
+so a parallel build never runs more than ``-j`` jobs at once however
+many targets are built at the same time. Every target a worker process
+runs holds a slot of its own, which the first job of the target uses.
+
+"""
+import os
+import sys
+import fcntl
+import errno
+import select
+import threading
+
+
+class JobServer:
+    """
+    The *slots* job slots shared by a process and the processes it
+    forks, like the jobserver of GNU make: a pipe that holds a token
+    for every free slot. A job takes a token out of the pipe before
+    it starts and puts it back when it is done.
+
+    A forked process that was given a token by the process that forked
+    it (see :meth:`hold`) uses that slot first, so it can always run
+    one job however many tokens the others hold.
+    """
+    TOKEN = '+'
+
+    def __init__(self, slots):
+        self.slots = max(1, int(slots))
+        self.read_fd, self.write_fd = os.pipe()
+        os.write(self.write_fd, self.TOKEN * self.slots)
+        # Never block in read, several processes wait on the pipe.
+        flags = fcntl.fcntl(self.read_fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.read_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        # The slots of the tokens this process was given, and how
+        # many of them are free.
+        self.held = 0
+        self.free_held = 0
+        # The tokens this process took out of the pipe.
+        self.taken = 0
+        # Called with the number of taken tokens when it changes.
+        self.on_change = None
+        self._lock = threading.Lock()
+
+    def hold(self, tokens):
+        """
+        Take over the slots of the *tokens* the process that forked
+        this one took for it. Called in the forked process.
+        """
+        self.held = self.free_held = tokens
+        self.taken = 0
+        self.on_change = None
+        self._lock = threading.Lock()
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self.taken)
+
+    def try_acquire(self):
+        """
+        Take a job slot if one is free.
+
+        :returns: True if a slot was taken.
+        """
+        self._lock.acquire()
+        try:
+            if self.free_held:
+                self.free_held -= 1
+                return True
+            try:
+                if not os.read(self.read_fd, 1):
+                    return False
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return False
+                raise
+            self.taken += 1
+            self._changed()
+            return True
+        finally:
+            self._lock.release()
+
+    def acquire(self):
+        """
+        Block until a job slot is free, and take it.
+        """
+        while not self.try_acquire():
+            try:
+                select.select([self.read_fd], [], [])
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def release(self):
+        self._lock.acquire()
+        try:
+            if self.free_held < self.held:
+                self.free_held += 1
+                return
+            os.write(self.write_fd, self.TOKEN)
+            self.taken -= 1
+            self._changed()
+        finally:
+            self._lock.release()
+
+    def return_tokens(self, tokens):
+        """
+        Put back the *tokens* a process that is gone took out of the
+        pipe and did not return.
+        """
+        if tokens > 0:
+            os.write(self.write_fd, self.TOKEN * tokens)
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+_job_server = None
+
+def get_job_server():
+    """
+    The :class:`JobServer` of the build, or None when the build runs
+    a single target at a time.
+    """
+    return _job_server
+
+def set_job_server(server):
+    global _job_server
+    _job_server = server
+
+
+class Job:
+    """
+    A single unit of work submitted to a :class:`WorkerPool`. The
+    return value of the job function is kept in :attr:`result`, an
+    exception raised by it is kept in :attr:`error`.
+    """
+    def __init__(self, name, function, *args, **kwargs):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+        self.exc_info = None
+        self.started = False
+        self.done = False
+
+    def run(self):
+        self.started = True
+        try:
+            self.result = self.function(*self.args, **self.kwargs)
+        except Exception, e:
+            self.error = e
+            self.exc_info = sys.exc_info()
+        self.done = True
+
+    def get_failed(self): return self.error is not None
+    failed = property(get_failed)
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return '%s(%s)' % (class_name, repr(self.name))
+
+
+class WorkerPool:
+    """
+    Runs a list of :class:`Job` instances on at most *num_workers*
+    threads.  Jobs are started in the order they are given. As soon
+    as one job fails no further jobs are started, the jobs that are
+    already running are allowed to finish. With a :class:`JobServer`
+    set each job also waits for a job slot of the build.
+    """
+    def __init__(self, num_workers=1):
+        self.num_workers = max(1, int(num_workers))
+        self._lock = threading.Lock()
+
+    def run(self, jobs):
+        """
+        Run all of *jobs* and block until they have finished (or
+        the batch was stopped by a failure).
+
+        :returns: The list of jobs, in submission order.
+        """
+        jobs = list(jobs)
+        state = {'next' : 0, 'stopped' : False}
+
+        def next_job():
+            self._lock.acquire()
+            try:
+                if state['stopped'] or state['next'] >= len(jobs):
+                    return None
+                job = jobs[state['next']]
+                state['next'] += 1
+                return job
+            finally:
+                self._lock.release()
+
+        server = get_job_server()
+
+        def worker():
+            job = next_job()
+            while job is not None:
+                if server is None:
+                    job.run()
+                else:
+                    server.acquire()
+                    try:
+                        job.run()
+                    finally:
+                        server.release()
+                if job.failed:
+                    state['stopped'] = True
+                job = next_job()
+
+        num_threads = min(self.num_workers, len(jobs))
+        if num_threads <= 1:
+            # Keep the serial case free of threads so that it behaves
+            # exactly like a plain loop.
+            worker()
+            return jobs
+
+        threads = [threading.Thread(target=worker) for i in range(num_threads)]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return jobs
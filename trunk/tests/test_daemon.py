@@ -0,0 +1,80 @@
+"""
+Tests of the per build state of the build server of
+:mod:`ipymake.daemon`.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from ipymake import daemon, distributed, runtimecore
+from ipymake.profiler import tracer, TARGET
+from ipymake.scheduler import build_counters, count
+
+BUILD_FILE = '''
+broken:
+    env.target_signatures['ipymake_test.built'] = 'recorded'
+    raise BuildError('broken')
+    pass
+'''
+
+
+class BuildServerStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olddir = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        outfile = open('build.py', 'w')
+        try:
+            outfile.write(BUILD_FILE)
+        finally:
+            outfile.close()
+        self.env = runtimecore.env
+        self.old_filename = self.env.filename
+        self.env.filename = os.path.join(self.workdir, 'state.db')
+        self.env._conn = None
+        self.server = daemon.BuildServer(self.workdir)
+        self.server.runtimecore = runtimecore
+
+    def tearDown(self):
+        self.env.target_signatures.pop('ipymake_test.built', None)
+        self.env._conn = None
+        self.env.filename = self.old_filename
+        os.chdir(self.olddir)
+        shutil.rmtree(self.workdir)
+
+    def build(self, target):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            status = self.server.build({'filename' : 'build.py', 'target' : target})
+            return status, sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_previous_build_forgotten(self):
+        count('object_cache_hits')
+        distributed.get_worker_set('localhost:1')
+        tracer.start(TARGET, 'previous').finish()
+        self.env.built_targets = {'previous' : ['ipym_build.previous']}
+
+        self.server.start_build()
+        self.assertEqual(build_counters, {})
+        self.assertEqual(distributed._worker_sets, {})
+        self.assertEqual(tracer.events, [])
+        self.assertEqual(self.env.built_targets, {})
+
+    def test_failed_build_saves_state(self):
+        status, output = self.build('broken')
+        self.assertEqual(status, daemon.EXIT_BUILD_FAILED)
+        self.assertTrue('Build Failed' in output, output)
+        row = self.env.query('SELECT value FROM records WHERE map = ? AND key = ?',
+                             ('target_signatures', 'ipymake_test.built'))
+        self.assertNotEqual(row, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+"""
+Tests of the option filtering of the compile workers of
+:mod:`ipymake.distributed`, and of the coordinator sending them the
+compiles.
+"""
+import os
+import stat
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ipymake import distributed, runtimecore
+from ipymake.distributed import allowed_option, remote_command, find_compilers
+from ipymake.scheduler import build_counters, reset_counters
+
+
+class OptionFilterTest(unittest.TestCase):
+
+    def test_allowed_options(self):
+        for arg in ['-O2', '-Os', '-g', '-g3', '-gdwarf-4', '-Wall', '-Werror=format',
+                    '-w', '-pedantic', '-std=c99', '-std=gnu++11', '-fPIC',
+                    '-fno-strict-aliasing', '-fvisibility=hidden', '-march=native',
+                    '-m64', '-DNDEBUG', '-DVERSION=3', '-UNDEBUG', '-pthread', '-c']:
+            self.assertTrue(allowed_option(arg), arg)
+
+    def test_refused_options(self):
+        for arg in ['-o', '-ofile', '-B/tmp', '-specs=/file', '--specs=/file',
+                    '-aux-info', '/any/path', '@args', '-wrapper', '-fplugin=x',
+                    '-fprofile-generate', '-fprofile-use=x', '-fprofile-generate=..',
+                    '-Wa,-adhln=/tmp/listing', '-Wl,-o,/tmp/x', '-Wp,-MD,/tmp/x',
+                    '-x', '-E', '-S', '--param', '-save-temps', '-fdump-tree-all=/tmp/x',
+                    '-DPATH=/etc/passwd', '-I/usr/include', '-include', '-MF']:
+            self.assertFalse(allowed_option(arg), arg)
+
+    def test_remote_command(self):
+        self.assertEqual(remote_command('gcc -O2 -I. -I include -DX="a b" -U Y '
+                                        '-include config.h -isystem /usr/local -Wall'),
+                         'gcc -O2 -Wall')
+        self.assertEqual(remote_command('gcc  -g -c -fPIC -Wall  -fPIC   '),
+                         'gcc -g -c -fPIC -Wall -fPIC')
+
+    def test_remote_command_refused(self):
+        self.assertEqual(remote_command('gcc -O2 -aux-info /tmp/aux'), None)
+        self.assertEqual(remote_command('gcc --specs=/file'), None)
+
+
+class CompileWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = distributed.CompileWorkerServer('localhost', 0, capacity=1)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.worker = distributed.RemoteWorker(*self.server.server_address)
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.workdir)
+
+    def test_compile(self):
+        exit_value, diagnostics, objdata = \
+            self.worker.compile('gcc -O2 -Wall', 'a.i', 'int a(void) { return 1; }\n')
+        self.assertEqual(exit_value, 0)
+        self.assertTrue(objdata.startswith('\x7fELF'))
+
+    def test_refused(self):
+        aux_info = os.path.join(self.workdir, 'aux')
+        self.assertRaises(EOFError, self.worker.compile, 'gcc -aux-info %s' % aux_info,
+                          'a.i', 'int a(void) { return 1; }\n')
+        self.assertRaises(EOFError, self.worker.compile, 'gcc -O2', '../a.i', '')
+        self.assertFalse(os.path.exists(aux_info))
+
+    def test_compiler_paths(self):
+        # Only the name of a compiler, never a path to one.
+        gcc = self.server.compiler_paths['gcc']
+        for compiler in ['/tmp/x/gcc', gcc, 'bin/gcc', './gcc', 'gcc-evil']:
+            self.assertRaises(EOFError, self.worker.compile, '%s -O2' % compiler,
+                              'a.i', 'int a(void) { return 1; }\n')
+
+
+class FindCompilersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.olddir = os.getcwd()
+        self.path = os.environ.get('PATH')
+        for directory in ('bin', 'other'):
+            os.mkdir(os.path.join(self.workdir, directory))
+            for name in ('gcc', 'cc'):
+                filename = os.path.join(self.workdir, directory, name)
+                open(filename, 'w').close()
+                os.chmod(filename, stat.S_IRWXU)
+
+    def tearDown(self):
+        os.chdir(self.olddir)
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.workdir)
+
+    def test_first_on_path(self):
+        os.remove(os.path.join(self.workdir, 'bin', 'cc'))
+        os.environ['PATH'] = os.pathsep.join([os.path.join(self.workdir, 'bin'),
+                                              os.path.join(self.workdir, 'other')])
+        self.assertEqual(find_compilers(('gcc', 'cc', 'g++', '/tmp/x/gcc')),
+                         {'gcc' : os.path.join(self.workdir, 'bin', 'gcc'),
+                          'cc' : os.path.join(self.workdir, 'other', 'cc')})
+
+    def test_relative_path(self):
+        os.chdir(self.workdir)
+        os.environ['PATH'] = os.pathsep.join(['', 'bin', '.'])
+        self.assertEqual(find_compilers(('gcc', 'cc')), {})
+
+
+class RecordingWorkerSet:
+    """
+    A worker set of one worker that compiles nothing, recording what
+    had happened when a slot was taken.
+    """
+    def __init__(self, depfile):
+        self.depfile = depfile
+        self.acquired = []
+        self.address = 'recording:1'
+
+    def acquire(self):
+        self.acquired.append(os.path.exists(self.depfile))
+        return self
+
+    def release(self, worker, failed=False):
+        pass
+
+    def compile(self, command, unit_name, unit):
+        return 0, '', 'object'
+
+
+class CompileRemoteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olddir = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        outfile = open('a.c', 'w')
+        outfile.write('int a(void) { return 1; }\n')
+        outfile.close()
+        reset_counters()
+        self.dist_workers = runtimecore.env.dist_workers
+
+    def tearDown(self):
+        runtimecore.env.dist_workers = self.dist_workers
+        distributed.reset_worker_sets()
+        reset_counters()
+        os.chdir(self.olddir)
+        shutil.rmtree(self.workdir)
+
+    def test_preprocessed_first(self):
+        workers = RecordingWorkerSet('a.d')
+        address, exit_value, diagnostics = \
+            distributed.compile_remote(workers, 'gcc -O2', 'a.c', 'a.o', 'a.d')
+        self.assertEqual(workers.acquired, [True])
+        self.assertEqual(open('a.o').read(), 'object')
+
+    def test_not_preprocessed(self):
+        workers = RecordingWorkerSet('a.d')
+        self.assertEqual(distributed.compile_remote(workers, 'gcc -O2', 'missing.c',
+                                                    'a.o', 'a.d'), None)
+        self.assertEqual(workers.acquired, [])
+
+    def test_local_compiles_counted(self):
+        # No worker listens on the port, and the Fortran source is never
+        # sent to one.
+        runtimecore.env.dist_workers = 'localhost:1'
+        runtimecore._run_compiler('a.c', 'true', 'a.o', 'gcc -O2')
+        runtimecore._run_compiler('a.f90', 'true', 'a.o', 'gfortran -O2')
+        self.assertEqual(build_counters.get('dist_local'), 2)
+        self.assertEqual(build_counters.get('dist_remote'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Tests of the native command execution of :mod:`ipymake.executor`.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from ipymake import executor
+from ipymake.executor import BuildError, run_command, check_result, \
+    expand_variables, variable_references
+
+
+class RunCommandTest(unittest.TestCase):
+
+    def test_output_and_exit_value(self):
+        result = run_command('echo out; echo err >&2; exit 3', stream=False)
+        self.assertEqual(result.exit_value, 3)
+        self.failIf(result.succeeded)
+        self.assertEqual(result.stdout, ['out'])
+        self.assertEqual(result.stderr, ['err'])
+        self.assertTrue(result.wall_time >= 0)
+
+    def test_streamed_output(self):
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            result = run_command('echo one; echo two >&2')
+            out, err = sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        self.assertTrue(result.succeeded)
+        self.assertEqual(out, 'one\n')
+        self.assertEqual(err, 'two\n')
+
+    def test_full_pipes(self):
+        # More than a pipe holds on both streams, read at the same time.
+        command = ('%s -c "import sys; sys.stderr.write(\'e\' * 200000); '
+                   'sys.stdout.write(\'o\' * 200000)"' % sys.executable)
+        result = run_command(command, stream=False)
+        self.assertTrue(result.succeeded)
+        self.assertEqual(len(''.join(result.stdout)), 200000)
+        self.assertEqual(len(''.join(result.stderr)), 200000)
+
+    def test_working_directory(self):
+        workdir = tempfile.mkdtemp()
+        try:
+            result = run_command('pwd', stream=False, cwd=workdir)
+            self.assertEqual(os.path.realpath(result.stdout[0]),
+                             os.path.realpath(workdir))
+        finally:
+            shutil.rmtree(workdir)
+
+
+class CheckResultTest(unittest.TestCase):
+
+    def test_success(self):
+        result = run_command('true', stream=False)
+        self.assertTrue(check_result(result, 'target') is result)
+
+    def test_failure(self):
+        result = run_command('echo broken; exit 2', stream=False)
+        try:
+            check_result(result, 'calc')
+        except BuildError, error:
+            self.assertTrue(error.result is result)
+            self.assertEqual(error.output, ['broken'])
+            self.assertTrue('TARGET: calc' in str(error), str(error))
+            self.assertTrue('RETURN VALUE: 2' in str(error), str(error))
+        else:
+            self.fail('no BuildError raised')
+
+    def test_execute(self):
+        self.assertRaises(BuildError, executor.execute, 'false', 'calc', False)
+        self.assertEqual(BuildError('no command').output, [])
+
+
+class ExpandVariablesTest(unittest.TestCase):
+
+    def test_references(self):
+        command = 'gcc $CFLAGS -o ${name + ".o"} $src.path $$HOME'
+        self.assertEqual(variable_references(command),
+                         ['CFLAGS', 'name + ".o"', 'src.path'])
+
+    def test_expand(self):
+        class Source:
+            path = 'calc.c'
+        global_ns = {'CFLAGS' : '-O2', 'name' : 'calc'}
+        local_ns = {'src' : Source(), 'name' : 'local'}
+        self.assertEqual(
+            expand_variables('gcc $CFLAGS -o ${name + ".o"} $src.path $$HOME',
+                             global_ns, local_ns),
+            'gcc -O2 -o local.o calc.c $HOME')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+Tests of the trusted fingerprints of :mod:`ipymake.fingerprint`, as
+used by the build server.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from ipymake.fingerprint import FingerprintStore
+
+
+class TrustedFingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.watched = os.path.join(self.workdir, 'workspace')
+        self.other = os.path.join(self.workdir, 'workspace-other')
+        os.mkdir(self.watched)
+        os.mkdir(self.other)
+        self.store = FingerprintStore({})
+        self.store.trust_cache([self.watched])
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def write(self, path, text):
+        outfile = open(path, 'w')
+        try:
+            outfile.write(text)
+        finally:
+            outfile.close()
+
+    def test_only_watched_files_are_trusted(self):
+        watched = os.path.join(self.watched, 'a.h')
+        other = os.path.join(self.other, 'a.h')
+        for path in (watched, other):
+            self.write(path, 'one')
+        digests = [self.store.digest(path) for path in (watched, other)]
+
+        for path in (watched, other):
+            self.write(path, 'other')
+        # Until it is reported changed, the watched file is not looked at.
+        self.assertEqual(self.store.digest(watched), digests[0])
+        self.assertNotEqual(self.store.digest(other), digests[1])
+
+        self.store.invalidate(watched)
+        self.assertNotEqual(self.store.digest(watched), digests[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
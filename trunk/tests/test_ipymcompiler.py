@@ -0,0 +1,225 @@
+"""
+Tests of the compile manifest, the cached lexer and the token sorting
+of :mod:`ipymake.ipymcompiler`.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import ply.lex as lex
+from ipymake import ipymcompiler
+
+BUILD_FILE = '''
+generate:
+    ipymake_test_generator --output gen.c
+    pass
+'''
+
+
+class CommandsManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olddir = os.getcwd()
+        self.oldpath = os.environ.get('PATH', '')
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        self.bindir = os.path.join(self.workdir, 'bin')
+        os.mkdir(self.bindir)
+        os.environ['PATH'] = self.bindir + os.pathsep + self.oldpath
+        outfile = open('build.py', 'w')
+        try:
+            outfile.write(BUILD_FILE)
+        finally:
+            outfile.close()
+
+    def tearDown(self):
+        os.environ['PATH'] = self.oldpath
+        os.chdir(self.olddir)
+        shutil.rmtree(self.workdir)
+
+    def test_command_added_to_path(self):
+        ipymcompiler.ipym_compile('build.py')
+        manifest = ipymcompiler.read_manifest('build.py')
+        self.assertTrue('ipymake_test_generator=0' in manifest['commands'].split())
+        self.assertFalse(ipymcompiler.needs_recompile('build.py'))
+
+        program = os.path.join(self.bindir, 'ipymake_test_generator')
+        outfile = open(program, 'w')
+        try:
+            outfile.write('#!/bin/sh\n')
+        finally:
+            outfile.close()
+        os.chmod(program, 0755)
+        self.assertTrue(ipymcompiler.needs_recompile('build.py'))
+
+        ipymcompiler.ipym_compile('build.py')
+        manifest = ipymcompiler.read_manifest('build.py')
+        self.assertTrue('ipymake_test_generator=1' in manifest['commands'].split())
+        self.assertTrue('shell_command' in open(ipymcompiler.format_outpath('build.py')).read())
+
+    def write_program(self, name):
+        program = os.path.join(self.bindir, name)
+        outfile = open(program, 'w')
+        try:
+            outfile.write('#!/bin/sh\n')
+        finally:
+            outfile.close()
+        os.chmod(program, 0755)
+        return program
+
+    def test_no_path_walk(self):
+        ipymcompiler.ipym_compile('build.py')
+        find_command = ipymcompiler.translator.find_command
+        looked_up = []
+        def record_lookup(word):
+            looked_up.append(word)
+            return find_command(word)
+        ipymcompiler.translator.find_command = record_lookup
+        try:
+            self.assertFalse(ipymcompiler.needs_recompile('build.py'))
+            self.assertEqual(looked_up, [])
+            # Another program in a directory of the PATH.
+            self.write_program('ipymake_test_other')
+            self.assertFalse(ipymcompiler.needs_recompile('build.py'))
+            self.assertEqual(looked_up, ['ipymake_test_generator'])
+        finally:
+            ipymcompiler.translator.find_command = find_command
+
+    def test_program_removed(self):
+        program = self.write_program('ipymake_test_generator')
+        ipymcompiler.ipym_compile('build.py')
+        manifest = ipymcompiler.read_manifest('build.py')
+        self.assertEqual(manifest['command_paths'], program)
+        self.assertFalse(ipymcompiler.needs_recompile('build.py'))
+        os.remove(program)
+        self.assertTrue(ipymcompiler.needs_recompile('build.py'))
+
+    def test_path_changed(self):
+        ipymcompiler.ipym_compile('build.py')
+        os.environ['PATH'] = self.oldpath
+        self.assertTrue(ipymcompiler.needs_recompile('build.py'))
+
+
+TOKENS_BUILD_FILE = '''
+import os
+CFLAGS = '-O2'
+
+# the first target
+calc: objects lib
+    ~gcc $CFLAGS -o calc calc.o
+    pass
+
+%.o: %.c
+    ~gcc -c $input -o $output
+    pass
+
+SOURCES = ['calc.c']
+lib :
+    print SOURCES
+    pass
+'''
+
+UNFINISHED_BUILD_FILE = '''
+broken:
+    print 'no pass'
+'''
+
+
+def token_values(tokens):
+    return [(t.type, t.value, t.lineno) for t in tokens]
+
+
+def old_targets(token_list):
+    """
+    The targets of *token_list*, drained from the front of the list
+    as the parser did before it sorted the tokens in one pass.
+    """
+    t_list = list(token_list)
+    targets = []
+    while t_list:
+        token = t_list.pop(0)
+        if token.type == 'TARGET_START':
+            target_tokens = [token]
+            while t_list and not token.type == 'TARGET_END':
+                token = t_list.pop(0)
+                target_tokens.append(token)
+            targets.append(target_tokens)
+    return targets
+
+
+class LexerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def write(self, text):
+        filename = os.path.join(self.workdir, 'build.py')
+        outfile = open(filename, 'w')
+        try:
+            outfile.write(text)
+        finally:
+            outfile.close()
+        return filename
+
+    def tokenize(self, text, build_lexer):
+        build_lexer.reset(text)
+        return token_values(iter(build_lexer.lexer.token, None))
+
+    def test_built_once(self):
+        self.assertTrue(ipymcompiler.get_lexer() is ipymcompiler.get_lexer())
+
+    def test_cached_tables(self):
+        validated = ipymcompiler.BuildLanguageLexer()
+        validated.build(optimize=0, errorlog=lex.NullLogger())
+        cached = ipymcompiler.get_lexer()
+        self.assertEqual(self.tokenize(TOKENS_BUILD_FILE, cached),
+                         self.tokenize(TOKENS_BUILD_FILE, validated))
+        lextab = os.path.join(os.path.dirname(ipymcompiler.__file__),
+                              'ipym_lextab_%s.py' % cached.signature())
+        if os.access(os.path.dirname(lextab), os.W_OK):
+            self.assertTrue(os.path.exists(lextab))
+
+    def test_signature_of_the_rules(self):
+        class ChangedLexer(ipymcompiler.BuildLanguageLexer):
+            def t_COMMENT(self, t):
+                r'\#[^\n]*'
+                pass
+        signature = ipymcompiler.BuildLanguageLexer().signature()
+        self.assertEqual(ipymcompiler.BuildLanguageLexer().signature(), signature)
+        self.assertNotEqual(ChangedLexer().signature(), signature)
+
+    def test_reused_lexer(self):
+        # A file that ends in a target leaves the lexer in the target
+        # state, the next file starts from the beginning all the same.
+        build_lexer = ipymcompiler.get_lexer()
+        before = self.tokenize(TOKENS_BUILD_FILE, build_lexer)
+        self.tokenize(UNFINISHED_BUILD_FILE, build_lexer)
+        self.assertEqual(self.tokenize(TOKENS_BUILD_FILE, build_lexer), before)
+
+    def test_sorted_tokens(self):
+        parser = ipymcompiler.BuildLanguageParser(self.write(TOKENS_BUILD_FILE))
+        tokens = parser.token_list
+        self.assertEqual([t.value for t in parser.imports], ['import os'])
+        self.assertEqual(token_values(parser.global_vars),
+                         token_values([t for t in tokens if t.type == 'GLOBAL_VAR']))
+        self.assertEqual(len(parser.global_vars), 2)
+        self.assertEqual([token_values(target) for target in parser.targets],
+                         [token_values(target) for target in old_targets(tokens)])
+        self.assertEqual([target[0].value for target in parser.targets],
+                         ['calc:', 'lib:'])
+        self.assertEqual(len(parser.patterns), 1)
+        self.assertEqual(parser.patterns[0][-1].type, 'TARGET_END')
+
+    def test_unfinished_target(self):
+        parser = ipymcompiler.BuildLanguageParser(self.write(UNFINISHED_BUILD_FILE))
+        self.assertEqual([token_values(target) for target in parser.targets],
+                         [token_values(target) for target in
+                          old_targets(parser.token_list)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Tests of the object file cache of :mod:`ipymake.objectcache` shared by
+two workspaces of the same tree.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from ipymake.objectcache import ObjectCache
+from ipymake.sourcefiles import depfile_name, depfile_flags, parse_depfile
+from ipymake.executor import execute
+
+
+class WorkspacesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.workdir, 'cache')
+        self.workspaces = [os.path.join(self.workdir, name) for name in ('one', 'two')]
+        for workspace in self.workspaces:
+            os.makedirs(os.path.join(workspace, 'include'))
+            os.makedirs(os.path.join(workspace, 'build'))
+            self.write(os.path.join(workspace, 'include', 'a.h'), '#define A 1\n')
+            self.write(os.path.join(workspace, 'a.c'),
+                       '#include "a.h"\nint a(void) { return A; }\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def write(self, path, text):
+        outfile = open(path, 'w')
+        try:
+            outfile.write(text)
+        finally:
+            outfile.close()
+
+    def command(self, workspace):
+        """
+        The compile command of a.c in *workspace*, as the build runs it:
+        absolute include directories and sources.
+        """
+        return 'gcc -c -O2 -I%s' % os.path.join(workspace, 'include'), \
+            os.path.join(workspace, 'a.c')
+
+    def key(self, workspace):
+        base_command, source = self.command(workspace)
+        return ObjectCache(self.cache_dir, root=workspace).key('gcc', base_command, source)
+
+    def test_workspaces_share_keys(self):
+        keys = [self.key(workspace) for workspace in self.workspaces]
+        self.assertNotEqual(keys[0], None)
+        self.assertEqual(keys[0], keys[1])
+
+    def test_header_change_changes_key(self):
+        key = self.key(self.workspaces[1])
+        self.write(os.path.join(self.workspaces[1], 'include', 'a.h'), '#define A 2\n')
+        self.assertNotEqual(self.key(self.workspaces[1]), key)
+
+    def test_depfile_names_the_workspace(self):
+        first, second = self.workspaces
+        base_command, source = self.command(first)
+        objfile = os.path.join(first, 'build', 'a.o')
+        execute('%s %s %s -o %s' % (base_command, depfile_flags(objfile), source, objfile))
+        cache = ObjectCache(self.cache_dir, root=first)
+        key = cache.key('gcc', base_command, source)
+        cache.store(key, objfile, depfile_name(objfile))
+
+        objfile = os.path.join(second, 'build', 'a.o')
+        cache = ObjectCache(self.cache_dir, root=second)
+        self.assertTrue(cache.fetch(key, objfile, depfile_name(objfile)))
+        prereqs = parse_depfile(depfile_name(objfile))
+        self.assertEqual(prereqs, [os.path.join(second, 'a.c'),
+                                   os.path.join(second, 'include', 'a.h')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Tests of the per build file pattern rules of :mod:`ipymake.patterns`.
+"""
+import unittest
+
+from ipymake.patterns import find_pattern_rule, reset_pattern_rules
+
+
+BUILD_FILE = """
+from ipymake.patterns import pattern_rule, calling_rules, find_pattern_rule
+
+pattern_rule('%%_gen.c', '%%.txt', %r)
+
+def rule_for(source):
+    return find_pattern_rule(source, calling_rules())
+
+def init_hook(**kwargs):
+    pass
+"""
+
+
+def load_build_file(command):
+    namespace = {'__name__' : 'ipym_test'}
+    exec BUILD_FILE % command in namespace
+    return namespace
+
+
+class PatternRuleTest(unittest.TestCase):
+
+    def test_rules_of_each_build_file(self):
+        first = load_build_file('cp $input $output')
+        second = load_build_file('sed s/a/b/ $input > $output')
+        self.assertEqual(first['rule_for']('table.txt').arguments['command'],
+                         'cp $input $output')
+        self.assertEqual(second['rule_for']('table.txt').arguments['command'],
+                         'sed s/a/b/ $input > $output')
+
+    def test_builtin_rules(self):
+        build_file = load_build_file('cp $input $output')
+        self.assertEqual(build_file['rule_for']('calc.y').output_for('calc.y'),
+                         'calc.c')
+        self.assertEqual(find_pattern_rule('table.txt'), None)
+
+    def test_reset(self):
+        build_file = load_build_file('cp $input $output')
+        reset_pattern_rules(build_file)
+        self.assertEqual(build_file['rule_for']('table.txt'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+Tests of the build spans and the critical path of :mod:`ipymake.profiler`.
+"""
+import os
+import json
+import random
+import shutil
+import tempfile
+import unittest
+
+from ipymake.profiler import Tracer, TARGET, COMPILE
+
+
+def add_target(tracer, name, seconds, dependencies=()):
+    span = tracer.start(TARGET, name, dependencies=list(dependencies))
+    span.start_time = tracer.epoch
+    tracer.record(span, tracer.epoch + seconds)
+
+
+def longest_path(durations, dependencies):
+    """
+    The length of the longest chain of targets, by trying every chain.
+    """
+    def paths(name):
+        deps = [dep for dep in dependencies.get(name, [])
+                if durations.has_key(dep)]
+        if not deps:
+            return [[name]]
+        result = []
+        for dep in deps:
+            result.extend([path + [name] for path in paths(dep)])
+        return result
+    best = 0.0
+    for name in durations.keys():
+        for path in paths(name):
+            best = max(best, sum([durations[step] for step in path]))
+    return best
+
+
+class CriticalPathTest(unittest.TestCase):
+
+    def test_diamond(self):
+        # all -> (lib, docs), lib -> (a.o, b.o)
+        tracer = Tracer()
+        add_target(tracer, 'a_o', 2.0)
+        add_target(tracer, 'b_o', 5.0)
+        add_target(tracer, 'lib', 1.0, ['a_o', 'b_o'])
+        add_target(tracer, 'docs', 7.0)
+        add_target(tracer, 'all', 0.5, ['lib', 'docs'])
+        seconds, path = tracer.critical_path()
+        self.assertAlmostEqual(seconds, 7.5)
+        self.assertEqual(path, ['docs', 'all'])
+
+        add_target(tracer, 'b_o', 2.0)
+        seconds, path = tracer.critical_path()
+        self.assertAlmostEqual(seconds, 8.5)
+        self.assertEqual(path, ['b_o', 'lib', 'all'])
+
+    def test_up_to_date(self):
+        # Targets without a span cost nothing and are not on the path.
+        tracer = Tracer()
+        add_target(tracer, 'lib', 1.0, ['a_o', 'b_o'])
+        add_target(tracer, 'all', 0.5, ['lib', 'docs'])
+        seconds, path = tracer.critical_path()
+        self.assertAlmostEqual(seconds, 1.5)
+        self.assertEqual(path[-2:], ['lib', 'all'])
+        self.assertEqual(Tracer().critical_path(), (0.0, []))
+
+    def test_cycle(self):
+        tracer = Tracer()
+        add_target(tracer, 'a', 1.0, ['b'])
+        add_target(tracer, 'b', 2.0, ['a'])
+        seconds, path = tracer.critical_path()
+        self.assertAlmostEqual(seconds, 3.0)
+        self.assertEqual(sorted(path), ['a', 'b'])
+
+    def test_random_graphs(self):
+        rand = random.Random(18)
+        for graph in range(30):
+            tracer = Tracer()
+            durations = {}
+            dependencies = {}
+            names = []
+            for index in range(rand.randrange(1, 12)):
+                name = 't%d' % index
+                durations[name] = rand.randrange(1, 100) / 10.0
+                dependencies[name] = rand.sample(names,
+                                                 min(index, rand.randrange(3)))
+                names.append(name)
+                add_target(tracer, name, durations[name], dependencies[name])
+            seconds, path = tracer.critical_path()
+            # The spans keep whole microseconds.
+            self.assertAlmostEqual(seconds, longest_path(durations, dependencies), 4)
+            self.assertAlmostEqual(seconds, sum([durations[name] for name in path]), 4)
+            for dep, name in zip(path, path[1:]):
+                self.assertTrue(dep in dependencies[name])
+
+    def test_worker_spans(self):
+        worker = Tracer()
+        mark = worker.mark()
+        add_target(worker, 'lib', 3.0)
+        tracer = Tracer()
+        add_target(tracer, 'all', 1.0, ['lib'])
+        tracer.extend(worker.events_since(mark))
+        self.assertEqual(tracer.critical_path()[1], ['lib', 'all'])
+
+
+class SummaryTest(unittest.TestCase):
+
+    def test_summary(self):
+        tracer = Tracer()
+        add_target(tracer, 'lib', 1.0)
+        add_target(tracer, 'all', 0.5, ['lib'])
+        span = tracer.start(COMPILE, 'calc.c', command='gcc -c calc.c')
+        span.finish(exit_value=0)
+        lines = tracer.summary()
+        self.assertEqual(lines[0], 'Slowest targets:')
+        self.assertTrue(lines[1].endswith('lib'), lines)
+        self.assertTrue('Slowest compile units:' in lines)
+        self.assertEqual(lines[-3:], ['Critical path (1.500s):', '  lib', '  all'])
+
+    def test_write(self):
+        tracer = Tracer()
+        add_target(tracer, 'all', 0.5)
+        workdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(workdir, 'trace.json')
+            tracer.write(filename)
+            infile = open(filename)
+            try:
+                trace = json.load(infile)
+            finally:
+                infile.close()
+        finally:
+            shutil.rmtree(workdir)
+        self.assertEqual(len(trace['traceEvents']), 1)
+        self.assertEqual(trace['traceEvents'][0]['dur'], 500000)
+        self.assertEqual(trace['traceEvents'][0]['ph'], 'X')
+
+
+if __name__ == '__main__':
+    unittest.main()
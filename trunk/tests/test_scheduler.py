@@ -0,0 +1,401 @@
+"""
+Tests of the signatures of the memoized targets of
+:mod:`ipymake.scheduler`, and of the scheduler building them.
+"""
+import os
+import sys
+import time
+import signal
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from ipymake import workerpool
+from ipymake.environment import Environment
+from ipymake.executor import BuildError, execute
+from ipymake.fingerprint import FingerprintStore
+from ipymake.objectcache import ObjectCache
+from ipymake.scheduler import Scheduler, TargetNode, count, code_signature
+from ipymake.workerpool import JobServer, WorkerPool, Job
+
+BUILD_FILE = '''
+import os
+CFLAGS = '-O2'
+SOURCES = ['a.c']
+def compile_shell():
+    shell_command('gcc $CFLAGS -c a.c', globals())
+def compile_python():
+    execute_critical_command('gcc %s -c %s' % (CFLAGS, ' '.join(SOURCES)))
+def compile_expression():
+    shell_command('gcc ${CFLAGS + " -g"} -c a.c', globals())
+'''
+
+
+class SignatureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.namespace = {}
+        exec BUILD_FILE in self.namespace
+        self.scheduler = Scheduler(None, fingerprints=FingerprintStore({}))
+
+    def signature(self, name):
+        target = self.namespace[name]
+        target.ipym_outputs = ['a.o']
+        return self.scheduler.signature(TargetNode(target))
+
+    def assertChangedBy(self, name, variable, value):
+        before = self.signature(name)
+        self.assertEqual(self.signature(name), before)
+        self.namespace[variable] = value
+        self.assertNotEqual(self.signature(name), before)
+
+    def test_shell_variable(self):
+        self.assertChangedBy('compile_shell', 'CFLAGS', '-O0')
+
+    def test_python_variable(self):
+        self.assertChangedBy('compile_python', 'SOURCES', ['a.c', 'b.c'])
+
+    def test_expression(self):
+        self.assertChangedBy('compile_expression', 'CFLAGS', '-O0')
+
+    def test_other_variables(self):
+        before = self.signature('compile_shell')
+        self.namespace['SOURCES'] = ['b.c']
+        self.namespace['os'] = None
+        self.assertEqual(self.signature('compile_shell'), before)
+
+
+class Recorder:
+    """
+    Stands in for the socket of a build server client.
+    """
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def make_target(name, dependencies=[]):
+    def target(**kwargs):
+        for i in range(50):
+            print '%s line %d' % (name, i)
+    target.__name__ = name
+    target.ipym_dependencies = dependencies
+    return target
+
+
+class ParallelOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olddir = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        self.env = Environment(load_from_cache=False, jobs=3)
+
+    def tearDown(self):
+        os.chdir(self.olddir)
+        shutil.rmtree(self.workdir)
+
+    def test_worker_output_reaches_the_build_output(self):
+        root = make_target('root', [make_target('first'), make_target('second')])
+        recorder = Recorder()
+        stdout = sys.stdout
+        sys.stdout = recorder
+        try:
+            Scheduler(self.env).build(root)
+        finally:
+            sys.stdout = stdout
+        output = ''.join(recorder.writes)
+        # The worker output comes a line at a time, the requested
+        # target runs in the build itself.
+        for write in recorder.writes:
+            if not write.startswith('root'):
+                self.assertTrue(write.endswith('\n'), repr(write))
+        for name in ('first', 'second', 'root'):
+            lines = [line for line in output.splitlines() if line.startswith(name)]
+            self.assertEqual(lines, ['%s line %d' % (name, i) for i in range(50)])
+
+
+def record_work(name):
+    """
+    Work for a while, and record when in the file *name*.
+    """
+    start_time = time.time()
+    time.sleep(0.2)
+    outfile = open(name, 'w')
+    outfile.write('%r %r\n' % (start_time, time.time()))
+    outfile.close()
+
+def most_at_once(names):
+    """
+    The most of the work recorded in *names* done at the same time.
+    """
+    times = []
+    for name in names:
+        start_time, end_time = map(float, open(name).read().split())
+        times.append((start_time, 1))
+        times.append((end_time, -1))
+    times.sort()
+    running = most = 0
+    for when, change in times:
+        running += change
+        most = max(most, running)
+    return most
+
+def make_job_target(name, jobs):
+    """
+    A target that works on its own, or that runs *jobs* jobs in a
+    pool of two.
+    """
+    def target(**kwargs):
+        if not jobs:
+            record_work(name)
+            return
+        WorkerPool(2).run([Job(i, record_work, '%s%d' % (name, i))
+                           for i in range(jobs)])
+    target.__name__ = name
+    target.ipym_dependencies = []
+    return target
+
+def make_failing_target(name, command):
+    def target(**kwargs):
+        execute(command, name, stream=False)
+    target.__name__ = name
+    target.ipym_dependencies = []
+    return target
+
+def make_dying_target(name):
+    def target(**kwargs):
+        server = workerpool.get_job_server()
+        server.acquire()
+        server.acquire()
+        os.kill(os.getpid(), signal.SIGKILL)
+    target.__name__ = name
+    target.ipym_dependencies = []
+    return target
+
+
+class JobSlotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olddir = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        self.env = Environment(load_from_cache=False, jobs=2)
+        self.server = JobServer(2)
+        workerpool.set_job_server(self.server)
+
+    def tearDown(self):
+        workerpool.set_job_server(None)
+        self.server.close()
+        os.chdir(self.olddir)
+        shutil.rmtree(self.workdir)
+
+    def free_slots(self):
+        slots = 0
+        while self.server.try_acquire():
+            slots += 1
+        self.server.return_tokens(slots)
+        return slots
+
+    def build(self, dependencies):
+        root = make_target('root', dependencies)
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            Scheduler(self.env).build(root)
+        finally:
+            sys.stdout = stdout
+
+    def test_worker_holds_a_slot(self):
+        # One target working on its own, one running four jobs.
+        self.build([make_job_target('alone', 0), make_job_target('pool', 4)])
+        self.assertEqual(most_at_once(['alone', 'pool0', 'pool1', 'pool2', 'pool3']), 2)
+        self.assertEqual(self.free_slots(), 2)
+
+    def test_dead_worker_slots(self):
+        self.assertRaises(BuildError, self.build, [make_dying_target('dies')])
+        self.assertEqual(self.free_slots(), 2)
+
+    def test_failed_command(self):
+        try:
+            self.build([make_failing_target('fails', 'echo broken; exit 2')])
+        except BuildError, error:
+            self.assertTrue('Target %s.fails failed' % __name__ in str(error), str(error))
+            self.assertEqual(error.output, ['broken'])
+            self.assertEqual(error.result.exit_value, 2)
+        else:
+            self.fail('no BuildError raised')
+        self.assertEqual(self.free_slots(), 2)
+
+
+def make_counting_target(name, dependencies=[]):
+    def target(**kwargs):
+        count('object_cache_hits')
+    target.__name__ = name
+    target.ipym_dependencies = dependencies
+    return target
+
+
+class BuildCountersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olddir = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        self.cache = ObjectCache(os.path.join(self.workdir, 'cache'))
+
+    def tearDown(self):
+        os.chdir(self.olddir)
+        shutil.rmtree(self.workdir)
+
+    def build_twice(self, jobs):
+        summaries = []
+        for i in range(2):
+            env = Environment(load_from_cache=False, jobs=jobs)
+            root = make_counting_target('root', [make_counting_target('first'),
+                                                 make_counting_target('second')])
+            Scheduler(env).build(root)
+            summaries.append(self.cache.summary())
+        return summaries
+
+    def test_serial_builds(self):
+        for summary in self.build_twice(1):
+            self.assertTrue(summary.startswith('3 hits, 0 misses'), summary)
+
+    def test_parallel_builds(self):
+        for summary in self.build_twice(3):
+            self.assertTrue(summary.startswith('3 hits, 0 misses'), summary)
+
+
+class CodeSignatureTest(unittest.TestCase):
+
+    def signature(self, source):
+        return code_signature(compile(source, 'build.py', 'exec'))
+
+    def test_line_numbers_left_out(self):
+        source = 'def target():\n    return "gcc -c a.c"\n'
+        self.assertEqual(self.signature(source),
+                         self.signature('\n\n# moved down\n' + source))
+
+    def test_code_changes(self):
+        signature = self.signature('def target():\n    return "gcc -c a.c"\n')
+        self.assertNotEqual(self.signature('def target():\n    return "gcc -c b.c"\n'),
+                            signature)
+        self.assertNotEqual(self.signature('def target():\n    return gcc("-c a.c")\n'),
+                            signature)
+
+
+COPY_TARGET = '''
+def copy(**kwargs):
+    log_run('copy')
+    infile = open('in.txt')
+    outfile = open('out.txt', 'w')
+    outfile.write(infile.read()%s)
+    outfile.close()
+    infile.close()
+'''
+
+
+def make_copy_target(runs, suffix=''):
+    """
+    Make the target function of :data:`COPY_TARGET`, with the code
+    to add *suffix* to what it copies.
+    """
+    # Not the list itself, the values of globals are part of the signature.
+    namespace = {'__name__' : __name__, 'log_run' : runs.append}
+    if suffix:
+        exec COPY_TARGET % (' + %r' % suffix) in namespace
+    else:
+        exec COPY_TARGET % '' in namespace
+    copy = namespace['copy']
+    copy.ipym_inputs = ['in.txt']
+    copy.ipym_outputs = ['out.txt']
+    return copy
+
+
+class MemoizedTargetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olddir = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        self.write('in.txt', 'first')
+        self.env = Environment(load_from_cache=False, jobs=1)
+        self.runs = []
+
+    def tearDown(self):
+        os.chdir(self.olddir)
+        shutil.rmtree(self.workdir)
+
+    def write(self, filename, text, age=0):
+        outfile = open(filename, 'w')
+        try:
+            outfile.write(text)
+        finally:
+            outfile.close()
+        mod_time = 1000000000 + age
+        os.utime(filename, (mod_time, mod_time))
+
+    def build(self, target):
+        """
+        Build *target* in a build of its own, and get whether it ran.
+        """
+        self.env.built_targets = {}
+        runs = len(self.runs)
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            Scheduler(self.env).build(target)
+        finally:
+            sys.stdout = stdout
+        return len(self.runs) > runs
+
+    def test_skipped_when_unchanged(self):
+        target = make_copy_target(self.runs)
+        self.assertTrue(self.build(target))
+        self.assertFalse(self.build(target))
+        self.assertTrue(self.env.target_signatures.has_key(
+            TargetNode(target).key))
+
+    def test_input_changed(self):
+        target = make_copy_target(self.runs)
+        self.build(target)
+        self.write('in.txt', 'second', age=10)
+        self.assertTrue(self.build(target))
+        self.assertEqual(open('out.txt').read(), 'second')
+        self.assertFalse(self.build(target))
+
+    def test_input_touched(self):
+        target = make_copy_target(self.runs)
+        self.build(target)
+        self.write('in.txt', 'first', age=10)
+        self.assertFalse(self.build(target))
+
+    def test_output_removed(self):
+        target = make_copy_target(self.runs)
+        self.build(target)
+        os.remove('out.txt')
+        self.assertTrue(self.build(target))
+        self.assertTrue(os.path.exists('out.txt'))
+
+    def test_code_changed(self):
+        self.build(make_copy_target(self.runs))
+        changed = make_copy_target(self.runs, suffix='!')
+        self.assertEqual(TargetNode(changed).key,
+                         TargetNode(make_copy_target(self.runs)).key)
+        self.assertFalse(self.build(make_copy_target(self.runs)))
+        self.assertTrue(self.build(changed))
+        self.assertEqual(open('out.txt').read(), 'first!')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Tests of the names :class:`ipymake.shell.LazyShell` shares with the
+build file that runs lines in it.
+"""
+import unittest
+
+from ipymake.shell import LazyShell
+
+
+class RecordingAPI:
+    """
+    Runs the lines as plain Python in its user namespace, the way
+    IPython does once the shell escapes are translated.
+    """
+    def __init__(self):
+        self.user_ns = {'In' : [], '_' : None}
+
+    def runlines(self, lines):
+        exec lines in self.user_ns
+        self.user_ns['_'] = lines
+        self.user_ns['In'].append(lines)
+
+
+def make_shell():
+    shell = LazyShell()
+    shell._ip = RecordingAPI()
+    return shell
+
+
+BUILD_FILE = """
+name = 'calc'
+
+def target():
+    local = 1
+    ip.runlines('found = name.upper()')
+    ip.runlines('local = 2')
+    return local
+
+def remove():
+    ip.runlines('del name')
+"""
+
+
+class WriteBackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.namespace = {'ip' : make_shell()}
+        exec BUILD_FILE in self.namespace
+
+    def test_bound_names(self):
+        self.assertEqual(self.namespace['target'](), 1)
+        self.assertEqual(self.namespace['found'], 'CALC')
+        self.failIf(self.namespace.has_key('local'))
+        self.failIf(self.namespace.has_key('In'))
+        self.failIf(self.namespace.has_key('_'))
+
+    def test_deleted_names(self):
+        self.namespace['remove']()
+        self.failIf(self.namespace.has_key('name'))
+
+
+FIRST_BUILD_FILE = """
+NAME = 'first'
+ONLY_FIRST = 1
+
+def target():
+    ip.runlines('seen = NAME')
+"""
+
+SECOND_BUILD_FILE = """
+NAME = 'second'
+
+def target():
+    ip.runlines('seen = NAME')
+    ip.runlines('leaked = [name for name in dir() if name.endswith("FIRST")]')
+"""
+
+
+class NamespaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shell = make_shell()
+        self.first = {'ip' : self.shell}
+        self.second = {'ip' : self.shell}
+        exec FIRST_BUILD_FILE in self.first
+        exec SECOND_BUILD_FILE in self.second
+
+    def test_same_name(self):
+        self.first['target']()
+        self.second['target']()
+        self.first['target']()
+        self.assertEqual(self.first['seen'], 'first')
+        self.assertEqual(self.second['seen'], 'second')
+        self.assertEqual(self.second['leaked'], [])
+        self.failIf(self.second.has_key('ONLY_FIRST'))
+
+    def test_user_ns_restored(self):
+        user_ns = self.shell._ip.user_ns
+        self.first['target']()
+        self.assertTrue(self.shell._ip.user_ns is user_ns)
+        self.assertEqual(sorted(user_ns.keys()), ['In', '_'])
+        self.assertEqual(user_ns['In'], ['seen = NAME'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+"""
+Tests of the object file and binary staleness checks of
+:mod:`ipymake.runtimecore`, with binaries that share their sources.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from ipymake import runtimecore
+
+
+class BinaryStalenessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olddir = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        self.write('a.h', '#define A 1\n')
+        self.write('a.c', '#include "a.h"\nint a(void) { return A; }\n')
+        self.write('m.c', 'int a(void);\nint main(void) { return a() - 1; }\n')
+        self.env = runtimecore.env
+        self.old_build_path = self.env.build_path
+        self.old_binaries = self.env.compiled_binaries
+        self.env.build_path = os.path.join(self.workdir, 'build')
+        self.env.compiled_binaries = []
+
+    def tearDown(self):
+        self.env.build_path = self.old_build_path
+        self.env.compiled_binaries = self.old_binaries
+        os.chdir(self.olddir)
+        shutil.rmtree(self.workdir)
+
+    def write(self, filename, text, age=0):
+        outfile = open(filename, 'w')
+        try:
+            outfile.write(text)
+        finally:
+            outfile.close()
+        # The timestamps are kept in seconds, move them apart.
+        mod_time = 1000000000 + age
+        os.utime(filename, (mod_time, mod_time))
+
+    def build(self, function, *args, **options):
+        """
+        Run the compile **function**, and get what it printed.
+        """
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            function(*args, **options)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def build_all(self):
+        return [self.build(runtimecore.compile_static_library, 'y', 'a.c'),
+                self.build(runtimecore.compile_shared_library, 'y', 'a.c',
+                           flags=['-fPIC']),
+                self.build(runtimecore.compile_executable, 'prog', 'a.c', 'm.c')]
+
+    def test_binaries_have_their_own_objects(self):
+        self.build_all()
+        objfiles = [runtimecore._object_file_name('a.c', name)
+                    for name in ('liby.a', 'liby.so', 'prog')]
+        self.assertEqual(len(set(objfiles)), 3)
+        for objfile in objfiles:
+            self.assertTrue(os.path.exists(objfile))
+
+    def test_header_change_rebuilds_every_binary(self):
+        self.build_all()
+        for output in self.build_all():
+            self.assertTrue('Up to Date' in output, output)
+
+        self.write('a.h', '#define A 2\n', age=10)
+        for output in self.build_all():
+            self.assertFalse('Up to Date' in output, output)
+        for output in self.build_all():
+            self.assertTrue('Up to Date' in output, output)
+
+    def test_header_changed_while_compiling(self):
+        self.build_all()
+        # The header was edited after the compiler read it, but before
+        # its timestamp was recorded.
+        objfile = runtimecore._object_file_name('a.c', 'prog')
+        mod_time = os.stat(objfile).st_mtime + 10
+        os.utime('a.h', (mod_time, mod_time))
+        self.env.object_dependencies[objfile] = [runtimecore.SourceFile(
+                os.path.abspath('a.h'))]
+        output = self.build(runtimecore.compile_executable, 'prog', 'a.c', 'm.c')
+        self.assertTrue('Built Executable' in output, output)
+
+    def test_source_changed_while_compiling(self):
+        self.build_all()
+        compile_object_files = runtimecore._compile_object_files
+        def edit_while_compiling(*args, **kwargs):
+            result = compile_object_files(*args, **kwargs)
+            self.write('m.c', 'int a(void);\nint main(void) { return a(); }\n',
+                       age=10)
+            return result
+        self.write('m.c', 'int a(void);\nint main(void) { return a() - 2; }\n',
+                   age=5)
+        runtimecore._compile_object_files = edit_while_compiling
+        try:
+            self.build(runtimecore.compile_executable, 'prog', 'a.c', 'm.c')
+        finally:
+            runtimecore._compile_object_files = compile_object_files
+        # The edit came after the compiler read the source.
+        output = self.build(runtimecore.compile_executable, 'prog', 'a.c', 'm.c')
+        self.assertTrue('Built Executable' in output, output)
+        output = self.build(runtimecore.compile_executable, 'prog', 'a.c', 'm.c')
+        self.assertTrue('Up to Date' in output, output)
+
+    def test_newer_object_relinks(self):
+        self.build_all()
+        objfile = runtimecore._object_file_name('m.c', 'prog')
+        binpath = os.path.join(self.env.current_build_path, 'prog')
+        mod_time = os.stat(binpath).st_mtime + 10
+        os.utime(objfile, (mod_time, mod_time))
+        output = self.build(runtimecore.compile_executable, 'prog', 'a.c', 'm.c')
+        self.assertTrue('Built Executable' in output, output)
+
+    def test_objects_of_older_builds(self):
+        self.build_all()
+        # Built when all of the binaries shared build/<source>.o
+        old_binary = runtimecore._find_compiled_binary('prog')
+        for ofile in old_binary.sources:
+            os.rename(ofile.path, os.path.join(self.env.current_build_path,
+                                               os.path.basename(ofile.path)))
+            ofile._path = os.path.join(self.env.current_build_path,
+                                       os.path.basename(ofile.path))
+        output = self.build(runtimecore.compile_executable, 'prog', 'a.c', 'm.c')
+        self.assertTrue('Built Executable' in output, output)
+        for src in ('a.c', 'm.c'):
+            self.assertTrue(os.path.exists(runtimecore._object_file_name(src, 'prog')))
+
+    def test_archive_updates_newer_members(self):
+        self.build_all()
+        binpath = os.path.join(self.env.current_build_path, 'liby.a')
+        objfile = runtimecore._object_file_name('a.c', 'liby.a')
+        mod_time = os.stat(binpath).st_mtime + 10
+        os.utime(objfile, (mod_time, mod_time))
+        options = runtimecore._find_compiled_binary('liby.a').options
+        commands = runtimecore._archive_commands('liby.a', binpath, [objfile], [],
+                                                 options)
+        self.assertEqual(commands, ['ar rs %s %s' % (binpath, objfile)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+"""
+Tests of the build state database of :mod:`ipymake.environment`
+shared by builds running at the same time.
+"""
+import os
+import cPickle
+import shutil
+import tempfile
+import unittest
+
+from ipymake.environment import StateDB, Environment, merge_values
+
+
+class Record:
+    def __init__(self, name, value=0):
+        self.name = name
+        self.value = value
+
+
+def names(records):
+    return sorted([record.name for record in records])
+
+
+class StateDBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.workdir, 'state.db')
+        state = StateDB(self.filename)
+        state['compiled_binaries'] = [Record('libA')]
+        state['flags'] = {'a' : 1}
+        state.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_concurrent_appends(self):
+        first = StateDB(self.filename)
+        second = StateDB(self.filename)
+        first['compiled_binaries'] = first['compiled_binaries'] + [Record('libB')]
+        second['compiled_binaries'] = second['compiled_binaries'] + [Record('libC')]
+        first.sync()
+        second.sync()
+        self.assertEqual(names(second['compiled_binaries']), ['libA', 'libB', 'libC'])
+        self.assertEqual(names(StateDB(self.filename)['compiled_binaries']),
+                         ['libA', 'libB', 'libC'])
+
+    def test_concurrent_replace_and_remove(self):
+        first = StateDB(self.filename)
+        second = StateDB(self.filename)
+        first['compiled_binaries'] = [Record('libA', 1)]
+        second['compiled_binaries'] = filter(lambda record: record.name != 'libA',
+                                             second['compiled_binaries']) + [Record('libB')]
+        first.sync()
+        second.sync()
+        # libA was removed by the second build, after the first one
+        # rebuilt it.
+        self.assertEqual(names(StateDB(self.filename)['compiled_binaries']), ['libB'])
+
+    def test_concurrent_dictionaries(self):
+        first = StateDB(self.filename)
+        second = StateDB(self.filename)
+        first['flags'] = dict(first['flags'], b=2)
+        flags = dict(second['flags'], c=3)
+        del flags['a']
+        second['flags'] = flags
+        first.sync()
+        second.sync()
+        self.assertEqual(StateDB(self.filename)['flags'], {'b' : 2, 'c' : 3})
+
+    def test_concurrent_processes(self):
+        pids = []
+        for name in ('first', 'second'):
+            pid = os.fork()
+            if not pid:
+                status = 1
+                try:
+                    for i in range(20):
+                        state = StateDB(self.filename)
+                        state['compiled_binaries'] = state['compiled_binaries'] + \
+                            [Record('%s%d' % (name, i))]
+                        state.close()
+                    status = 0
+                finally:
+                    os._exit(status)
+            pids.append(pid)
+        for pid in pids:
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertEqual(len(StateDB(self.filename)['compiled_binaries']), 41)
+
+
+class RecordMapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olddir = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        env = Environment()
+        env.fingerprints['a.c'] = 1
+        env.fingerprints['b.c'] = 2
+        env.close()
+
+    def tearDown(self):
+        os.chdir(self.olddir)
+        shutil.rmtree(self.workdir)
+
+    def test_removed_records_sent_back(self):
+        env = Environment()
+        self.assertEqual(env.fingerprints['a.c'], 1)
+        # The worker process.
+        worker = Environment()
+        snapshot = worker.snapshot()
+        del worker.fingerprints['a.c']
+        worker.fingerprints['c.c'] = 3
+        changes = cPickle.loads(cPickle.dumps(worker.changes_since(snapshot), -1))
+
+        env.merge_changes(changes)
+        self.failIf(env.fingerprints.has_key('a.c'))
+        self.assertEqual(env.fingerprints['c.c'], 3)
+        env.close()
+        self.assertEqual(sorted(Environment().fingerprints.items()),
+                         [('b.c', 2), ('c.c', 3)])
+
+    def test_not_loaded_from_cache(self):
+        env = Environment(load_from_cache=False)
+        self.failIf(env.fingerprints.has_key('a.c'))
+        self.assertEqual(env.fingerprints.get('b.c'), None)
+        self.assertEqual(env.fingerprints.keys(), [])
+        env.fingerprints['c.c'] = 3
+        env.close()
+        self.assertEqual(Environment().fingerprints.items(), [('c.c', 3)])
+
+
+class MergeValuesTest(unittest.TestCase):
+
+    def test_other_values(self):
+        self.assertEqual(merge_values(1, 2, 3), 2)
+
+    def test_unnamed_items(self):
+        self.assertEqual(sorted(merge_values(['a', 'b'], ['b', 'c'], ['a', 'b', 'd'])),
+                         ['b', 'c', 'd'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Tests of the in-process sub builds of :func:`ipymake.runtimecore.load_subdir`
+and :func:`ipymake.runtimecore.build_subdir`.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from ipymake import ipymcompiler, runtimecore
+
+BUILD_FILE = '''
+NAME = %r
+LOADED_IN = os.getcwd()
+
+all:
+    outfile = open('name.txt', 'w')
+    outfile.write(NAME)
+    outfile.close()
+    pass
+'''
+
+
+class SubdirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olddir = os.getcwd()
+        self.workdir = os.path.realpath(tempfile.mkdtemp())
+        os.chdir(self.workdir)
+        for subdir in ('a', 'b'):
+            os.mkdir(subdir)
+            self.write_build_file(subdir, subdir)
+        self.env = runtimecore.env
+        self.old_filename = self.env.filename
+        self.env.filename = os.path.join(self.workdir, 'state.db')
+        self.env._conn = None
+
+    def tearDown(self):
+        self.env._conn = None
+        self.env.filename = self.old_filename
+        os.chdir(self.olddir)
+        shutil.rmtree(self.workdir)
+
+    def write_build_file(self, subdir, name, age=0):
+        filename = os.path.join(subdir, 'build.py')
+        outfile = open(filename, 'w')
+        try:
+            outfile.write(BUILD_FILE % name)
+        finally:
+            outfile.close()
+        mod_time = 1000000000 + age
+        os.utime(filename, (mod_time, mod_time))
+
+    def quietly(self, function, *args):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            return function(*args)
+        finally:
+            sys.stdout = stdout
+
+    def read(self, filename):
+        infile = open(filename)
+        try:
+            return infile.read()
+        finally:
+            infile.close()
+
+    def test_modules_of_their_own(self):
+        first = self.quietly(runtimecore.load_subdir, 'a', 'build.py')
+        second = self.quietly(runtimecore.load_subdir, 'b', 'build.py')
+        self.failIf(first is second)
+        self.assertNotEqual(first.__name__, second.__name__)
+        self.assertEqual(first.NAME, 'a')
+        self.assertEqual(second.NAME, 'b')
+        self.assertEqual(first.LOADED_IN, os.path.join(self.workdir, 'a'))
+        self.assertEqual(second.LOADED_IN, os.path.join(self.workdir, 'b'))
+        self.assertEqual(os.getcwd(), self.workdir)
+
+    def test_loaded_once(self):
+        first = self.quietly(runtimecore.load_subdir, 'a', 'build.py')
+        first.NAME = 'kept'
+        self.assertTrue(self.quietly(runtimecore.load_subdir, 'a', 'build.py')
+                        is first)
+        self.assertEqual(first.NAME, 'kept')
+
+    def test_changed_build_file(self):
+        first = self.quietly(runtimecore.load_subdir, 'a', 'build.py')
+        self.write_build_file('a', 'changed', age=10)
+        module = self.quietly(runtimecore.load_subdir, 'a', 'build.py')
+        self.assertEqual(module.NAME, 'changed')
+        self.assertEqual(self.quietly(runtimecore.load_subdir, 'b',
+                                      'build.py').NAME, 'b')
+
+    def test_build_subdir(self):
+        self.quietly(runtimecore.build_subdir, 'a', 'build.py')
+        self.quietly(runtimecore.build_subdir, 'b', 'build.py')
+        self.assertEqual(self.read(os.path.join('a', 'name.txt')), 'a')
+        self.assertEqual(self.read(os.path.join('b', 'name.txt')), 'b')
+        self.assertEqual(os.getcwd(), self.workdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Tests of the bundles of the unity builds of :mod:`ipymake.unity`.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from ipymake.unity import group_sources, write_bundle, unity_sources, \
+    bundle_filename
+
+SOURCES = ['src/%s.c' % name for name in
+           ('add', 'sub', 'mul', 'div', 'mod', 'pow', 'sqrt', 'log', 'exp',
+            'sin', 'cos', 'tan')]
+
+
+class GroupSourcesTest(unittest.TestCase):
+
+    def test_extensions_apart(self):
+        groups = group_sources(['a.c', 'b.cpp', 'c.c', 'd.cpp'], 1)
+        self.assertEqual(groups, {('.c', 0) : ['a.c', 'c.c'],
+                                  ('.cpp', 0) : ['b.cpp', 'd.cpp']})
+
+    def test_stable(self):
+        groups = group_sources(SOURCES, 4)
+        self.assertEqual(sorted(sum(groups.values(), [])), sorted(SOURCES))
+        self.assertTrue(len(groups) > 1)
+        # The same bundle for a source, whatever the order of the others.
+        reversed_sources = list(reversed(SOURCES))
+        self.assertEqual(dict([(key, sorted(members)) for key, members in
+                               group_sources(reversed_sources, 4).items()]),
+                         dict([(key, sorted(members)) for key, members in
+                               groups.items()]))
+        self.assertEqual(group_sources(['./src/add.c'], 4).keys(),
+                         group_sources(['src/add.c'], 4).keys())
+
+    def test_only_own_bundle_changes(self):
+        groups = group_sources(SOURCES, 4)
+        added = group_sources(SOURCES + ['src/atan.c'], 4)
+        removed = group_sources(SOURCES[1:], 4)
+        for changed, source in ((added, 'src/atan.c'), (removed, SOURCES[0])):
+            keys = [key for key in set(groups.keys() + changed.keys())
+                    if groups.get(key) != changed.get(key)]
+            self.assertEqual(len(keys), 1)
+            self.assertTrue(source in groups.get(keys[0], []) +
+                            changed.get(keys[0], []))
+
+
+class WriteBundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.olddir = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        os.mkdir('build')
+
+    def tearDown(self):
+        os.chdir(self.olddir)
+        shutil.rmtree(self.workdir)
+
+    def read(self, filename):
+        infile = open(filename)
+        try:
+            return infile.read()
+        finally:
+            infile.close()
+
+    def test_relative_includes(self):
+        self.assertTrue(write_bundle('build/unity_calc_0.c', SOURCES[:2]))
+        lines = self.read('build/unity_calc_0.c').splitlines()
+        self.assertEqual(lines[1:], ['#include "../src/add.c"',
+                                     '#include "../src/sub.c"'])
+
+    def test_timestamp_kept(self):
+        filename = 'build/unity_calc_0.c'
+        write_bundle(filename, SOURCES[:2])
+        os.utime(filename, (1000000000, 1000000000))
+        self.failIf(write_bundle(filename, SOURCES[:2]))
+        self.assertEqual(os.stat(filename).st_mtime, 1000000000)
+
+        self.assertTrue(write_bundle(filename, SOURCES[:3]))
+        self.assertNotEqual(os.stat(filename).st_mtime, 1000000000)
+        self.assertTrue('src/mul.c' in self.read(filename))
+
+    def test_unity_sources(self):
+        sources = SOURCES + ['src/main.cpp']
+        compiled = unity_sources('build', 'calc', sources, 3,
+                                 exclude=['./src/sqrt.c'])
+        self.assertEqual(compiled[-1], 'src/sqrt.c')
+        bundles = compiled[:-1]
+        self.assertEqual([filename for filename in bundles
+                          if filename.endswith('.cpp')],
+                         [bundle_filename('build', 'calc', '.cpp',
+                                          group_sources(['src/main.cpp'], 3).keys()[0][1])])
+        included = []
+        for filename in bundles:
+            self.assertTrue(os.path.basename(filename).startswith('unity_calc_'))
+            included.extend([line.split('"')[1] for line in
+                             self.read(filename).splitlines()[1:]])
+        self.assertEqual(sorted(included),
+                         sorted(['../' + source for source in sources
+                                 if source != 'src/sqrt.c']))
+
+        # Building again writes none of the bundles.
+        for filename in bundles:
+            os.utime(filename, (1000000000, 1000000000))
+        self.assertEqual(unity_sources('build', 'calc', sources, 3,
+                                       exclude=['./src/sqrt.c']), compiled)
+        for filename in bundles:
+            self.assertEqual(os.stat(filename).st_mtime, 1000000000)
+
+
+if __name__ == '__main__':
+    unittest.main()
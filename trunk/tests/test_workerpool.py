@@ -0,0 +1,89 @@
+"""
+Tests of the job slots shared by the worker pools of a build.
+"""
+import time
+import threading
+import unittest
+
+from ipymake import workerpool
+from ipymake.workerpool import WorkerPool, Job, JobServer
+
+
+class JobServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+
+    def tearDown(self):
+        server = workerpool.get_job_server()
+        workerpool.set_job_server(None)
+        if server is not None:
+            server.close()
+
+    def job(self):
+        self.lock.acquire()
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        self.lock.release()
+        time.sleep(0.02)
+        self.lock.acquire()
+        self.running -= 1
+        self.lock.release()
+
+    def run_pools(self, num_pools, num_workers):
+        def run_pool():
+            WorkerPool(num_workers).run([Job(i, self.job) for i in range(8)])
+        threads = [threading.Thread(target=run_pool) for i in range(num_pools)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_pools_share_the_job_slots(self):
+        workerpool.set_job_server(JobServer(3))
+        self.run_pools(3, 4)
+        self.assertEqual(self.most_running, 3)
+
+    def test_no_job_server(self):
+        self.run_pools(2, 4)
+        self.assertEqual(self.most_running, 8)
+
+    def test_failed_job_gives_its_slot_back(self):
+        server = JobServer(1)
+        workerpool.set_job_server(server)
+        def fail():
+            raise ValueError('failed')
+        jobs = WorkerPool(1).run([Job('fail', fail)])
+        self.assertTrue(jobs[0].failed)
+        WorkerPool(1).run([Job('next', self.job)])
+        self.assertEqual(self.most_running, 1)
+
+    def test_held_slot(self):
+        # A worker process forked with the last slot of the build.
+        server = JobServer(2)
+        server.acquire()
+        server.acquire()
+        self.failIf(server.try_acquire())
+        server.hold(1)
+        taken = []
+        server.on_change = taken.append
+        self.assertTrue(server.try_acquire())
+        self.failIf(server.try_acquire())
+        server.return_tokens(1)
+        self.assertTrue(server.try_acquire())
+        self.assertEqual(taken, [1])
+        # The held slot is free first, then the other goes back.
+        server.release()
+        self.assertEqual(taken, [1])
+        server.release()
+        self.assertEqual(taken, [1, 0])
+        self.assertTrue(server.try_acquire())
+        self.assertTrue(server.try_acquire())
+        self.failIf(server.try_acquire())
+        server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()